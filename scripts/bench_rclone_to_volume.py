@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# scripts/bench_rclone_to_volume.py
+#
+# Offline benchmark for the transfer strategies in rclone_to_volume.py.
+# Uses an rclone local-filesystem remote as the source and a temp directory in
+# place of the Modal volume, so listing, scheduling and copy code paths run
+# in-process without touching the cloud. Needs rclone on PATH and the modal
+# package installed (rclone_to_volume imports it).
+#
+# Example:
+#   python scripts/bench_rclone_to_volume.py --distributions tiny mixed --scale 0.2
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import rclone_to_volume as rtv  # noqa: E402
+
+BENCH_REMOTE = "bench"
+DEFAULT_OUTPUT_DIR = "bench_results"
+WRITE_BLOCK_SIZE = 1024 * 1024
+
+# (file count, min size, max size) ranges per synthetic distribution, before --scale
+DISTRIBUTIONS = {
+    "tiny": [(5000, 1024, 8 * 1024)],
+    "mixed": [(1000, 1024, 256 * 1024), (200, 1024**2, 16 * 1024**2), (20, 64 * 1024**2, 256 * 1024**2)],
+    "huge": [(3, 1024**3, 2 * 1024**3)],
+}
+STRATEGIES = ("per-file", "batched", "bulk")
+
+def generate_distribution(root: str, name: str, scale: float, seed: int) -> List[Dict]:
+    """Writes a synthetic file tree for a distribution and returns its entries."""
+    rng = random.Random(seed)
+    block = rng.randbytes(WRITE_BLOCK_SIZE)
+    entries = []
+    for group, (count, min_size, max_size) in enumerate(DISTRIBUTIONS[name]):
+        for i in range(max(1, int(count * scale))):
+            size = rng.randint(min_size, max_size)
+            path = f"group{group}/dir{i % 16}/file{i}.bin"
+            full_path = os.path.join(root, path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, "wb") as f:
+                remaining = size
+                while remaining > 0:
+                    f.write(block[:min(remaining, WRITE_BLOCK_SIZE)])
+                    remaining -= WRITE_BLOCK_SIZE
+            entries.append({"path": path, "size": size})
+    logging.info(f"Generated '{name}': {len(entries)} files, {sum(e['size'] for e in entries) / 1024**2:.1f} MB")
+    return entries
+
+class CommitCounter:
+    """Stands in for volume_storage.commit and counts how often it is called."""
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            self.count += 1
+
+def run_strategy(
+    strategy: str,
+    source_path: str,
+    dest_path: str,
+    manifest_dir: str,
+    workers: int,
+    commit_policy: Dict,
+    max_batch_files: int,
+    max_batch_bytes: int
+) -> Dict:
+    """Lists, schedules and copies the source with one strategy. Returns its metrics."""
+    counter = CommitCounter()
+    tracemalloc.start()
+    start = time.monotonic()
+
+    entries = list(rtv.iter_remote_entries(source_path, recursive=True))
+    listing_seconds = time.monotonic() - start
+
+    small_bytes = rtv.parse_size(rtv.DEFAULT_SMALL_FILE_THRESHOLD)
+    jobs = []
+    if strategy == "per-file":
+        # The original behaviour: one copy (and one commit) per file
+        jobs = [([entry], rtv.DEFAULT_TRANSFER_PROFILE, False, {"files": 1}) for entry in entries]
+    else:
+        small_file_mode = "bulk" if strategy == "bulk" else "per-file"
+        by_route: Dict[str, List[Dict]] = {}
+        for entry in entries:
+            by_route.setdefault(rtv.route_for(entry, small_file_mode, small_bytes), []).append(entry)
+        for profile in rtv.TRANSFER_PROFILES:
+            for batch in rtv.plan_batches(by_route.get(profile["name"], []), max_batch_bytes, max_batch_files):
+                jobs.append((batch, profile, False, commit_policy))
+        for batch in rtv.plan_batches(by_route.get("bulk", []), max_batch_bytes, rtv.DEFAULT_SMALL_FILE_GROUP_SIZE):
+            jobs.append((batch, rtv.TRANSFER_PROFILES[0], True, commit_policy))
+    scheduling_seconds = time.monotonic() - start - listing_seconds
+
+    def run_job(job) -> Dict:
+        batch, profile, bulk, policy = job
+        committer = rtv.VolumeCommitter(
+            counter,
+            every_files=policy.get("files", 0),
+            every_seconds=policy.get("seconds", 0),
+            every_bytes=policy.get("bytes", 0),
+            manifest_dir=manifest_dir
+        )
+        if bulk:
+            return rtv.copy_entries_bulk(batch, source_path, dest_path, committer, profile)
+        return rtv.copy_entries(batch, source_path, dest_path, committer, profile)
+
+    # Worker threads stand in for parallel containers
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(run_job, jobs))
+
+    duration = time.monotonic() - start
+    _, python_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    files = [f for result in results for f in result["files"]]
+    copied_bytes = sum(f["size"] for f in files if f["success"])
+    copied_files = sum(1 for f in files if f["success"])
+    return {
+        "files": len(entries),
+        "copied_files": copied_files,
+        "failed_files": len(files) - copied_files,
+        "bytes": copied_bytes,
+        "batches": len(jobs),
+        "commits": counter.count,
+        "duration_seconds": round(duration, 3),
+        "listing_seconds": round(listing_seconds, 3),
+        "scheduling_seconds": round(scheduling_seconds, 3),
+        "transfer_seconds": round(sum(r["transfer_seconds"] for r in results), 3),
+        "commit_seconds": round(sum(r["commit_seconds"] for r in results), 3),
+        "files_per_second": round(copied_files / duration, 2) if duration else 0.0,
+        "mb_per_second": round(copied_bytes / duration / 1024**2, 2) if duration else 0.0,
+        "peak_python_memory_mb": round(python_peak / 1024**2, 2),
+        # ru_maxrss is in KB on Linux and covers the largest rclone child of
+        # this process, which run_strategy_isolated limits to this run
+        "peak_rclone_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 2),
+    }
+
+def run_strategy_isolated(*args) -> Dict:
+    """
+    Runs run_strategy in a forked process. RUSAGE_CHILDREN is a lifetime
+    maximum over all children, so measured in the benchmark process every
+    strategy after the first would report the largest earlier peak.
+    """
+    with multiprocessing.get_context("fork").Pool(1) as pool:
+        return pool.apply(run_strategy, args)
+
+def size_arg(value: str) -> str:
+    """argparse type for size options: validates the size, keeps the string."""
+    try:
+        rtv.parse_size(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+def rclone_version() -> str:
+    try:
+        result = subprocess.run(["rclone", "version"], check=True, capture_output=True, text=True)
+        return result.stdout.splitlines()[0]
+    except Exception as e:
+        return f"unknown ({e})"
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark for rclone_to_volume transfer strategies")
+    parser.add_argument("--distributions", nargs="+", choices=sorted(DISTRIBUTIONS), default=["tiny", "mixed"])
+    parser.add_argument("--strategies", nargs="+", choices=STRATEGIES, default=list(STRATEGIES))
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplier for the file counts")
+    parser.add_argument("--workers", type=int, default=4, help="Parallel workers standing in for containers")
+    parser.add_argument("--max-batch-files", type=int, default=rtv.DEFAULT_MAX_BATCH_FILES)
+    parser.add_argument("--max-batch-size", type=size_arg, default=rtv.DEFAULT_MAX_BATCH_SIZE)
+    parser.add_argument("--commit-every-files", type=int, default=rtv.DEFAULT_COMMIT_EVERY_FILES)
+    parser.add_argument("--commit-every-seconds", type=float, default=rtv.DEFAULT_COMMIT_EVERY_SECONDS)
+    parser.add_argument("--commit-every-size", type=size_arg, default=rtv.DEFAULT_COMMIT_EVERY_SIZE)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR, help="Where the JSON results are saved")
+    args = parser.parse_args()
+
+    if not shutil.which("rclone"):
+        print("Error: rclone must be installed and on PATH to run the benchmark")
+        sys.exit(1)
+
+    commit_policy = {
+        "files": args.commit_every_files,
+        "seconds": args.commit_every_seconds,
+        "bytes": rtv.parse_size(args.commit_every_size)
+    }
+    # Keep the per-file INFO logs of the copy code out of the benchmark output
+    logging.getLogger().setLevel(logging.WARNING)
+
+    runs = []
+    with tempfile.TemporaryDirectory(prefix="rclone-bench-") as work_dir:
+        rtv.RCLONE_CONFIG_DIR = os.path.join(work_dir, "config")
+        rtv.setup_rclone_config(f"[{BENCH_REMOTE}]\ntype = local\n")
+
+        for distribution in args.distributions:
+            source_dir = os.path.join(work_dir, "source", distribution)
+            generate_distribution(source_dir, distribution, args.scale, args.seed)
+            for strategy in args.strategies:
+                # A fresh directory stands in for the volume on every run
+                volume_dir = os.path.join(work_dir, "volume", distribution, strategy)
+                metrics = run_strategy_isolated(
+                    strategy,
+                    f"{BENCH_REMOTE}:{source_dir}",
+                    os.path.join(volume_dir, "data"),
+                    os.path.join(volume_dir, "manifest"),
+                    args.workers,
+                    commit_policy,
+                    args.max_batch_files,
+                    rtv.parse_size(args.max_batch_size)
+                )
+                print(f"{distribution:>6} {strategy:>9}: {metrics['files_per_second']:>9.1f} files/s "
+                      f"{metrics['mb_per_second']:>8.1f} MB/s {metrics['commits']:>6} commits "
+                      f"{metrics['duration_seconds']:>8.2f}s")
+                runs.append({"distribution": distribution, "strategy": strategy, **metrics})
+                shutil.rmtree(volume_dir, ignore_errors=True)
+            shutil.rmtree(source_dir, ignore_errors=True)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    output_path = os.path.join(args.output_dir, f"rclone_to_volume-{timestamp}.json")
+    with open(output_path, "w") as f:
+        json.dump({
+            "timestamp": timestamp,
+            "rclone_version": rclone_version(),
+            "settings": {**vars(args), "commit_policy": commit_policy},
+            "runs": runs
+        }, f, indent=2)
+    print(f"Results saved to {output_path}")
+
+if __name__ == "__main__":
+    main()
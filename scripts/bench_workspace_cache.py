@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# scripts/bench_workspace_cache.py
+#
+# Benchmark for the write-back cache in workspace_cache.py. Builds a synthetic
+# git repository on the direct path (e.g. the RemoteWorkspace volume mount),
+# then compares `git status` and small-file write throughput on the direct
+# path against the same repository hydrated into the local-disk cache, and
+# reports what hydrating and flushing back cost. Needs git and rsync on PATH.
+#
+# Inside the RemoteWorkspace container:
+#   python /root/bench_workspace_cache.py --direct /root/external-mounts/remote-volume
+# Locally (both paths on local disk, to check the harness):
+#   python scripts/bench_workspace_cache.py --files 2000
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Dict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import workspace_cache as wc  # noqa: E402
+
+DEFAULT_OUTPUT_DIR = "bench_results"
+PROJECT_NAME = "bench-workspace-cache"
+
+
+def git(repo: str, *args: str):
+    subprocess.run(["git", "-C", repo, *args], check=True, capture_output=True)
+
+
+def create_repo(path: str, files: int, file_size: int, seed: int):
+    """Writes a repository of small files spread over nested directories and commits it."""
+    rng = random.Random(seed)
+    os.makedirs(path)
+    for i in range(files):
+        file_path = os.path.join(path, f"src/module{i % 50}/pkg{i % 7}/file{i}.txt")
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as f:
+            f.write(rng.randbytes(file_size))
+    git(path, "init", "-q")
+    git(path, "add", "-A")
+    git(path, "-c", "user.name=bench", "-c", "user.email=bench@localhost", "commit", "-qm", "bench")
+
+
+def time_git_status(repo: str, runs: int) -> Dict:
+    # The first run fills the index stat cache, so it is reported separately
+    timings = []
+    for _ in range(runs + 1):
+        start = time.monotonic()
+        git(repo, "status", "--porcelain")
+        timings.append(time.monotonic() - start)
+    return {"cold_seconds": round(timings[0], 4), "warm_seconds": round(min(timings[1:]), 4)}
+
+
+def time_small_writes(directory: str, count: int, size: int) -> Dict:
+    target = os.path.join(directory, "bench-writes")
+    os.makedirs(target, exist_ok=True)
+    payload = os.urandom(size)
+    start = time.monotonic()
+    for i in range(count):
+        with open(os.path.join(target, f"w{i}.bin"), "wb") as f:
+            f.write(payload)
+    seconds = time.monotonic() - start
+    shutil.rmtree(target)
+    return {"seconds": round(seconds, 4), "files_per_second": round(count / seconds, 1) if seconds else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the workspace write-back cache against the direct mount")
+    parser.add_argument("--direct", help="Directory on the mount to benchmark (a temp dir by default)")
+    parser.add_argument("--cache-root", help="Local cache root (a temp dir by default)")
+    parser.add_argument("--files", type=int, default=10000, help="Files in the synthetic repository")
+    parser.add_argument("--file-size", type=int, default=2048)
+    parser.add_argument("--writes", type=int, default=2000, help="Small files written per write test")
+    parser.add_argument("--write-size", type=int, default=4096)
+    parser.add_argument("--status-runs", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR, help="Where the JSON results are saved")
+    args = parser.parse_args()
+
+    for tool in ("git", "rsync"):
+        if not shutil.which(tool):
+            print(f"Error: {tool} must be installed and on PATH to run the benchmark")
+            sys.exit(1)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory(prefix="workspace-cache-bench-") as work_dir:
+        direct_root = args.direct or os.path.join(work_dir, "direct")
+        cache_root = args.cache_root or os.path.join(work_dir, "cache")
+        os.makedirs(direct_root, exist_ok=True)
+        direct_repo = os.path.join(direct_root, PROJECT_NAME)
+        if os.path.exists(direct_repo):
+            print(f"Error: {direct_repo} already exists, remove it or pick another --direct")
+            sys.exit(1)
+
+        try:
+            start = time.monotonic()
+            create_repo(direct_repo, args.files, args.file_size, args.seed)
+            setup_seconds = time.monotonic() - start
+
+            direct = {
+                "git_status": time_git_status(direct_repo, args.status_runs),
+                "small_writes": time_small_writes(direct_repo, args.writes, args.write_size),
+            }
+
+            cache = wc.WriteBackCache({"direct": direct_root}, root=cache_root, budget_bytes=wc.CACHE_BUDGET_BYTES)
+            key = f"direct/{PROJECT_NAME}"
+            start = time.monotonic()
+            cache.hydrate(key)
+            hydrate_seconds = time.monotonic() - start
+            cached_repo = cache.cache_path(key)
+            cached = {
+                "git_status": time_git_status(cached_repo, args.status_runs),
+                "small_writes": time_small_writes(cached_repo, args.writes, args.write_size),
+            }
+            # Flush after a write burst, which is the work the cache defers
+            for i in range(args.writes):
+                with open(os.path.join(cached_repo, f"flushed{i}.bin"), "wb") as f:
+                    f.write(b"x" * args.write_size)
+            start = time.monotonic()
+            cache.flush(key)
+            flush_seconds = time.monotonic() - start
+        finally:
+            shutil.rmtree(direct_repo, ignore_errors=True)
+
+    results = {
+        "settings": vars(args),
+        "setup_seconds": round(setup_seconds, 3),
+        "direct": direct,
+        "cached": cached,
+        "hydrate_seconds": round(hydrate_seconds, 3),
+        "flush_seconds": round(flush_seconds, 3),
+        "git_status_speedup": round(direct["git_status"]["warm_seconds"] / max(cached["git_status"]["warm_seconds"], 1e-6), 2),
+        "small_write_speedup": round(cached["small_writes"]["files_per_second"] / max(direct["small_writes"]["files_per_second"], 1e-6), 2),
+    }
+    for label in ("direct", "cached"):
+        r = results[label]
+        print(f"{label:>7}: git status {r['git_status']['warm_seconds']:.3f}s (cold {r['git_status']['cold_seconds']:.3f}s), "
+              f"{r['small_writes']['files_per_second']:.0f} small files/s")
+    print(f"hydrate {results['hydrate_seconds']:.2f}s, flush {results['flush_seconds']:.2f}s, "
+          f"git status x{results['git_status_speedup']}, small writes x{results['small_write_speedup']}")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    output_path = os.path.join(args.output_dir, f"workspace_cache-{timestamp}.json")
+    with open(output_path, "w") as f:
+        json.dump({"timestamp": timestamp, **results}, f, indent=2)
+    print(f"Results saved to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
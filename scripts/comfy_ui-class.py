@@ -1,6 +1,21 @@
+import asyncio
+import collections
+import contextlib
+import hashlib
+import importlib.util
+import itertools
+import json
+import math
+import os
 import pathlib
+import shutil
+import socket
 import subprocess
+import sys
+import threading
 import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import modal
 
 from modal import enter, exit
@@ -9,53 +24,489 @@ import yaml
 assets_volume = modal.Volume.from_name("assets", create_if_missing=True)
 assets_volume_mount_dir = "/root/assets"
 
-ASSETS = {
-    "Checkpoints": [
-        #"https://huggingface.co/stabilityai/stable-diffusion-2-inpainting/resolve/main/512-inpainting-ema.ckpt",
-        #"https://huggingface.co/stabilityai/stable-diffusion-xl-base-1.0/resolve/main/sd_xl_base_1.0.safetensors",
-    ],
-    "ControlNet": [
-        #"https://huggingface.co/stabilityai/control-lora/resolve/main/control-LoRAs-rank256/control-lora-canny-rank256.safetensors"
-    ],
-    # Add more types and URLs as needed
-}
+# Asset manifest. Each entry needs a type (the models/<type>/ directory) and
+# a url; name, size (bytes), sha256 and priority are optional. Lower priority
+# values are fetched first, and only entries at or below
+# BUILD_PREFETCH_MAX_PRIORITY are downloaded while building the image; the
+# rest are prefetched in the background once the container is up. A copy at
+# ASSET_MANIFEST_FILE on the volume, if present, replaces this one at runtime.
+ASSET_MANIFEST = """
+assets:
+    # - type: checkpoints
+    #   url: https://huggingface.co/stabilityai/stable-diffusion-xl-base-1.0/resolve/main/sd_xl_base_1.0.safetensors
+    #   size: 6938078334
+    #   sha256: 31e35c80fc4829d14f90153f4c74cd59c90b779f6afe05a74cd6120b893f7e5b
+    #   priority: 0
+    # - type: checkpoints
+    #   url: https://huggingface.co/stabilityai/stable-diffusion-2-inpainting/resolve/main/512-inpainting-ema.ckpt
+    #   priority: 10
+    # - type: controlnet
+    #   url: https://huggingface.co/stabilityai/control-lora/resolve/main/control-LoRAs-rank256/control-lora-canny-rank256.safetensors
+    #   priority: 20
+"""
+ASSET_MANIFEST_FILE = f"{assets_volume_mount_dir}/asset-manifest.yaml"
+DEFAULT_ASSET_PRIORITY = 100
+BUILD_PREFETCH_MAX_PRIORITY = 0
+
+
+# Models are kept in a content-addressed store on the assets volume and
+# exposed to ComfyUI as symlinks under models/<type>/ (see ModelStore)
+MODELS_DIRECTORY = f"{assets_volume_mount_dir}/models"
+MODEL_STORE_DIRECTORY = f"{assets_volume_mount_dir}/model-store"
+# One <type>/<name>.json marker per asset, written once its model is linked
+READY_DIRECTORY = f"{assets_volume_mount_dir}/model-ready"
+
+# Download tuning: files fetched at once, parallel Range requests per file,
+# and the size of each Range chunk. Files smaller than one chunk, or served
+# without Range support, are fetched over a single connection.
+MAX_PARALLEL_DOWNLOADS = 4
+CONNECTIONS_PER_FILE = 8
+DOWNLOAD_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def normalize_asset(entry):
+    """Fills in the optional manifest fields of an asset entry."""
+    asset = dict(entry)
+    if "type" not in asset or "url" not in asset:
+        raise ValueError(f"Asset entries need a type and a url: {entry}")
+    asset["type"] = asset["type"].lower()
+    asset.setdefault("name", asset["url"].split("?")[0].split("/")[-1])
+    asset.setdefault("priority", DEFAULT_ASSET_PRIORITY)
+    return asset
+
+
+def load_asset_manifest(text=ASSET_MANIFEST, path=ASSET_MANIFEST_FILE):
+    """Parses the manifest, preferring the copy on the volume when there is one."""
+    if path and pathlib.Path(path).exists():
+        text = pathlib.Path(path).read_text()
+    assets = (yaml.safe_load(text) or {}).get("assets") or []
+    return sorted((normalize_asset(entry) for entry in assets), key=lambda asset: asset["priority"])
+
+
+def ready_marker_path(asset, ready_directory=READY_DIRECTORY):
+    return pathlib.Path(ready_directory, asset["type"], f"{asset['name']}.json")
+
+
+class AssetReadiness:
+    """
+    Answers which manifest models are usable yet, from their readiness
+    markers, so prompts can be checked against what is actually present.
+    """
+
+    def __init__(self, assets, ready_directory=READY_DIRECTORY):
+        self.assets = {asset["name"]: asset for asset in assets}
+        self.ready_directory = ready_directory
+
+    def is_ready(self, name):
+        asset = self.assets.get(name)
+        return asset is None or ready_marker_path(asset, self.ready_directory).exists()
+
+    def missing_for_prompt(self, prompt):
+        """Names of manifest models an API-format prompt refers to that are not ready."""
+        missing = set()
+        for node in prompt.values():
+            for value in (node.get("inputs") or {}).values():
+                if isinstance(value, str):
+                    name = value.replace("\\", "/").split("/")[-1]
+                    if name in self.assets and not self.is_ready(name):
+                        missing.add(name)
+        return sorted(missing)
+
+
+class DownloadProgress:
+    """Thread-safe aggregate progress bar across all files being downloaded."""
+
+    def __init__(self):
+        from tqdm import tqdm
+
+        self.lock = threading.Lock()
+        self.bar = tqdm(total=0, unit_scale=True, unit_divisor=1024, unit="B", desc="assets")
+
+    def add_total(self, num_bytes):
+        with self.lock:
+            self.bar.total += num_bytes
+            self.bar.refresh()
+
+    def update(self, num_bytes):
+        with self.lock:
+            self.bar.update(num_bytes)
+
+    def close(self):
+        self.bar.close()
+
+
+class ModelStore:
+    """
+    Content-addressed model store on the assets volume.
+
+    Files live once under objects/<sha256[:2]>/<sha256>, no matter how many
+    URLs or asset types refer to them. index.json maps each URL to its hash
+    and each hash to the model paths (relative to the models directory) that
+    link to it, which serves as the reference count for garbage collection.
+    Model paths are relative symlinks into the store.
+    """
+
+    def __init__(self, root, models_directory):
+        self.root = pathlib.Path(root)
+        self.models_directory = pathlib.Path(models_directory)
+        self.index_path = self.root / "index.json"
+        self.lock = threading.Lock()
+        self.index = {"urls": {}, "refs": {}}
+        if self.index_path.exists():
+            self.index = json.loads(self.index_path.read_text())
+
+    def object_path(self, digest):
+        return self.root / "objects" / digest[:2] / digest
+
+    def staging_directory(self, url):
+        return self.root / "staging" / hashlib.sha1(url.encode()).hexdigest()
+
+    def save(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.index_path.with_suffix(".json.tmp")
+        tmp_path.write_text(json.dumps(self.index, indent=1, sort_keys=True))
+        tmp_path.replace(self.index_path)
+
+    def lookup(self, url, sha256=None):
+        """Returns the cached hash for url, or None if it has to be downloaded."""
+        digest = self.index["urls"].get(url)
+        if digest is None or not self.object_path(digest).exists():
+            return None
+        if sha256 is not None and digest != sha256:
+            return None
+        return digest
+
+    def ingest(self, url, downloaded_path, sha256=None):
+        """Moves a downloaded file into the store, deduplicating by content."""
+        digest = sha256 or sha256_of_file(downloaded_path)
+        target = self.object_path(digest)
+        with self.lock:
+            if target.exists():
+                downloaded_path.unlink()
+            else:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                downloaded_path.replace(target)
+            try:
+                downloaded_path.parent.rmdir()
+            except OSError:
+                pass
+            self.index["urls"][url] = digest
+            self.save()
+        return digest
+
+    def link(self, digest, model_path):
+        """Points models/<type>/<name> at the stored object and records the reference."""
+        model_path = pathlib.Path(model_path)
+        model_path.parent.mkdir(parents=True, exist_ok=True)
+        relative_target = os.path.relpath(self.object_path(digest), model_path.parent)
+        if model_path.is_symlink() or model_path.exists():
+            if model_path.is_symlink() and os.readlink(model_path) == relative_target:
+                relative_target = None
+            else:
+                model_path.unlink()
+        if relative_target is not None:
+            model_path.symlink_to(relative_target)
+
+        reference = str(model_path.relative_to(self.models_directory))
+        with self.lock:
+            for other, references in self.index["refs"].items():
+                if other != digest and reference in references:
+                    references.remove(reference)
+            references = self.index["refs"].setdefault(digest, [])
+            if reference not in references:
+                references.append(reference)
+            self.save()
+
+    def collect_garbage(self, wanted_references):
+        """
+        Drops links the store created that are no longer wanted, then deletes
+        objects that nothing references any more, and forgets their URLs.
+        """
+        removed = 0
+        with self.lock:
+            for digest, references in list(self.index["refs"].items()):
+                for reference in [r for r in references if r not in wanted_references]:
+                    model_path = self.models_directory / reference
+                    if model_path.is_symlink():
+                        model_path.unlink()
+                    references.remove(reference)
+                if not references:
+                    del self.index["refs"][digest]
+                    self.object_path(digest).unlink(missing_ok=True)
+                    removed += 1
+            live = set(self.index["refs"])
+            self.index["urls"] = {url: d for url, d in self.index["urls"].items() if d in live}
+            self.save()
+        if removed:
+            print(f"Garbage collected {removed} unreferenced models from the store")
+
+
+def download_assets(
+    assets=None,
+    base_directory=MODELS_DIRECTORY,
+    store_directory=MODEL_STORE_DIRECTORY,
+    ready_directory=READY_DIRECTORY,
+    max_parallel_downloads=MAX_PARALLEL_DOWNLOADS,
+    connections_per_file=CONNECTIONS_PER_FILE,
+    chunk_size=DOWNLOAD_CHUNK_SIZE,
+    max_priority=None,
+    commit=True,
+    commit_each=False,
+):
+    """
+    Makes every asset in the manifest available as models/<type>/<name>,
+    highest priority first, downloading only URLs the model store has not
+    seen before. A readiness marker is written as each asset is linked. With
+    max_priority only the assets at or below it are fetched; otherwise models
+    no longer in the manifest are garbage collected afterwards.
+    """
+    if assets is None:
+        assets = load_asset_manifest()
+    assets = [normalize_asset(asset) for asset in assets]
+    store = ModelStore(store_directory, base_directory)
+
+    # Group by URL so a file listed under several asset types downloads once,
+    # at the most urgent priority among its entries
+    links = {}
+    for asset in assets:
+        model_path = pathlib.Path(base_directory, asset["type"], asset["name"])
+        links.setdefault(asset["url"], []).append((asset, model_path))
+    ordered = sorted(links, key=lambda url: min(asset["priority"] for asset, _ in links[url]))
+    if max_priority is not None:
+        ordered = [url for url in ordered if min(asset["priority"] for asset, _ in links[url]) <= max_priority]
+
+    def fetch(asset):
+        digest = store.lookup(asset["url"], asset.get("sha256"))
+        if digest is not None:
+            print(f"{asset['url']} found in the model store, skipping download")
+            return digest
+        downloaded = download_url_to_directory(
+            asset["url"],
+            store.staging_directory(asset["url"]),
+            sha256=asset.get("sha256"),
+            progress=progress,
+            connections=connections_per_file,
+            chunk_size=chunk_size,
+        )
+        size = downloaded.stat().st_size
+        if asset.get("size") and size != asset["size"]:
+            downloaded.unlink()
+            raise ValueError(f"Size mismatch for {asset['url']}: expected {asset['size']}, got {size}")
+        return store.ingest(asset["url"], downloaded, asset.get("sha256"))
 
+    def mark_ready(asset, model_path, digest):
+        marker = ready_marker_path(asset, ready_directory)
+        marker.parent.mkdir(parents=True, exist_ok=True)
+        marker.write_text(json.dumps({
+            "url": asset["url"],
+            "path": str(model_path),
+            "sha256": digest,
+            "size": store.object_path(digest).stat().st_size,
+            "priority": asset["priority"],
+            "ready_at": time.time(),
+        }))
+
+    commit_lock = threading.Lock()
+    progress = DownloadProgress()
+    failures = []
+    try:
+        # The pool works through submissions in order, so higher priority
+        # assets start first and lower ones fill in behind them
+        with ThreadPoolExecutor(max_workers=max_parallel_downloads) as pool:
+            futures = {pool.submit(fetch, links[url][0][0]): url for url in ordered}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    digest = future.result()
+                except Exception as e:
+                    print(f"Error downloading {url}: {e}")
+                    failures.append(url)
+                    continue
+                for asset, model_path in links[url]:
+                    store.link(digest, model_path)
+                    mark_ready(asset, model_path, digest)
+                    print(f"Asset ready: {asset['type']}/{asset['name']} (priority {asset['priority']})")
+                if commit_each:
+                    with commit_lock:
+                        assets_volume.commit()
+    finally:
+        progress.close()
+
+    if max_priority is None:
+        # Keep the references of failed downloads so a flaky run does not evict them
+        wanted = {str(path.relative_to(base_directory)) for entries in links.values() for _, path in entries}
+        store.collect_garbage(wanted)
+        wanted_markers = {ready_marker_path(asset, ready_directory) for asset in assets}
+        for marker in pathlib.Path(ready_directory).glob("*/*.json"):
+            if marker not in wanted_markers:
+                marker.unlink()
+    if commit:
+        assets_volume.commit()
+
+    if failures:
+        raise RuntimeError(f"{len(failures)} asset downloads failed: {failures}")
+
+
+def start_asset_prefetch():
+    """
+    Downloads whatever the manifest lists that is not on the volume yet in a
+    background thread, committing after each asset so it is usable as soon
+    as it lands. Returns the thread and an AssetReadiness for the manifest.
+    """
+    assets = load_asset_manifest()
+
+    def prefetch():
+        try:
+            download_assets(assets, commit_each=True)
+        except Exception as e:
+            print(f"Asset prefetch finished with errors: {e}")
 
-def download_assets(assets=ASSETS, base_directory="/root/models"):
-    for asset_type, urls in assets.items():
-        # Convert asset_type to lowercase for the directory name
-        asset_type_directory = asset_type.lower()
-        for url in urls:
-            download_url_to_directory(url, pathlib.Path(base_directory, asset_type_directory))
+    thread = threading.Thread(target=prefetch, daemon=True, name="asset-prefetch")
+    thread.start()
+    return thread, AssetReadiness(assets)
 
 
-def download_url_to_directory(url, directory):
+def probe_url(client, url):
+    """Returns (final_url, size or None, accepts_ranges) for a URL, following redirects."""
+    response = client.head(url, follow_redirects=True)
+    response.raise_for_status()
+    size = response.headers.get("Content-Length")
+    accepts_ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+    return str(response.url), int(size) if size is not None else None, accepts_ranges
+
+
+def sha256_of_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(8 * 1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def download_url_to_directory(
+    url,
+    directory,
+    sha256=None,
+    progress=None,
+    connections=CONNECTIONS_PER_FILE,
+    chunk_size=DOWNLOAD_CHUNK_SIZE,
+):
+    """
+    Downloads url into directory, resuming from a previous partial download.
+
+    Large files on servers that support Range requests are fetched as parallel
+    chunks into a preallocated "<name>.part" file; finished chunks are tracked
+    in "<name>.part.json" so an interrupted download only refetches the rest.
+    Other files stream over one connection, resuming from the length of the
+    .part file when the server allows it. When sha256 is given the result is
+    verified before it is moved into place.
+    """
     import httpx
-    from tqdm import tqdm
 
     directory.mkdir(parents=True, exist_ok=True)
     local_filename = url.split("/")[-1]
     local_filepath = directory / local_filename
-    print(f"Downloading {url} to {local_filepath}...")
+    part_path = directory / f"{local_filename}.part"
+    state_path = directory / f"{local_filename}.part.json"
 
-    with httpx.stream("GET", url, follow_redirects=True) as stream:
-        try: 
-            total = int(stream.headers["Content-Length"])
-        except KeyError:
+    if local_filepath.exists() and (sha256 is None or sha256_of_file(local_filepath) == sha256):
+        print(f"{local_filepath} already present, skipping download")
+        return local_filepath
+
+    print(f"Downloading {url} to {local_filepath}...")
+    with httpx.Client(follow_redirects=True, timeout=httpx.Timeout(60.0, connect=30.0)) as client:
+        final_url, total, accepts_ranges = probe_url(client, url)
+        if total is None:
             print(f"Content-Length not found for {url}; downloading in chunk mode.")
-            total = None
+        elif progress:
+            progress.add_total(total)
+
+        if total is not None and accepts_ranges and total > chunk_size:
+            completed = set()
+            if part_path.exists() and state_path.exists():
+                state = json.loads(state_path.read_text())
+                if state.get("size") == total and state.get("chunk_size") == chunk_size:
+                    completed = set(state["completed"])
+            if not completed:
+                with open(part_path, "wb") as f:
+                    f.truncate(total)
+            if progress:
+                progress.update(sum(min(chunk_size, total - i * chunk_size) for i in completed))
+            download_ranges(client, final_url, part_path, state_path, total, chunk_size,
+                            completed, connections, progress)
+        else:
+            download_stream(client, final_url, part_path, total, accepts_ranges, progress)
+
+    if sha256 is not None:
+        actual = sha256_of_file(part_path)
+        if actual != sha256:
+            part_path.unlink()
+            state_path.unlink(missing_ok=True)
+            raise ValueError(f"sha256 mismatch for {url}: expected {sha256}, got {actual}")
+
+    part_path.replace(local_filepath)
+    state_path.unlink(missing_ok=True)
+    print(f"Downloaded {local_filepath}")
+    return local_filepath
+
+
+def download_ranges(client, url, part_path, state_path, total, chunk_size, completed, connections, progress):
+    """Fetches the missing chunks of a file with parallel Range requests."""
+    state_lock = threading.Lock()
+    num_chunks = (total + chunk_size - 1) // chunk_size
+
+    def fetch(index):
+        start = index * chunk_size
+        end = min(start + chunk_size, total) - 1
+        with client.stream("GET", url, headers={"Range": f"bytes={start}-{end}"}) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise RuntimeError(f"Server ignored Range request for {url}")
+            with open(part_path, "r+b") as f:
+                f.seek(start)
+                for data in response.iter_bytes():
+                    f.write(data)
+                    if progress:
+                        progress.update(len(data))
+        with state_lock:
+            completed.add(index)
+            state_path.write_text(json.dumps({
+                "size": total, "chunk_size": chunk_size, "completed": sorted(completed)
+            }))
+
+    missing = [index for index in range(num_chunks) if index not in completed]
+    with ThreadPoolExecutor(max_workers=connections) as pool:
+        # list() re-raises the first failed chunk; finished chunks stay recorded
+        list(pool.map(fetch, missing))
 
-        with open(local_filepath, "wb") as f, tqdm(total=total, unit_scale=True, unit_divisor=1024, unit="B", desc=local_filename, disable=total is None) as progress:
-            num_bytes_downloaded = stream.num_bytes_downloaded
+
+def download_stream(client, url, part_path, total, accepts_ranges, progress):
+    """Streams a file over one connection, resuming from an existing .part file."""
+    offset = part_path.stat().st_size if part_path.exists() and accepts_ranges else 0
+    if total is not None and offset > total:
+        offset = 0
+    if total is not None and offset == total:
+        return
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+    with client.stream("GET", url, headers=headers) as stream:
+        stream.raise_for_status()
+        if offset and stream.status_code != 206:
+            offset = 0
+        if progress and offset:
+            progress.update(offset)
+        with open(part_path, "ab" if offset else "wb") as f:
             for data in stream.iter_bytes():
                 f.write(data)
-                if total:  # Only update progress if total size is known
-                    progress.update(stream.num_bytes_downloaded - num_bytes_downloaded)
-                    num_bytes_downloaded = stream.num_bytes_downloaded
+                if progress:
+                    progress.update(len(data))
 
 # We shouldn't sync comfyui plugins as the containers spinned up are epehemeral, 
 # and they need the dependencies installed into the image
 # Syncing Models and outputs is fine though
+# Each plugin may pin "ref" (a commit SHA, tag or branch) for reproducible
+# builds; unpinned plugins use the default branch and the build report prints
+# the commit they resolved to so it can be pinned.
 PLUGINS = [
     {
         "url": "https://github.com/coreyryanhanson/ComfyQR",
@@ -65,25 +516,99 @@ PLUGINS = [
         "url": "https://github.com/ltdrdata/ComfyUI-Manager.git"
     }
 ]
-def download_plugins():
-    import subprocess
+CUSTOM_NODES_DIRECTORY = "/root/custom_nodes"
+MAX_PARALLEL_CLONES = 8
+# Persistent pip cache shared by image builds, so wheels are built or
+# downloaded once and reused whenever the plugin layer is rebuilt
+pip_cache_volume = modal.Volume.from_name("pip-wheel-cache", create_if_missing=True)
+pip_cache_mount_dir = "/root/pip-cache"
+
+
+def clone_plugin(plugin, directory=CUSTOM_NODES_DIRECTORY):
+    """Shallow-clones one plugin at its pinned ref. Returns its timing record."""
+    url = plugin["url"]
+    name = url.rstrip("/").split("/")[-1].removesuffix(".git")
+    path = pathlib.Path(directory, name)
+    ref = plugin.get("ref")
+    record = {"name": name, "url": url, "ref": ref, "path": str(path)}
+    start = time.monotonic()
+    try:
+        if ref:
+            # Fetching a single ref with depth 1 works for branches, tags and
+            # (on GitHub) commit SHAs
+            path.mkdir(parents=True, exist_ok=True)
+            for command in (
+                ["git", "init", "-q"],
+                ["git", "remote", "add", "origin", url],
+                ["git", "fetch", "-q", "--depth", "1", "origin", ref],
+                ["git", "checkout", "-q", "FETCH_HEAD"],
+            ):
+                subprocess.run(command, cwd=path, check=True, capture_output=True, text=True)
+        else:
+            subprocess.run(
+                ["git", "clone", "-q", "--depth", "1", url, str(path)],
+                check=True, capture_output=True, text=True,
+            )
+        record["commit"] = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=path, check=True, capture_output=True, text=True
+        ).stdout.strip()
+        record["ok"] = True
+    except subprocess.CalledProcessError as e:
+        print(f"Error cloning repository {url}: {e.stderr}")
+        record["ok"] = False
+    record["clone_seconds"] = round(time.monotonic() - start, 2)
+    return record
+
+
+def download_plugins(plugins=PLUGINS, directory=CUSTOM_NODES_DIRECTORY, max_parallel_clones=MAX_PARALLEL_CLONES):
+    """
+    Clones all plugins in parallel (shallow, at their pinned refs), then
+    installs their requirements together in a single pip resolve backed by
+    the persistent wheel cache, and prints where the time went per plugin.
+    """
+    build_start = time.monotonic()
+    pathlib.Path(directory).mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=max_parallel_clones) as pool:
+        records = list(pool.map(lambda plugin: clone_plugin(plugin, directory), plugins))
 
-    for plugin in PLUGINS:
-        url = plugin["url"]
-        name = url.split("/")[-1]
-        command = f"cd /root/custom_nodes && git clone {url}"
+    requirement_args = []
+    for plugin, record in zip(plugins, records):
+        requirements = plugin.get("requirements")
+        if record["ok"] and requirements:
+            requirement_args += ["-r", str(pathlib.Path(record["path"], requirements))]
+        record["requirements"] = requirements
+
+    install_seconds = 0.0
+    install_ok = True
+    if requirement_args:
+        start = time.monotonic()
+        pip_command = ["pip", "install", "--cache-dir", pip_cache_mount_dir] + requirement_args
         try:
-            subprocess.run(command, shell=True, check=True)
-            print(f"Repository {url} cloned successfully")
+            subprocess.run(pip_command, check=True)
+            print(f"Requirements for {len(requirement_args) // 2} plugins installed successfully")
         except subprocess.CalledProcessError as e:
-            print(f"Error cloning repository: {e.stderr}")
-        if plugin.get("requirements"):
-            pip_command = f"cd /root/custom_nodes/{name} && pip install -r {plugin['requirements']}"
-            try:
-                subprocess.run(pip_command, shell=True, check=True)
-                print(f"Requirements for {url} installed successfully")
-            except subprocess.CalledProcessError as e:
-                print(f"Error installing requirements: {e.stderr}")
+            print(f"Error installing requirements: {e}")
+            install_ok = False
+        install_seconds = round(time.monotonic() - start, 2)
+        try:
+            pip_cache_volume.commit()
+        except Exception as e:
+            print(f"Could not commit the pip cache volume: {e}")
+
+    report = {
+        "plugins": records,
+        "install_seconds": install_seconds,
+        "install_ok": install_ok,
+        "total_seconds": round(time.monotonic() - build_start, 2),
+    }
+    pathlib.Path(directory, "plugin_build_report.json").write_text(json.dumps(report, indent=2))
+
+    print("Plugin build report:")
+    for record in records:
+        pin = record["ref"] or "unpinned"
+        status = record.get("commit", "FAILED")
+        print(f"  {record['name']:<40} clone {record['clone_seconds']:>7.2f}s  {pin} -> {status}")
+    print(f"  combined requirements install: {install_seconds:.2f}s, total: {report['total_seconds']:.2f}s")
 
 
 comfyui_config = f"""
@@ -113,85 +638,1217 @@ def configure_comfyui():
     with open("/root/extra_model_paths.yaml", "w") as f:
         f.write(comfyui_config)
 
-# This Sync script is used to sync files from the volume to the modal container
-# Upon startup, it will copy all dirs listed in `load_directories` array to the
-# container. Once that is done, it will set a an event handler to watch for 
-# closed_write, delete and move events on the dirs listed in `watched_dirs`
-# array. When one of these events is triggered, it will sync the files from the
-# container to the volume.
-def run_sync_script():
-    sync_script = '''#!/bin/bash
-        # Function to sync files
-        sync_file() {
-            local src_file="$1"
-            local dest_file="$2"
-
-            mkdir -p "$(dirname "${dest_file}")"
-            rsync -av "${src_file}" "${dest_file}" | grep -v '/$'
-            local sync_status=$?
-            if [ $sync_status -eq 0 ]; then
-                echo "[INFO] File synchronized successfully: ${src_file} -> ${dest_file}"
-            else
-                echo "[ERROR] Issues encountered while synchronizing file: ${src_file}"
-            fi
-            return $sync_status
-        }
+# Sync engine settings. Changes under SYNC_WATCHED_DIRS are mirrored to the
+# assets volume (/root/<dir> -> /root/assets/<dir>); SYNC_LOAD_DIRS are copied
+# from the volume into the container at startup.
+SYNC_LOCAL_ROOT = "/root"
+SYNC_WATCHED_DIRS = ["/root/models", "/root/output"]
+SYNC_LOAD_DIRS = ["/root/output"]
+# "lazy" recreates the directory tree and links files to their volume copies
+# in the background, so startup does not grow with the output history;
+# "eager" copies everything with rsync before the watcher starts
+SYNC_HYDRATION_MODE = "lazy"
+SYNC_DEBOUNCE_SECONDS = 2.0  # quiet time before a changed file is considered stable
+SYNC_MAX_BATCH_FILES = 200  # files written to the volume per flush
+SYNC_MAX_BYTES_PER_SECOND = 0  # write rate limit for the volume, 0 for unlimited
+SYNC_RESCAN_SECONDS = 30  # polling interval if inotifywait is unavailable or exits
+# Optional transcoding of outputs before they are synced. The local file is
+# left alone for the UI; the volume gets the compact copy and a thumbnail,
+# plus the original only if TRANSCODE_KEEP_ORIGINAL is set.
+TRANSCODE_OUTPUTS = False
+TRANSCODE_DIRS = ["/root/output"]
+TRANSCODE_EXTENSIONS = {".png"}
+TRANSCODE_FORMAT = "webp"
+TRANSCODE_LOSSLESS = True
+TRANSCODE_QUALITY = 90  # used for lossy encoding, or as effort for lossless WebP
+TRANSCODE_THUMBNAIL_SIZE = (256, 256)
+TRANSCODE_THUMBNAIL_DIR = "thumbnails"  # created under each directory in TRANSCODE_DIRS
+TRANSCODE_KEEP_ORIGINAL = False
+TRANSCODE_WORKERS = 2
+TRANSCODE_NICENESS = 19  # workers yield the CPU to the inference server
 
-        # Function to handle file events
-        handle_file_event() {
-            local directory="$1"
-            local filename="$2"
-            local backup_vol="/root/assets"
-
-            local src_file="${directory}/${filename}"
-            local dest_file="${backup_vol}/${directory#/root/}/${filename}"
-            sync_file "${src_file}" "${dest_file}"
-            local sync_status=$?
-            if [ $sync_status -ne 0 ]; then
-                echo "[ERROR] Synchronization failed for file: ${src_file}"
-            fi
-        }
 
-        # Function to load files from the volume to the local directory
-        load_from_volume() {
-            local directories=("$@")
-            local backup_vol="/root/assets"
-
-            for directory in "${directories[@]}"; do
-                local src_dir="${backup_vol}/${directory#/root/}"
-                local dest_dir="${directory}"
-
-                echo "[INFO] Loading files from volume: ${src_dir} -> ${dest_dir}"
-                rsync -av "${src_dir}/" "${dest_dir}" | grep -v '/$'
-                local sync_status=$?
-                if [ $sync_status -eq 0 ]; then
-                    echo "[INFO] Files loaded successfully from volume: ${src_dir}"
-                else
-                    echo "[ERROR] Issues encountered while loading files from volume: ${src_dir}"
-                fi
-            done
+def lower_process_priority(niceness=TRANSCODE_NICENESS):
+    os.nice(niceness)
+
+
+def transcode_image(source, target, thumbnail_target, image_format, lossless, quality, thumbnail_size):
+    """
+    Writes a compact copy of source to target and a thumbnail to
+    thumbnail_target. Runs in a worker process; returns its CPU time and the
+    sizes involved.
+    """
+    from PIL import Image
+
+    cpu_start = time.process_time()
+    with Image.open(source) as image:
+        image.load()
+        # ComfyUI keeps the prompt and workflow in PNG text chunks; carry them
+        # over in the EXIF tags its own WebP loader reads them from
+        exif = Image.Exif()
+        for tag, key in ((0x0110, "prompt"), (0x010F, "workflow")):
+            if key in image.info:
+                exif[tag] = f"{key}:{image.info[key]}"
+        thumbnail = image.copy()
+        thumbnail.thumbnail(thumbnail_size)
+        for img, path, options in (
+            (image, target, {"lossless": lossless, "quality": quality, "exif": exif}),
+            (thumbnail, thumbnail_target, {"quality": 80}),
+        ):
+            pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+            temporary = f"{path}.tmp"
+            img.save(temporary, format=image_format, **options)
+            os.replace(temporary, path)
+    return {
+        "cpu_seconds": time.process_time() - cpu_start,
+        "original_bytes": os.path.getsize(source),
+        "compact_bytes": os.path.getsize(target),
+        "thumbnail_bytes": os.path.getsize(thumbnail_target),
+    }
+
+
+class OutputTranscoder:
+    """
+    Transcodes finished outputs into the volume from a pool of low-priority
+    worker processes, so encoding never competes with inference for the CPU.
+    Tracks the CPU time spent against the bytes kept off the volume.
+    """
+
+    def __init__(
+        self,
+        local_root=SYNC_LOCAL_ROOT,
+        backup_root=assets_volume_mount_dir,
+        directories=TRANSCODE_DIRS,
+        extensions=TRANSCODE_EXTENSIONS,
+        image_format=TRANSCODE_FORMAT,
+        lossless=TRANSCODE_LOSSLESS,
+        quality=TRANSCODE_QUALITY,
+        thumbnail_size=TRANSCODE_THUMBNAIL_SIZE,
+        keep_original=TRANSCODE_KEEP_ORIGINAL,
+        workers=TRANSCODE_WORKERS,
+        niceness=TRANSCODE_NICENESS,
+    ):
+        self.local_root = pathlib.Path(local_root)
+        self.backup_root = pathlib.Path(backup_root)
+        self.directories = [pathlib.Path(d) for d in directories]
+        self.extensions = {e.lower() for e in extensions}
+        self.image_format = image_format
+        self.lossless = lossless
+        self.quality = quality
+        self.thumbnail_size = thumbnail_size
+        self.keep_original = keep_original
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers, initializer=lower_process_priority, initargs=(niceness,)
+        )
+        self.lock = threading.Lock()
+        self.in_flight = set()
+        self.dirty = False
+        self.stats = {
+            "files": 0, "failed": 0, "cpu_seconds": 0.0,
+            "original_bytes": 0, "compact_bytes": 0, "thumbnail_bytes": 0,
         }
 
-        # Load files from the volume to the local directory
-        load_directories=("/root/output")
-        load_from_volume "${load_directories[@]}"
+    def accepts(self, path):
+        path = pathlib.Path(path)
+        return (
+            path.suffix.lower() in self.extensions
+            and not path.is_symlink()
+            and any(d in path.parents for d in self.directories)
+        )
+
+    def targets(self, path):
+        """Volume paths of the compact copy and the thumbnail for a local file."""
+        path = pathlib.Path(path)
+        directory = next(d for d in self.directories if d in path.parents)
+        suffix = f".{self.image_format.lower()}"
+        target = self.backup_root / path.relative_to(self.local_root)
+        thumbnail = (
+            self.backup_root / directory.relative_to(self.local_root) / TRANSCODE_THUMBNAIL_DIR
+            / path.relative_to(directory)
+        )
+        return target.with_suffix(suffix), thumbnail.with_suffix(suffix)
+
+    def submit(self, path):
+        target, thumbnail = self.targets(path)
+        future = self.pool.submit(
+            transcode_image, str(path), str(target), str(thumbnail),
+            self.image_format, self.lossless, self.quality, self.thumbnail_size,
+        )
+        with self.lock:
+            self.in_flight.add(future)
+        future.add_done_callback(lambda f: self.finished(path, f))
+
+    def finished(self, path, future):
+        with self.lock:
+            self.in_flight.discard(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                self.stats["failed"] += 1
+                print(f"[ERROR] Could not transcode {path}: {e}")
+                return
+            self.stats["files"] += 1
+            for key, value in result.items():
+                self.stats[key] += value
+            self.dirty = True
+            files = self.stats["files"]
+        print(f"[TRANSCODE] {path} -> {result['compact_bytes']} bytes ({result['cpu_seconds']:.2f}s CPU)")
+        if files % 50 == 0:
+            self.report()
+
+    def take_dirty(self):
+        """True once after transcodes have written to the volume since the last call."""
+        with self.lock:
+            dirty, self.dirty = self.dirty, False
+        return dirty
+
+    def bytes_saved(self):
+        stats = self.stats
+        saved = stats["original_bytes"] - stats["compact_bytes"] - stats["thumbnail_bytes"]
+        # With the original kept, the compact copies are pure overhead
+        return saved - stats["original_bytes"] if self.keep_original else saved
+
+    def report(self):
+        stats = self.stats
+        print(
+            f"[TRANSCODE] {stats['files']} files ({stats['failed']} failed), "
+            f"{stats['cpu_seconds']:.1f}s CPU, {stats['original_bytes'] / 1024**2:.1f} MB in, "
+            f"{(stats['compact_bytes'] + stats['thumbnail_bytes']) / 1024**2:.1f} MB out, "
+            f"{self.bytes_saved() / 1024**2:.1f} MB saved on the volume"
+        )
+
+    def shutdown(self):
+        """Waits for queued transcodes to finish."""
+        self.pool.shutdown(wait=True)
+        self.report()
+
+
+
+class SyncEngine:
+    """
+    Mirrors file changes from watched local directories to the assets volume.
+
+    Events from inotifywait are coalesced per path, so a burst of writes to one
+    file results in a single copy. A file is only copied once it has had no
+    events for the debounce window and its size and mtime are unchanged since
+    the last event, so files still being written are not uploaded. Deletes
+    and moves are mirrored: a move out of a watched tree deletes the volume
+    copy, a move in (or a new directory) copies everything it contains.
+    Pending changes are flushed in batches of at most max_batch_files, with an
+    optional bytes per second limit, followed by one volume commit per batch.
+
+    handle_event() can be fed directly, which keeps the engine testable
+    without inotify.
+    """
+
+    def __init__(
+        self,
+        watched_dirs=SYNC_WATCHED_DIRS,
+        local_root=SYNC_LOCAL_ROOT,
+        backup_root=assets_volume_mount_dir,
+        debounce_seconds=SYNC_DEBOUNCE_SECONDS,
+        max_batch_files=SYNC_MAX_BATCH_FILES,
+        max_bytes_per_second=SYNC_MAX_BYTES_PER_SECOND,
+        commit=None,
+        transcoder=None,
+    ):
+        self.watched_dirs = [pathlib.Path(d) for d in watched_dirs]
+        self.local_root = pathlib.Path(local_root)
+        self.backup_root = pathlib.Path(backup_root)
+        self.debounce_seconds = debounce_seconds
+        self.max_batch_files = max_batch_files
+        self.max_bytes_per_second = max_bytes_per_second
+        self.commit = commit
+        self.transcoder = transcoder
+        # path -> {"op": "copy" | "delete", "since": monotonic time, "stat": (size, mtime) or None}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.watcher = None
+        self.stats = {"copied": 0, "deleted": 0, "bytes": 0, "batches": 0, "conflicts": 0}
+        # Lazily hydrated directories, the local paths linked to (or already
+        # synced over) their volume copies, and volume paths redirected because
+        # a new local file collided with an older volume file of the same name
+        self.hydrated_dirs = []
+        self.counterparts = set()
+        self.redirects = {}
+
+    def backup_path(self, path):
+        if path in self.redirects:
+            return self.redirects[path]
+        return self.backup_root / pathlib.Path(path).relative_to(self.local_root)
+
+    def shadows_volume_file(self, path, target):
+        """
+        True when writing path would replace a volume file from an earlier run
+        that was never linked to path, e.g. an output whose name ComfyUI's
+        counter picked before lazy hydration linked the older file of that
+        name.
+        """
+        if not any(directory == path or directory in path.parents for directory in self.hydrated_dirs):
+            return False
+        with self.lock:
+            if path in self.counterparts:
+                return False
+        return target.exists() and not target.is_symlink()
+
+    def conflict_path(self, target):
+        for n in itertools.count(1):
+            candidate = target.with_name(f"{target.stem}.conflict-{n}{target.suffix}")
+            if not candidate.exists():
+                return candidate
+
+    @staticmethod
+    def file_stat(path):
+        try:
+            stat = path.stat()
+            return (stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            return None
+
+    def is_hydrated_link(self, path):
+        """True for symlinks lazy hydration created; their content is already on the volume."""
+        return path.is_symlink() and self.backup_root in pathlib.Path(os.path.realpath(path)).parents
+
+    def handle_event(self, events, path):
+        """Records an inotify event (comma separated names, e.g. 'MOVED_TO,ISDIR')."""
+        events = set(events.split(","))
+        path = pathlib.Path(path)
+        now = time.monotonic()
+        if "ISDIR" not in events and not events & {"DELETE", "MOVED_FROM"} and self.is_hydrated_link(path):
+            return
+        with self.lock:
+            if events & {"DELETE", "MOVED_FROM"}:
+                self.pending[path] = {"op": "delete", "since": now, "stat": None}
+                if "ISDIR" in events:
+                    # Pending changes inside a removed directory are moot
+                    for other in [p for p in self.pending if path in p.parents]:
+                        del self.pending[other]
+            elif "ISDIR" in events and events & {"CREATE", "MOVED_TO"}:
+                # Files may land in a new directory before its watch is added
+                for child in path.rglob("*"):
+                    if child.is_file() and not self.is_hydrated_link(child):
+                        self.pending[child] = {"op": "copy", "since": now, "stat": self.file_stat(child)}
+            elif events & {"CLOSE_WRITE", "MOVED_TO", "CREATE", "MODIFY"}:
+                self.pending[path] = {"op": "copy", "since": now, "stat": self.file_stat(path)}
+
+    def ready_changes(self):
+        """Pops the pending changes that are stable, up to max_batch_files."""
+        now = time.monotonic()
+        ready = []
+        with self.lock:
+            for path, change in list(self.pending.items()):
+                if len(ready) >= self.max_batch_files:
+                    break
+                if now - change["since"] < self.debounce_seconds:
+                    continue
+                if change["op"] == "copy":
+                    stat = self.file_stat(path)
+                    if stat is not None and stat != change["stat"]:
+                        # Still being written; wait for another quiet window
+                        change.update(since=now, stat=stat)
+                        continue
+                    if stat is None:
+                        # Gone before it was synced; the delete event will follow
+                        del self.pending[path]
+                        continue
+                ready.append((path, change["op"]))
+                del self.pending[path]
+        return ready
+
+    def apply(self, path, op):
+        target = self.backup_path(path)
+        if op == "delete":
+            if target.is_dir() and not target.is_symlink():
+                shutil.rmtree(target, ignore_errors=True)
+            else:
+                target.unlink(missing_ok=True)
+            self.stats["deleted"] += 1
+            return
+
+        if self.shadows_volume_file(path, target):
+            self.redirects[path] = self.conflict_path(target)
+            self.stats["conflicts"] += 1
+            print(f"[WARN] {path} would overwrite the older {target} on the volume, keeping it as {self.redirects[path]}")
+            target = self.redirects[path]
+        target.parent.mkdir(parents=True, exist_ok=True)
+        start = time.monotonic()
+        # Written next to the target and renamed over it, so a symlink at the
+        # target (e.g. a ModelStore link under models/) is replaced rather
+        # than followed into the object it points at
+        tmp_target = target.with_name(f".{target.name}.sync-tmp")
+        tmp_target.unlink(missing_ok=True)
+        try:
+            if path.is_symlink():
+                tmp_target.symlink_to(path.readlink())
+                size = 0
+            else:
+                shutil.copy2(path, tmp_target)
+                size = path.stat().st_size
+            os.replace(tmp_target, target)
+        except BaseException:
+            tmp_target.unlink(missing_ok=True)
+            raise
+        with self.lock:
+            self.counterparts.add(path)
+        self.stats["copied"] += 1
+        self.stats["bytes"] += size
+        if self.max_bytes_per_second:
+            # Stretch the write to the configured rate
+            time.sleep(max(0.0, size / self.max_bytes_per_second - (time.monotonic() - start)))
+
+    def flush(self):
+        """Applies one batch of stable changes. Returns the number applied."""
+        changes = self.ready_changes()
+        for path, op in changes:
+            try:
+                if op == "copy" and self.transcoder and self.transcoder.accepts(path):
+                    # Committed by a later flush once the worker has written it
+                    self.transcoder.submit(path)
+                    if not self.transcoder.keep_original:
+                        continue
+                elif op == "delete" and self.transcoder and self.transcoder.accepts(path):
+                    for target in self.transcoder.targets(path):
+                        target.unlink(missing_ok=True)
+                self.apply(path, op)
+                print(f"[SYNC] {op} {path} -> {self.backup_path(path)}")
+            except FileNotFoundError:
+                # Deleted between the stability check and the copy
+                pass
+            except Exception as e:
+                print(f"[ERROR] Could not sync {path}: {e}")
+        transcoded = self.transcoder.take_dirty() if self.transcoder else False
+        if changes or transcoded:
+            self.stats["batches"] += 1
+            if self.commit:
+                try:
+                    self.commit()
+                except Exception as e:
+                    print(f"[ERROR] Volume commit failed: {e}")
+        return len(changes)
+
+    def load_from_volume(self, directories=SYNC_LOAD_DIRS):
+        """Copies the listed directories from the volume into the container."""
+        for directory in directories:
+            src_dir = self.backup_path(directory)
+            if not src_dir.exists():
+                continue
+            print(f"[INFO] Loading files from volume: {src_dir} -> {directory}")
+            pathlib.Path(directory).mkdir(parents=True, exist_ok=True)
+            result = subprocess.run(["rsync", "-a", f"{src_dir}/", f"{directory}/"])
+            if result.returncode != 0:
+                print(f"[ERROR] Issues encountered while loading files from volume: {src_dir}")
+
+    def hydrate_lazily(self, directories=SYNC_LOAD_DIRS):
+        """
+        Creates the listed directories right away and, in a background
+        thread, recreates their subdirectories from the volume and links
+        every file to its volume copy, so startup does not touch the output
+        history at all. Reads go straight to the volume through the symlinks,
+        and the watcher ignores them, so nothing is copied back. Local files
+        win over volume files of the same name; if one was created before its
+        volume namesake was linked, it is synced under a conflict name rather
+        than overwriting the older file.
+        """
+        trees = []
+        for directory in directories:
+            src_dir = self.backup_path(directory)
+            if not src_dir.exists():
+                continue
+            pathlib.Path(directory).mkdir(parents=True, exist_ok=True)
+            self.hydrated_dirs.append(pathlib.Path(directory))
+            trees.append((src_dir, pathlib.Path(directory)))
+
+        def link_files():
+            linked = 0
+            for src_dir, local_dir in trees:
+                for dirpath, _, filenames in os.walk(src_dir):
+                    relative = pathlib.Path(dirpath).relative_to(src_dir)
+                    (local_dir / relative).mkdir(parents=True, exist_ok=True)
+                    for filename in filenames:
+                        local_path = local_dir / relative / filename
+                        if local_path.exists() or local_path.is_symlink():
+                            continue
+                        try:
+                            local_path.symlink_to(pathlib.Path(dirpath, filename))
+                            with self.lock:
+                                self.counterparts.add(local_path)
+                            linked += 1
+                        except OSError as e:
+                            print(f"[ERROR] Could not link {local_path}: {e}")
+            print(f"[INFO] Lazy hydration linked {linked} files from the volume")
+
+        thread = threading.Thread(target=link_files, daemon=True, name="sync-hydrate")
+        thread.start()
+        return thread
+
+    def watch(self):
+        """
+        Feeds inotifywait events into handle_event until stopped. If
+        inotifywait cannot run or exits (e.g. on hitting
+        fs.inotify.max_user_watches), the watched directories are rescanned
+        every SYNC_RESCAN_SECONDS instead.
+        """
+        for directory in self.watched_dirs:
+            directory.mkdir(parents=True, exist_ok=True)
+        cmd = [
+            "inotifywait", "-m", "-r", "-q",
+            "-e", "close_write,create,delete,moved_from,moved_to",
+            "--format", "%e\t%w%f",
+        ] + [str(d) for d in self.watched_dirs]
+        try:
+            self.watcher = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+            for line in self.watcher.stdout:
+                events, _, path = line.rstrip("\n").partition("\t")
+                if path:
+                    self.handle_event(events, path)
+            reason = f"exited with code {self.watcher.wait()}"
+        except OSError as e:
+            reason = f"could not run: {e}"
+        if self.stopped.is_set():
+            return
+        print(f"[ERROR] inotifywait {reason}; rescanning {len(self.watched_dirs)} directories every {SYNC_RESCAN_SECONDS}s instead")
+        known = self.scan()
+        while not self.stopped.wait(SYNC_RESCAN_SECONDS):
+            current = self.scan()
+            for path, stat in current.items():
+                if known.get(path) != stat:
+                    self.handle_event("CLOSE_WRITE", path)
+            for path in known.keys() - current.keys():
+                self.handle_event("DELETE", path)
+            known = current
+
+    def scan(self):
+        """(size, mtime) of every regular file under the watched directories."""
+        files = {}
+        for directory in self.watched_dirs:
+            for dirpath, _, filenames in os.walk(directory):
+                for filename in filenames:
+                    path = pathlib.Path(dirpath, filename)
+                    if not self.is_hydrated_link(path):
+                        files[path] = self.file_stat(path)
+        return files
+
+    def run_flusher(self):
+        while not self.stopped.wait(min(1.0, self.debounce_seconds / 2) or 0.1):
+            while self.flush():
+                pass
+
+    def start(self):
+        threading.Thread(target=self.watch, daemon=True, name="sync-watch").start()
+        threading.Thread(target=self.run_flusher, daemon=True, name="sync-flush").start()
+        print("Background synchronization engine started.")
+
+    def stop(self):
+        """Stops watching and flushes everything still pending."""
+        if self.watcher:
+            self.watcher.terminate()
+        self.stopped.set()
+        self.debounce_seconds = 0
+        while self.flush():
+            pass
+        if self.transcoder:
+            self.transcoder.shutdown()
+            self.flush()
+
+
+def start_sync_engine(hydration_mode=SYNC_HYDRATION_MODE, transcode=TRANSCODE_OUTPUTS):
+    transcoder = OutputTranscoder() if transcode else None
+    engine = SyncEngine(commit=assets_volume.commit, transcoder=transcoder)
+    if hydration_mode == "lazy":
+        engine.hydrate_lazily()
+    else:
+        engine.load_from_volume()
+    engine.start()
+    return engine
 
-        # Watching the specified directories for changes
-        watched_dirs=("/root/models" "/root/output")
-        inotifywait_cmd="inotifywait -m -r -e close_write,delete,move ${watched_dirs[*]}"
+# Admission-control proxy. ComfyUI itself listens on COMFYUI_PORT inside the
+# container and the proxy takes over the public port, so prompt submissions
+# wait in a bounded queue instead of piling up inside ComfyUI.
+PROXY_PORT = 8188
+COMFYUI_PORT = 8189
+PROXY_MAX_QUEUE_DEPTH = 32  # prompts waiting for a slot before we answer 429
+PROXY_MAX_RUNNING_PROMPTS = 1  # prompts handed to ComfyUI at the same time
+PROXY_MAX_QUEUE_WAIT_SECONDS = 15  # longest a request waits for a slot, well inside the web request timeout
+PROXY_POLL_SECONDS = 0.5  # how often /history is checked for finished prompts
+PROXY_PROMPT_TIMEOUT_SECONDS = 3600  # a prompt still unfinished after this gives up its slot
+PROXY_METRICS_PATH = "/proxy/metrics"
+PROXY_MODELS_RETRY_AFTER = 30  # seconds, for prompts whose models are still prefetching
+PROXY_LATENCY_BUCKETS = [0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600]
 
-        eval "$inotifywait_cmd" | while read -r directory events filename; do
-            echo "[EVENT] Detected ${events} in ${directory} affecting ${filename}"
-            handle_file_event "${directory}" "${filename}"
-        done
-'''
 
-    with open("/root/sync_models.sh", "w") as f:
-        f.write(sync_script)
+class LatencyHistogram:
+    """Cumulative histogram in the Prometheus text exposition format."""
 
-    subprocess.run(["chmod", "+x", "/root/sync_models.sh"], check=True)
-    subprocess.Popen(["nohup", "/root/sync_models.sh", "&"])
-    print("Background synchronization script initiated.")
+    def __init__(self, name, help_text, buckets=PROXY_LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for bound, count in zip(self.buckets, self.counts):
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {count}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum {self.total:.6f}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+class QueueingProxy:
+    """
+    Async reverse proxy in front of the ComfyUI server.
+
+    POST /prompt is admitted through a bounded queue: at most max_running
+    prompts are handed to ComfyUI at once and a prompt is forwarded right
+    away while a slot is free. Otherwise up to max_queue_depth requests wait
+    for one, but never longer than max_queue_wait seconds, so the client's
+    request cannot outlive the web endpoint's timeout; anything turned away
+    gets a 429 with a Retry-After estimated from recent execution times. A
+    submitted prompt holds its slot until it shows up in ComfyUI's /history,
+    which is where the execution latency comes from, or until ComfyUI no
+    longer knows about it (restarted, history cleared) or prompt_timeout
+    passes. Every other request, websockets included, is passed through
+    untouched.
+    """
+
+    def __init__(
+        self,
+        backend_url,
+        max_queue_depth=PROXY_MAX_QUEUE_DEPTH,
+        max_running=PROXY_MAX_RUNNING_PROMPTS,
+        max_queue_wait=PROXY_MAX_QUEUE_WAIT_SECONDS,
+        poll_seconds=PROXY_POLL_SECONDS,
+        prompt_timeout=PROXY_PROMPT_TIMEOUT_SECONDS,
+        readiness=None,
+    ):
+        self.backend_url = backend_url.rstrip("/")
+        self.max_queue_depth = max_queue_depth
+        self.max_running = max_running
+        self.max_queue_wait = max_queue_wait
+        self.poll_seconds = poll_seconds
+        self.prompt_timeout = prompt_timeout
+        self.readiness = readiness
+        self.waiting = 0
+        self.running = 0
+        self.rejected = 0
+        self.failed = 0
+        self.abandoned = 0
+        self.queue_wait = LatencyHistogram(
+            "comfyui_proxy_queue_wait_seconds", "Time prompts spent waiting in the proxy queue"
+        )
+        self.execution = LatencyHistogram(
+            "comfyui_proxy_execution_seconds", "Time from handing a prompt to ComfyUI until it finished"
+        )
+        self.slots = None
+        self.session = None
+
+    def retry_after(self):
+        """Seconds until a queue slot is likely to free up, at least one."""
+        expected = self.execution.mean() or 1.0
+        return max(1, math.ceil(expected * (self.waiting + 1) / self.max_running))
+
+    async def on_startup(self, web_app):
+        import aiohttp
+
+        self.slots = asyncio.Semaphore(self.max_running)
+        self.session = aiohttp.ClientSession(
+            auto_decompress=False, timeout=aiohttp.ClientTimeout(total=None, sock_connect=10)
+        )
+
+    async def on_cleanup(self, web_app):
+        await self.session.close()
+
+    async def handle_prompt(self, request):
+        from aiohttp import web
+
+        if self.waiting >= self.max_queue_depth:
+            return self.reject("queue full")
+
+        self.waiting += 1
+        queued_at = time.monotonic()
+        try:
+            body = await request.read()
+            missing = self.missing_models(body)
+            if missing:
+                # Still being prefetched; nothing to gain from queueing it now
+                return web.json_response(
+                    {"error": "models not ready", "missing": missing},
+                    status=503,
+                    headers={"Retry-After": str(PROXY_MODELS_RETRY_AFTER)},
+                )
+            try:
+                await asyncio.wait_for(self.slots.acquire(), self.max_queue_wait)
+            except asyncio.TimeoutError:
+                return self.reject("no free slot")
+        finally:
+            self.waiting -= 1
+        self.queue_wait.observe(time.monotonic() - queued_at)
+
+        started_at = time.monotonic()
+        self.running += 1
+        handed_over = False
+        try:
+            async with self.session.post(
+                f"{self.backend_url}/prompt", data=body, headers=self.forward_headers(request)
+            ) as response:
+                payload = await response.read()
+                status = response.status
+                headers = self.response_headers(response)
+            prompt_id = None
+            if status == 200:
+                try:
+                    prompt_id = json.loads(payload).get("prompt_id")
+                except ValueError:
+                    pass
+            if prompt_id:
+                asyncio.create_task(self.track_prompt(prompt_id, started_at))
+                handed_over = True
+            else:
+                self.failed += 1
+            return web.Response(body=payload, status=status, headers=headers)
+        except Exception as e:
+            self.failed += 1
+            print(f"Error forwarding prompt to ComfyUI: {e}")
+            return web.json_response({"error": "backend unavailable"}, status=502)
+        finally:
+            if not handed_over:
+                self.release(started_at, record=False)
+
+    def reject(self, reason):
+        from aiohttp import web
+
+        self.rejected += 1
+        return web.json_response(
+            {"error": reason, "queue_depth": self.waiting},
+            status=429,
+            headers={"Retry-After": str(self.retry_after())},
+        )
+
+    def missing_models(self, body):
+        if self.readiness is None:
+            return []
+        try:
+            return self.readiness.missing_for_prompt(json.loads(body).get("prompt") or {})
+        except (ValueError, AttributeError):
+            # Malformed prompts are ComfyUI's to reject
+            return []
+
+    async def track_prompt(self, prompt_id, started_at):
+        """
+        Holds the prompt's slot until ComfyUI reports it in /history. The slot
+        is given up without recording a latency if the prompt is in neither
+        the history nor the queue, or once prompt_timeout has passed.
+        """
+        finished = False
+        try:
+            while time.monotonic() - started_at < self.prompt_timeout:
+                await asyncio.sleep(self.poll_seconds)
+                try:
+                    if await self.in_history(prompt_id):
+                        finished = True
+                        return
+                    if not await self.in_queue(prompt_id) and not await self.in_history(prompt_id):
+                        print(f"Prompt {prompt_id} is no longer known to ComfyUI, releasing its slot")
+                        return
+                except Exception as e:
+                    print(f"Error polling ComfyUI for {prompt_id}: {e}")
+            print(f"Prompt {prompt_id} did not finish within {self.prompt_timeout}s, releasing its slot")
+        finally:
+            if not finished:
+                self.abandoned += 1
+            self.release(started_at, record=finished)
+
+    async def in_history(self, prompt_id):
+        async with self.session.get(f"{self.backend_url}/history/{prompt_id}") as response:
+            response.raise_for_status()
+            return prompt_id in await response.json(content_type=None)
+
+    async def in_queue(self, prompt_id):
+        """Whether the prompt is running or pending; queue entries are [number, prompt_id, ...]."""
+        async with self.session.get(f"{self.backend_url}/queue") as response:
+            response.raise_for_status()
+            queue = await response.json(content_type=None)
+        return any(
+            entry[1] == prompt_id for entry in queue.get("queue_running", []) + queue.get("queue_pending", [])
+        )
+
+    def release(self, started_at, record):
+        if record:
+            self.execution.observe(time.monotonic() - started_at)
+        self.running -= 1
+        self.slots.release()
+
+    async def handle_metrics(self, request):
+        from aiohttp import web
+
+        lines = []
+        for name, help_text, value in (
+            ("comfyui_proxy_queue_depth", "Prompts waiting in the proxy queue", self.waiting),
+            ("comfyui_proxy_running", "Prompts handed to ComfyUI and not finished yet", self.running),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+        for name, help_text, value in (
+            ("comfyui_proxy_rejected_total", "Prompts rejected with 429", self.rejected),
+            ("comfyui_proxy_failed_total", "Prompts ComfyUI did not accept", self.failed),
+            ("comfyui_proxy_abandoned_total", "Prompts whose slot was released without seeing them finish", self.abandoned),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter", f"{name} {value}"]
+        lines += self.queue_wait.render() + self.execution.render()
+        return web.Response(text="\n".join(lines) + "\n", content_type="text/plain")
+
+    @staticmethod
+    def forward_headers(request):
+        skipped = {"host", "content-length", "transfer-encoding", "connection"}
+        return {k: v for k, v in request.headers.items() if k.lower() not in skipped}
+
+    @staticmethod
+    def response_headers(response):
+        skipped = {"content-length", "transfer-encoding", "connection"}
+        return {k: v for k, v in response.headers.items() if k.lower() not in skipped}
+
+    async def handle_passthrough(self, request):
+        from aiohttp import web
+
+        if request.headers.get("Upgrade", "").lower() == "websocket":
+            return await self.handle_websocket(request)
+        url = f"{self.backend_url}{request.rel_url}"
+        try:
+            async with self.session.request(
+                request.method, url, data=request.content if request.can_read_body else None,
+                headers=self.forward_headers(request), allow_redirects=False,
+            ) as response:
+                proxied = web.StreamResponse(status=response.status, headers=self.response_headers(response))
+                await proxied.prepare(request)
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    await proxied.write(chunk)
+                await proxied.write_eof()
+                return proxied
+        except Exception as e:
+            print(f"Error proxying {request.method} {request.rel_url}: {e}")
+            return web.json_response({"error": "backend unavailable"}, status=502)
+
+    async def handle_websocket(self, request):
+        import aiohttp
+        from aiohttp import web
+
+        client = web.WebSocketResponse()
+        await client.prepare(request)
+        async with self.session.ws_connect(f"{self.backend_url}{request.rel_url}") as backend:
+
+            async def pump(source, target):
+                async for message in source:
+                    if message.type == aiohttp.WSMsgType.TEXT:
+                        await target.send_str(message.data)
+                    elif message.type == aiohttp.WSMsgType.BINARY:
+                        await target.send_bytes(message.data)
+                    else:
+                        break
+
+            tasks = [asyncio.create_task(pump(client, backend)), asyncio.create_task(pump(backend, client))]
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in tasks:
+                task.cancel()
+        await client.close()
+        return client
+
+    def make_app(self):
+        from aiohttp import web
+
+        web_app = web.Application(client_max_size=1024**3)
+        web_app.on_startup.append(self.on_startup)
+        web_app.on_cleanup.append(self.on_cleanup)
+        web_app.router.add_get(PROXY_METRICS_PATH, self.handle_metrics)
+        web_app.router.add_post("/prompt", self.handle_prompt)
+        web_app.router.add_route("*", "/{tail:.*}", self.handle_passthrough)
+        return web_app
+
+
+def make_stub_backend(execution_seconds=1.0):
+    """
+    Minimal stand-in for ComfyUI's /prompt and /history API, for exercising
+    the proxy locally without a GPU. Each prompt "finishes" execution_seconds
+    after it was submitted.
+    """
+    from aiohttp import web
+
+    submitted = {}
+
+    async def prompt(request):
+        prompt_id = str(uuid.uuid4())
+        submitted[prompt_id] = time.monotonic()
+        return web.json_response({"prompt_id": prompt_id, "number": len(submitted)})
+
+    async def history(request):
+        prompt_id = request.match_info["prompt_id"]
+        finished = time.monotonic() - submitted.get(prompt_id, float("inf")) >= execution_seconds
+        return web.json_response({prompt_id: {"outputs": {}}} if finished else {})
+
+    async def queue(request):
+        now = time.monotonic()
+        running = [
+            [number, prompt_id, {}, {}, []]
+            for number, (prompt_id, at) in enumerate(submitted.items())
+            if now - at < execution_seconds
+        ]
+        return web.json_response({"queue_running": running, "queue_pending": []})
+
+    stub = web.Application()
+    stub.router.add_post("/prompt", prompt)
+    stub.router.add_get("/history/{prompt_id}", history)
+    stub.router.add_get("/queue", queue)
+    return stub
+
+
+def start_queueing_proxy(backend_port=COMFYUI_PORT, port=PROXY_PORT, **kwargs):
+    """Runs the proxy on its own event loop in a daemon thread."""
+    from aiohttp import web
+
+    proxy = QueueingProxy(f"http://127.0.0.1:{backend_port}", **kwargs)
+    threading.Thread(
+        target=web.run_app,
+        args=(proxy.make_app(),),
+        kwargs={"host": "0.0.0.0", "port": port, "print": None, "handle_signals": False},
+        daemon=True,
+        name="comfyui-proxy",
+    ).start()
+    print(f"Queueing proxy listening on port {port}, forwarding to {backend_port}")
+    return proxy
+
+# Startup orchestration for web(). Hydration, the config check and the server
+# launch run concurrently; readiness is polled instead of assumed.
+STARTUP_READY_TIMEOUT = 600  # seconds ComfyUI gets to answer its HTTP API
+STARTUP_POLL_SECONDS = 0.25
+STARTUP_READY_PATH = "/system_stats"
+STARTUP_TIMELINE_PATH = "/root/startup_timeline.json"
+EXTRA_MODEL_PATHS_FILE = "/root/extra_model_paths.yaml"
+
+
+class StartupTimeline:
+    """Records when each startup phase began and ended, relative to container start."""
+
+    def __init__(self):
+        self.origin = time.monotonic()
+        self.phases = []
+        self.lock = threading.Lock()
+
+    def phase(self, name):
+        @contextlib.contextmanager
+        def record():
+            start = time.monotonic()
+            entry = {"phase": name, "ok": False}
+            try:
+                yield entry
+                entry["ok"] = True
+            finally:
+                end = time.monotonic()
+                entry["start"] = round(start - self.origin, 3)
+                entry["end"] = round(end - self.origin, 3)
+                entry["seconds"] = round(end - start, 3)
+                with self.lock:
+                    self.phases.append(entry)
+
+        return record()
+
+    def report(self, path=STARTUP_TIMELINE_PATH):
+        phases = sorted(self.phases, key=lambda p: p["start"])
+        print("Startup timeline:")
+        for p in phases:
+            status = "ok" if p["ok"] else "FAILED"
+            print(f"  {p['phase']:<20} {p['start']:>8.2f}s -> {p['end']:>8.2f}s  ({p['seconds']:.2f}s, {status})")
+        if phases:
+            slowest = max(phases, key=lambda p: p["seconds"])
+            print(f"  ready after {max(p['end'] for p in phases):.2f}s, dominated by '{slowest['phase']}'")
+        try:
+            pathlib.Path(path).write_text(json.dumps(phases, indent=2))
+        except OSError as e:
+            print(f"Could not write startup timeline to {path}: {e}")
+
+
+def wait_for_port(port, host="127.0.0.1", timeout=STARTUP_READY_TIMEOUT, process=None):
+    """Polls until something accepts TCP connections on host:port."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Process exited with code {process.returncode} before port {port} opened")
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            time.sleep(STARTUP_POLL_SECONDS)
+    raise TimeoutError(f"Port {port} did not open within {timeout}s")
+
+
+def wait_for_http(url, timeout=STARTUP_READY_TIMEOUT, process=None):
+    """Polls until url answers with a 2xx status."""
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Process exited with code {process.returncode} before {url} was ready")
+        try:
+            if httpx.get(url, timeout=2).is_success:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(STARTUP_POLL_SECONDS)
+    raise TimeoutError(f"{url} was not ready within {timeout}s")
+
+
+def check_comfyui_config(path=EXTRA_MODEL_PATHS_FILE):
+    """Validates the extra model paths file and creates missing model directories."""
+    with open(path) as f:
+        config = yaml.safe_load(f)
+    for section in config.values():
+        base_path = pathlib.Path(section.get("base_path", ""))
+        for key, value in section.items():
+            if key != "base_path":
+                (base_path / value).mkdir(parents=True, exist_ok=True)
+
+
+def launch_comfyui(port=COMFYUI_PORT):
+    return subprocess.Popen(
+        ["python", "main.py", "--dont-print-server", "--multi-user", "--listen", "127.0.0.1", "--port", str(port)],
+        cwd="/root",
+    )
+
+
+def orchestrate_startup(timeline=None, ready_timeout=STARTUP_READY_TIMEOUT):
+    """
+    Brings up the container's services, running independent phases in
+    parallel, and returns once ComfyUI answers its API.
+    Returns the ComfyUI process, the proxy and the sync engine.
+    """
+    timeline = timeline or StartupTimeline()
+    # Models appear to ComfyUI as they finish; prompts needing one that has
+    # not arrived yet are turned away by the proxy
+    with timeline.phase("asset_prefetch_start"):
+        _, readiness = start_asset_prefetch()
+
+    def bring_up_comfyui():
+        with timeline.phase("comfyui_launch"):
+            process = launch_comfyui()
+        with timeline.phase("comfyui_port"):
+            wait_for_port(COMFYUI_PORT, timeout=ready_timeout, process=process)
+        with timeline.phase("comfyui_api"):
+            wait_for_http(f"http://127.0.0.1:{COMFYUI_PORT}{STARTUP_READY_PATH}", timeout=ready_timeout, process=process)
+        return process
+
+    def bring_up_proxy():
+        with timeline.phase("proxy"):
+            proxy = start_queueing_proxy(readiness=readiness)
+            wait_for_port(PROXY_PORT, timeout=ready_timeout)
+        return proxy
+
+    def hydrate():
+        with timeline.phase("hydration"):
+            return start_sync_engine()
+
+    def check_config():
+        with timeline.phase("config_check"):
+            check_comfyui_config()
+
+    try:
+        with ThreadPoolExecutor(max_workers=4, thread_name_prefix="startup") as pool:
+            config = pool.submit(check_config)
+            comfyui = pool.submit(bring_up_comfyui)
+            proxy = pool.submit(bring_up_proxy)
+            engine = pool.submit(hydrate)
+            # A broken config is only logged, ComfyUI falls back to its own paths
+            try:
+                config.result()
+            except Exception as e:
+                print(f"ComfyUI config check failed: {e}")
+            return comfyui.result(), proxy.result(), engine.result()
+    finally:
+        timeline.report()
+
+# Headless batch execution of workflows exported with ComfyUI-to-Python-Extension
+# ("Save as Script"). Each exported script defines main(); jobs name a script
+# under WORKFLOWS_DIRECTORY and optionally the checkpoint it uses, which is
+# how jobs are grouped so containers keep hitting the same cached model.
+WORKFLOWS_DIRECTORY = f"{assets_volume_mount_dir}/workflows"
+BATCH_OUTPUT_DIRECTORY = f"{assets_volume_mount_dir}/output/batch"
+MODEL_CACHE_SIZE = 2  # checkpoints kept resident per container
+BATCH_SIZE = 4  # jobs per .map() input
+WARM_CHECKPOINTS = []  # loaded into the cache in @enter, e.g. ["sd_xl_base_1.0.safetensors"]
+
+
+class ModelCache:
+    """Least recently used cache of loaded models, keyed by checkpoint."""
+
+    def __init__(self, capacity=MODEL_CACHE_SIZE):
+        self.capacity = capacity
+        self.models = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "load_seconds": 0.0}
+
+    def get_or_load(self, key, load):
+        with self.lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                self.stats["hits"] += 1
+                return self.models[key]
+            self.stats["misses"] += 1
+            start = time.monotonic()
+            model = load()
+            self.stats["load_seconds"] += time.monotonic() - start
+            self.models[key] = model
+            while len(self.models) > self.capacity:
+                evicted, _ = self.models.popitem(last=False)
+                self.stats["evictions"] += 1
+                print(f"Evicted {evicted} from the model cache")
+            return model
+
+
+class ComfyWorkflowExecutor:
+    """
+    Runs exported workflow scripts inside this process, with ComfyUI's
+    checkpoint loader routed through a ModelCache so repeated workflows reuse
+    the loaded model instead of reading it from the volume again.
+    """
+
+    def __init__(self, cache, comfyui_directory="/root", workflows_directory=WORKFLOWS_DIRECTORY):
+        self.cache = cache
+        self.comfyui_directory = comfyui_directory
+        self.workflows_directory = pathlib.Path(workflows_directory)
+        self.modules = {}
+        self.load_checkpoint = None
+
+    def load(self):
+        os.chdir(self.comfyui_directory)  # exported scripts look for extra_model_paths.yaml from here
+        sys.path.insert(0, self.comfyui_directory)
+        import nodes
+
+        nodes.init_extra_nodes()
+        loader_class = nodes.NODE_CLASS_MAPPINGS["CheckpointLoaderSimple"]
+        original = loader_class.load_checkpoint
+        cache = self.cache
+
+        def load_checkpoint(loader, ckpt_name, *args, **kwargs):
+            return cache.get_or_load(ckpt_name, lambda: original(loader, ckpt_name, *args, **kwargs))
+
+        loader_class.load_checkpoint = load_checkpoint
+        self.load_checkpoint = lambda name: load_checkpoint(loader_class(), name)
+
+    def warm(self, checkpoints):
+        for checkpoint in checkpoints:
+            self.load_checkpoint(checkpoint)
+
+    def workflow_module(self, name):
+        if name not in self.modules:
+            path = self.workflows_directory / name
+            spec = importlib.util.spec_from_file_location(f"workflow_{path.stem}", path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            self.modules[name] = module
+        return self.modules[name]
+
+    def run(self, job):
+        self.workflow_module(job["workflow"]).main(**job.get("kwargs", {}))
+
+
+class StubWorkflowExecutor:
+    """
+    Stand-in for ComfyWorkflowExecutor that needs neither ComfyUI nor a GPU:
+    loading a checkpoint and running a workflow are simulated with sleeps.
+    """
+
+    def __init__(self, cache, load_seconds=0.5, run_seconds=0.05):
+        self.cache = cache
+        self.load_seconds = load_seconds
+        self.run_seconds = run_seconds
+
+    def load(self):
+        pass
+
+    def warm(self, checkpoints):
+        for checkpoint in checkpoints:
+            self.cache.get_or_load(checkpoint, lambda: time.sleep(self.load_seconds) or checkpoint)
+
+    def run(self, job):
+        if job.get("checkpoint"):
+            self.warm([job["checkpoint"]])
+        time.sleep(self.run_seconds)
+
+
+def run_workflow_batch(executor, jobs, output_directory="/root/output", batch_output_directory=None):
+    """
+    Runs jobs one after another on an executor and returns a record per job.
+    Files a job adds to output_directory are copied to batch_output_directory
+    when one is given.
+    """
+    output_directory = pathlib.Path(output_directory)
+    results = []
+    for job in jobs:
+        before = set(output_directory.rglob("*")) if output_directory.exists() else set()
+        hits = executor.cache.stats["hits"]
+        start = time.monotonic()
+        result = {"workflow": job["workflow"], "checkpoint": job.get("checkpoint")}
+        try:
+            executor.run(job)
+            result["ok"] = True
+        except Exception as e:
+            print(f"Error running workflow {job['workflow']}: {e}")
+            result.update(ok=False, error=str(e))
+        result["seconds"] = round(time.monotonic() - start, 3)
+        result["cache_hit"] = executor.cache.stats["hits"] > hits
+        outputs = sorted(set(output_directory.rglob("*")) - before) if output_directory.exists() else []
+        result["outputs"] = [str(p.relative_to(output_directory)) for p in outputs if p.is_file()]
+        if batch_output_directory:
+            for relative in result["outputs"]:
+                target = pathlib.Path(batch_output_directory, relative)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(output_directory / relative, target)
+        results.append(result)
+    return results
+
+
+def plan_workflow_batches(jobs, batch_size=BATCH_SIZE):
+    """Splits jobs into batches, keeping jobs for the same checkpoint together."""
+    by_checkpoint = {}
+    for job in jobs:
+        by_checkpoint.setdefault(job.get("checkpoint"), []).append(job)
+    ordered = [job for group in by_checkpoint.values() for job in group]
+    return [ordered[i:i + batch_size] for i in range(0, len(ordered), batch_size)]
+
+
+def run_stub_batches(batches, load_seconds=0.5, run_seconds=0.05):
+    """
+    Runs planned batches in this process on StubWorkflowExecutor, sharing
+    one model cache the way a single BatchWorkflowRunner container does, so
+    the batching can be tried out without Modal or a GPU.
+    """
+    executor = StubWorkflowExecutor(ModelCache(), load_seconds=load_seconds, run_seconds=run_seconds)
+    executor.load()
+    executor.warm(WARM_CHECKPOINTS)
+    results = [run_workflow_batch(executor, batch) for batch in batches]
+    print(f"Model cache: {executor.cache.stats}")
+    return results
+
+
+def report_workflow_results(results):
+    records = [record for batch in results for record in batch]
+    failed = [record for record in records if not record["ok"]]
+    hits = sum(1 for record in records if record["cache_hit"])
+    print(f"{len(records) - len(failed)} jobs succeeded, {len(failed)} failed, {hits} model cache hits")
+    for record in failed:
+        print(f"  {record['workflow']}: {record['error']}")
+    return records
 
 comfyui_commit_sha = "daa92a8ff4d3e75a3b17bb1a6b6c508b27264ff5"
 
@@ -211,8 +1868,12 @@ image = (
         "requests",
         "tqdm",
     )
-    .run_function(download_assets)
-    .run_function(download_plugins)
+    .run_function(
+        download_assets,
+        volumes={assets_volume_mount_dir: assets_volume},
+        kwargs={"max_priority": BUILD_PREFETCH_MAX_PRIORITY},
+    )
+    .run_function(download_plugins, volumes={pip_cache_mount_dir: pip_cache_volume})
     .run_function(configure_comfyui)
 )
 app = modal.App(
@@ -228,9 +1889,65 @@ app = modal.App(
     timeout=60*60*24,
     volumes={assets_volume_mount_dir: assets_volume}, _allow_background_volume_commits=True
 )
-@modal.web_server(8188, startup_timeout=30)
+@modal.web_server(PROXY_PORT, startup_timeout=30)
 def web():
-    cmd = "python main.py --dont-print-server --multi-user --listen --port 8188"
-    subprocess.Popen(cmd, shell=True)
+    # Returns only once ComfyUI answers its API, so the web_server startup
+    # timeout no longer has to cover model loading and hydration
+    orchestrate_startup()
     print("Started ComfyUI server")
-    run_sync_script()
\ No newline at end of file
+
+
+@app.cls(
+    gpu="t4",
+    timeout=60*60,
+    volumes={assets_volume_mount_dir: assets_volume},
+)
+class BatchWorkflowRunner:
+    @enter()
+    def load(self):
+        self.executor = ComfyWorkflowExecutor(ModelCache())
+        self.executor.load()
+        self.executor.warm(WARM_CHECKPOINTS)
+
+    @modal.method()
+    def run_batch(self, jobs):
+        assets_volume.reload()  # pick up workflows and models added since the container started
+        results = run_workflow_batch(self.executor, jobs, batch_output_directory=BATCH_OUTPUT_DIRECTORY)
+        assets_volume.commit()
+        print(f"Batch of {len(jobs)} done, model cache: {self.executor.cache.stats}")
+        return results
+
+
+@app.local_entrypoint()
+def run_workflows(jobs_file: str, batch_size: int = BATCH_SIZE, stub: bool = False):
+    """
+    Runs the jobs in a JSON file (a list of {"workflow", "checkpoint",
+    "kwargs"}) across containers. --stub runs them in this process with
+    StubWorkflowExecutor instead, to try out batching without a GPU; running
+    this file directly with python does the same without going through Modal.
+    """
+    jobs = json.loads(pathlib.Path(jobs_file).read_text())
+    batches = plan_workflow_batches(jobs, batch_size)
+    print(f"Running {len(jobs)} jobs in {len(batches)} batches")
+    if stub:
+        results = run_stub_batches(batches)
+    else:
+        results = list(BatchWorkflowRunner().run_batch.map(batches))
+    report_workflow_results(results)
+
+
+if __name__ == "__main__":
+    # python scripts/comfy_ui-class.py jobs.json --batch-size 4
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a jobs file through the batch planner on the stub executor")
+    parser.add_argument("jobs_file", help='JSON list of {"workflow", "checkpoint", "kwargs"}')
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--load-seconds", type=float, default=0.5, help="Simulated checkpoint load time")
+    parser.add_argument("--run-seconds", type=float, default=0.05, help="Simulated workflow run time")
+    args = parser.parse_args()
+
+    jobs = json.loads(pathlib.Path(args.jobs_file).read_text())
+    batches = plan_workflow_batches(jobs, args.batch_size)
+    print(f"Running {len(jobs)} jobs in {len(batches)} batches on the stub executor")
+    report_workflow_results(run_stub_batches(batches, args.load_seconds, args.run_seconds))
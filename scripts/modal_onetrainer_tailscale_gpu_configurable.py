@@ -1,165 +1,334 @@
-# modal_onetrainer_tailscale_gpu_configurable.py
-
-import asyncio
-from functools import cache
-import os
-import subprocess
-import time
-import modal
-import logging
-
-
-# Basic Logging Setup
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# Configuration parameters
-PYTHON_VERSION = "3.10"
-DEBIAN_PACKAGES = [
-    "git", "rsync", "curl", "ssh",
-    "dbus", "x11-xserver-utils", "dbus-x11", "xfce4", "tightvncserver",
-    "libgl1", "xfonts-base", "software-properties-common", "build-essential",
-    "apt-utils", "ca-certificates", "kmod", "tk"
-]
-REPOSITORY_URL = "https://github.com/Nerogar/OneTrainer"
-REPOSITORY_DIR = "/OneTrainer"
-GPU_TYPE = "A100"
-VOLUME = "assets"
-VOLUME_MOUNT_PATH = os.path.join(REPOSITORY_DIR, VOLUME)
-VNC_PASSWORD = "modal"
-VNC_DISPLAY = "1"
-VNC_RESOLUTION = "1920x1080"
-VNC_DEPTH = "24"
-TAILSCALE_AUTHKEY_ENV_VAR = "TAILSCALE_AUTHKEY"
-# Add the auth key to secrets using the command:
-# modal secret create tailscale-auth TAILSCALE_AUTHKEY=<auth-key>
-
-def create_image():
-    """Creates and configures a Modal image."""
-    image = modal.Image.debian_slim(python_version=PYTHON_VERSION)
-    image = image.apt_install(*DEBIAN_PACKAGES)
-    image = image.run_commands(
-        "curl -fsSL https://tailscale.com/install.sh | sh",
-        f"git clone {REPOSITORY_URL} {REPOSITORY_DIR}",
-        f"cd {REPOSITORY_DIR} && python3 -m pip install -r requirements.txt",
-        gpu="t4"
-    )
-    return image
-
-app = modal.App(image=create_image())
-
-# Create or get a reference to an existing volume
-assets_volume = modal.Volume.from_name(VOLUME, create_if_missing=True)
-
-@app.function(
-    gpu=GPU_TYPE,
-    secrets=[modal.Secret.from_name("tailscale-auth")],
-    container_idle_timeout=None,
-    keep_warm=1,
-    timeout=60*60*24,
-    volumes={VOLUME_MOUNT_PATH: assets_volume},
-    _allow_background_volume_commits=True
-)
-def run_container():
-    """Runs the main container process, setting up Tailscale, VNC, and the UI."""
-    try:
-        tailscale_ip = start_tailscale_and_get_ip()
-        if tailscale_ip:
-            logging.info(f"SSH into the container using: ssh root@{tailscale_ip}")
-        else:
-            logging.error("Failed to retrieve Tailscale IP")
-
-        setup_and_start_vnc(VNC_PASSWORD, VNC_DISPLAY, VNC_RESOLUTION, VNC_DEPTH, tailscale_ip)
-        run_onetrainer_ui(VNC_DISPLAY)
- 
-        while True:
-            time.sleep(1)
-
-    except KeyboardInterrupt:
-        logging.info("KeyboardInterrupt caught. Shutting down gracefully...")
-        subprocess.run(["ps", "aux"], check=True)
-        subprocess.run(["tailscale", "down"], check=True)
-    except Exception as e:
-        logging.error(f"Error occurred: {e}")
-
-def start_tailscale_and_get_ip() -> str:
-    """Starts the Tailscale daemon and retrieves the Tailscale IP address."""
-    try:
-        # Start Tailscale daemon
-        with open("tailscaled.log", "w") as log_file:
-            subprocess.Popen(
-                ["tailscaled", "--tun=userspace-networking"],
-                stdout=log_file,
-                stderr=subprocess.STDOUT
-            )
-        time.sleep(2)  # Allow time for the daemon to start
-
-        # Retrieve auth key and start Tailscale
-        ts_authkey = os.getenv(TAILSCALE_AUTHKEY_ENV_VAR)
-        if not ts_authkey:
-            raise ValueError(f"{TAILSCALE_AUTHKEY_ENV_VAR} environment variable is not set.")
-
-        subprocess.run(["tailscale", "up", "--authkey", ts_authkey, "--ssh"], check=True)
-
-        # Retrieve and return the Tailscale IP address
-        result = subprocess.run(["tailscale", "ip"], check=True, capture_output=True, text=True)
-        for line in result.stdout.splitlines():
-            if line.startswith("100."):
-                logging.info(f"Tailscale IP: {line}")
-                return line
-    
-    except Exception as e:
-        logging.error(f"Error occurred during Tailscale setup: {e}")
-        return ""
-    
-    return ""
-
-
-def setup_and_start_vnc(password: str, display: str, resolution: str, depth: str, tailscale_ip: str):
-    """Sets up and starts a VNC server."""
-    try:
-        os.environ["USER"] = "root"
-        os.system("mkdir -p /run/dbus")
-        os.system("dbus-daemon --system")
-        os.system("dbus-daemon --session --fork")
-
-        vnc_password_file = f"/root/.vnc/passwd"
-        os.system(f"mkdir -p /root/.vnc && echo '{password}'| vncpasswd -f > {vnc_password_file}")
-        os.chmod(vnc_password_file, 0o600)
-        
-        with open("vncserver.log", "w") as vnc_log:
-            subprocess.Popen(
-                ["vncserver", f":{display}", "-geometry", resolution, "-depth", depth],
-                stdout=vnc_log,
-                stderr=subprocess.STDOUT,
-            )
-        logging.info(f"VNC Server running on display :{display} at resolution {resolution}")
-        logging.info(f"Use the following SSH command for VNC access:\nssh -L 590{display}:localhost:590{display} root@{tailscale_ip}")
-
-    except Exception as e:
-        logging.error(f"VNC Setup failed: {e}")
-
-def run_onetrainer_ui(display: str):
-    """Starts the OneTrainer UI on the specified VNC display."""
-    try:
-        os.environ["DISPLAY"] = f":{display}"
-        os.environ["USER"] = "root"
-        os.system("touch /root/.Xresources")  # Ensure X resources exists
-
-        log_file_path = "/root/OneTrainer.log"
-        with open(log_file_path, "w") as log_file:
-            os.chdir(REPOSITORY_DIR)
-            subprocess.Popen(
-                ["python3", "scripts/train_ui.py"],
-                stdout=log_file,
-                stderr=subprocess.STDOUT
-            )
-        logging.info(f"OneTrainer UI started on display :{display}")
-        logging.info(f"Logs are available at {log_file_path}")
-
-    except Exception as e:
-        logging.error(f"OneTrainer UI failed to start: {e}")
-
-
-@app.local_entrypoint()
-def main():
+# modal_onetrainer_tailscale_gpu_configurable.py
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+import hashlib
+import json
+import os
+import shutil
+import signal
+import subprocess
+import threading
+import time
+import modal
+import logging
+
+from process_supervisor import ProcessSupervisor
+from service_startup import (
+    ServiceGraph, add_remote_desktop_services, log_access, restart_tailscale, restart_vnc, vnc_pid
+)
+
+# Basic Logging Setup
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Configuration parameters
+PYTHON_VERSION = "3.10"
+DEBIAN_PACKAGES = [
+    "git", "rsync", "curl", "ssh",
+    "dbus", "x11-xserver-utils", "dbus-x11", "xfce4", "tightvncserver",
+    "libgl1", "xfonts-base", "software-properties-common", "build-essential",
+    "apt-utils", "ca-certificates", "kmod", "tk"
+]
+REPOSITORY_URL = "https://github.com/Nerogar/OneTrainer"
+REPOSITORY_DIR = "/OneTrainer"
+GPU_TYPE = "A100"
+VOLUME = "assets"
+VOLUME_MOUNT_PATH = os.path.join(REPOSITORY_DIR, VOLUME)
+VNC_PASSWORD = "modal"
+VNC_DISPLAY = "1"
+VNC_RESOLUTION = "1920x1080"
+VNC_DEPTH = "24"
+TAILSCALE_AUTHKEY_ENV_VAR = "TAILSCALE_AUTHKEY"
+PROCESS_SAMPLE_INTERVAL = 30  # seconds between CPU/RSS samples of the supervised processes
+SUPERVISOR_STATUS_PATH = "/root/supervisor_status.json"
+# Dataset staging: DATASET_NAME (a directory under assets/datasets on the
+# volume) is copied to STAGED_DATASETS_DIR on local disk before the UI
+# starts; point the concept paths in OneTrainer at the staged copy. Leave it
+# empty to skip staging.
+DATASET_NAME = ""
+DATASETS_DIR = os.path.join(VOLUME_MOUNT_PATH, "datasets")
+STAGED_DATASETS_DIR = "/root/datasets"
+# OneTrainer config (relative to the volume) that the latent and text
+# embedding caches depend on; hashed together with the dataset contents.
+# Leave it empty to neither restore nor persist the caches: without it they
+# could be reused after the model or resolution changed
+TRAINING_CONFIG = ""
+# OneTrainer's cache_dir. Restored from PERSISTENT_CACHE_DIR/<key> before the
+# UI starts and saved back periodically and on exit, so a restarted run on
+# the same data and config skips re-encoding
+LOCAL_CACHE_DIR = os.path.join(REPOSITORY_DIR, "workspace-cache", "run")
+PERSISTENT_CACHE_DIR = os.path.join(VOLUME_MOUNT_PATH, "onetrainer-cache")
+CACHE_PERSIST_INTERVAL = 10 * 60
+CACHE_PERSIST_LOCK = threading.Lock()  # the periodic and the final save must not copy at once
+COPY_WORKERS = 16
+COPY_CHUNK_SIZE = 4 * 1024 * 1024
+# Add the auth key to secrets using the command:
+# modal secret create tailscale-auth TAILSCALE_AUTHKEY=<auth-key>
+
+def create_image():
+    """Creates and configures a Modal image."""
+    image = modal.Image.debian_slim(python_version=PYTHON_VERSION)
+    image = image.apt_install(*DEBIAN_PACKAGES)
+    image = image.run_commands(
+        "curl -fsSL https://tailscale.com/install.sh | sh",
+        f"git clone {REPOSITORY_URL} {REPOSITORY_DIR}",
+        f"cd {REPOSITORY_DIR} && python3 -m pip install -r requirements.txt",
+        gpu="t4"
+    )
+    image = image.add_local_python_source("service_startup", "process_supervisor")
+    return image
+
+app = modal.App(image=create_image())
+
+# Create or get a reference to an existing volume
+assets_volume = modal.Volume.from_name(VOLUME, create_if_missing=True)
+
+@app.function(
+    gpu=GPU_TYPE,
+    secrets=[modal.Secret.from_name("tailscale-auth")],
+    container_idle_timeout=None,
+    keep_warm=1,
+    timeout=60*60*24,
+    volumes={VOLUME_MOUNT_PATH: assets_volume},
+    _allow_background_volume_commits=True
+)
+def run_container():
+    """Runs the main container process, setting up Tailscale, VNC, and the UI."""
+    cache_key = None
+    # Modal stops containers with SIGTERM; handle it like Ctrl-C so the cache is saved on the way out
+    signal.signal(signal.SIGTERM, interrupt_on_sigterm)
+    try:
+        # Tailscale and dbus/VNC come up concurrently; the UI only waits for VNC
+        services = add_remote_desktop_services(
+            ServiceGraph(),
+            TAILSCALE_AUTHKEY_ENV_VAR,
+            VNC_PASSWORD, VNC_DISPLAY, VNC_RESOLUTION, VNC_DEPTH,
+        )
+        # Staging runs alongside the desktop services; the UI waits for both
+        services.add("dataset", lambda started: prepare_training_data())
+        services.add("onetrainer", lambda started: run_onetrainer_ui(VNC_DISPLAY), depends_on=["vnc", "dataset"])
+        services.run()
+        log_access(services, VNC_DISPLAY)
+        if "onetrainer" not in services.started:
+            # Nothing would be left to supervise, and waiting would only keep the GPU billed
+            raise RuntimeError("OneTrainer UI did not start, see the startup timeline above; shutting down")
+        cache_key = services.results.get("dataset")
+        if cache_key:
+            start_cache_persister(cache_key)
+
+        # The container only lives as long as the UI does: once train_ui.py
+        # keeps crashing, wait() returns and the GPU is released
+        supervisor = ProcessSupervisor(PROCESS_SAMPLE_INTERVAL, status_path=SUPERVISOR_STATUS_PATH).start()
+        supervisor.watch(
+            "onetrainer", lambda: run_onetrainer_ui(VNC_DISPLAY),
+            process=services.started["onetrainer"], critical=True,
+        )
+        if "tailscale" in services.results:
+            supervisor.watch(
+                "tailscaled", lambda: restart_tailscale(TAILSCALE_AUTHKEY_ENV_VAR),
+                process=services.started["tailscaled"],
+            )
+        if "vnc" in services.results:
+            supervisor.watch(
+                "vnc", lambda: restart_vnc(VNC_PASSWORD, VNC_DISPLAY, VNC_RESOLUTION, VNC_DEPTH),
+                process=vnc_pid(VNC_DISPLAY),
+            )
+        logging.info(f"Supervisor status is written to {SUPERVISOR_STATUS_PATH}")
+        final_status = supervisor.wait()
+        logging.error(f"OneTrainer can no longer be restarted, shutting down: {final_status}")
+        supervisor.stop()
+
+    except KeyboardInterrupt:
+        logging.info("KeyboardInterrupt caught. Shutting down gracefully...")
+        subprocess.run(["ps", "aux"], check=True)
+        subprocess.run(["tailscale", "down"], check=True)
+    except Exception as e:
+        logging.error(f"Error occurred: {e}")
+    finally:
+        # Saves what was cached since the last periodic save, however the container stops
+        if cache_key:
+            persist_cache(cache_key)
+
+
+def interrupt_on_sigterm(signum, frame):
+    """SIGTERM handler that raises KeyboardInterrupt in the main thread."""
+    raise KeyboardInterrupt
+
+
+def run_onetrainer_ui(display: str) -> subprocess.Popen:
+    """Starts the OneTrainer UI on the specified VNC display and returns its process."""
+    try:
+        os.environ["DISPLAY"] = f":{display}"
+        os.environ["USER"] = "root"
+        os.system("touch /root/.Xresources")  # Ensure X resources exists
+
+        log_file_path = "/root/OneTrainer.log"
+        # Appended to, so the output before a restart is kept
+        with open(log_file_path, "a") as log_file:
+            os.chdir(REPOSITORY_DIR)
+            process = subprocess.Popen(
+                ["python3", "scripts/train_ui.py"],
+                stdout=log_file,
+                stderr=subprocess.STDOUT
+            )
+        logging.info(f"OneTrainer UI started on display :{display}")
+        logging.info(f"Logs are available at {log_file_path}")
+        return process
+
+    except Exception as e:
+        logging.error(f"OneTrainer UI failed to start: {e}")
+        raise
+
+
+def copy_tree(source: str, target: str, workers: int = COPY_WORKERS, hash_files: bool = False, prune: bool = False) -> dict:
+    """
+    Copies the files under source to target with a pool of workers, skipping
+    files whose size and mtime already match. With hash_files, every source
+    file is hashed (while it is copied, or read once if it was skipped) and the
+    SHA-256 per relative path is returned. With prune, files under target that
+    are not in source are removed.
+    """
+    files = []
+    for dirpath, _, filenames in os.walk(source):
+        for filename in filenames:
+            files.append(os.path.relpath(os.path.join(dirpath, filename), source))
+
+    stats = {"files": len(files), "copied": 0, "bytes": 0}
+    stats_lock = threading.Lock()
+
+    def copy_file(relative: str):
+        src = os.path.join(source, relative)
+        dst = os.path.join(target, relative)
+        src_stat = os.stat(src)
+        try:
+            dst_stat = os.stat(dst)
+            unchanged = dst_stat.st_size == src_stat.st_size and dst_stat.st_mtime_ns == src_stat.st_mtime_ns
+        except FileNotFoundError:
+            unchanged = False
+        digest = hashlib.sha256() if hash_files else None
+        if unchanged and not hash_files:
+            return relative, None
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        # Unchanged files are only read, for the hash
+        with open(src, "rb") as src_file, open(os.devnull if unchanged else f"{dst}.part", "wb") as dst_file:
+            while chunk := src_file.read(COPY_CHUNK_SIZE):
+                if digest:
+                    digest.update(chunk)
+                if not unchanged:
+                    dst_file.write(chunk)
+        if not unchanged:
+            os.replace(f"{dst}.part", dst)
+            shutil.copystat(src, dst)
+            with stats_lock:
+                stats["copied"] += 1
+                stats["bytes"] += src_stat.st_size
+        return relative, digest.hexdigest() if digest else None
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        hashes = dict(pool.map(copy_file, files))
+    if prune and os.path.isdir(target):
+        wanted = set(files)
+        for dirpath, _, filenames in os.walk(target):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if os.path.relpath(path, target) not in wanted:
+                    os.remove(path)
+    stats["seconds"] = round(time.monotonic() - start, 2)
+    stats["hashes"] = hashes
+    return stats
+
+
+def training_cache_key(dataset_hashes: dict, config_path: str) -> str:
+    """
+    Hash of the dataset contents and the training config the caches were
+    built with. The config must exist, or the key would miss the settings.
+    """
+    key = hashlib.sha256()
+    for relative in sorted(dataset_hashes):
+        key.update(f"{relative}\0{dataset_hashes[relative]}\n".encode())
+    with open(config_path) as f:
+        key.update(json.dumps(json.load(f), sort_keys=True).encode())
+    return key.hexdigest()[:16]
+
+
+def prepare_training_data():
+    """
+    Stages the dataset on local disk and restores OneTrainer's cache for it
+    from the volume. Returns the cache key, or None when no dataset is
+    configured or no TRAINING_CONFIG is set (the cache is then not
+    persisted). A configured dataset that is missing, empty or cannot be
+    copied, or a TRAINING_CONFIG that does not exist, raises instead and
+    fails the service, so training never silently starts on nothing, on a
+    partial copy or with a cache built for other settings.
+    """
+    if not DATASET_NAME:
+        logging.info("No DATASET_NAME configured, skipping dataset staging")
+        return None
+    source = os.path.join(DATASETS_DIR, DATASET_NAME)
+    if not os.path.isdir(source):
+        raise FileNotFoundError(f"Dataset '{DATASET_NAME}' not found at {source}")
+    if not any(filenames for _, _, filenames in os.walk(source)):
+        raise ValueError(f"Dataset '{DATASET_NAME}' at {source} contains no files")
+    config_path = os.path.join(VOLUME_MOUNT_PATH, TRAINING_CONFIG) if TRAINING_CONFIG else ""
+    if config_path and not os.path.isfile(config_path):
+        raise FileNotFoundError(f"Training config {config_path} not found; fix TRAINING_CONFIG or leave it empty")
+    target = os.path.join(STAGED_DATASETS_DIR, DATASET_NAME)
+    stats = copy_tree(source, target, hash_files=True, prune=True)
+    logging.info(
+        f"Staged {stats['files']} files ({stats['bytes'] / 1024**2:.1f} MB copied) "
+        f"from {source} to {target} in {stats['seconds']:.2f}s"
+    )
+
+    logging.info(f"Point OneTrainer's concepts at {target} and its cache directory at {LOCAL_CACHE_DIR}")
+    if not config_path:
+        logging.warning("No TRAINING_CONFIG configured, so OneTrainer's cache is neither restored nor persisted")
+        return None
+
+    cache_key = training_cache_key(stats["hashes"], config_path)
+    persisted = os.path.join(PERSISTENT_CACHE_DIR, cache_key)
+    if os.path.isdir(persisted):
+        try:
+            restored = copy_tree(persisted, LOCAL_CACHE_DIR, prune=True)
+            logging.info(f"Restored OneTrainer cache {cache_key} ({restored['files']} files) in {restored['seconds']:.2f}s")
+        except Exception as e:
+            # The cache only saves time; OneTrainer rebuilds it from an empty directory
+            logging.error(f"Could not restore OneTrainer cache {cache_key}, starting without it: {e}")
+            shutil.rmtree(LOCAL_CACHE_DIR, ignore_errors=True)
+    else:
+        # A cache built for other data or another config would be wrong
+        shutil.rmtree(LOCAL_CACHE_DIR, ignore_errors=True)
+        logging.info(f"No OneTrainer cache for {cache_key} yet; it will be saved once OneTrainer builds it")
+    os.makedirs(LOCAL_CACHE_DIR, exist_ok=True)
+    return cache_key
+
+
+def persist_cache(cache_key: str):
+    """Saves new and changed files of OneTrainer's cache to the volume."""
+    try:
+        persisted = os.path.join(PERSISTENT_CACHE_DIR, cache_key)
+        with CACHE_PERSIST_LOCK:
+            stats = copy_tree(LOCAL_CACHE_DIR, persisted)
+            if stats["copied"]:
+                assets_volume.commit()
+        logging.info(
+            f"Persisted OneTrainer cache {cache_key}: {stats['copied']} of {stats['files']} files "
+            f"({stats['bytes'] / 1024**2:.1f} MB) in {stats['seconds']:.2f}s"
+        )
+    except Exception as e:
+        logging.error(f"Could not persist the OneTrainer cache: {e}")
+
+
+def start_cache_persister(cache_key: str):
+    def persist_periodically():
+        while True:
+            time.sleep(CACHE_PERSIST_INTERVAL)
+            persist_cache(cache_key)
+
+    threading.Thread(target=persist_periodically, daemon=True, name="cache-persister").start()
+
+
+@app.local_entrypoint()
+def main():
     run_container.remote()
\ No newline at end of file
@@ -0,0 +1,300 @@
+# scripts/process_supervisor.py
+#
+# Event-driven supervisor for the long-running processes of the workspace
+# containers. Instead of sleeping in a loop, one thread blocks in poll() on a
+# pidfd per process, so it wakes up exactly when a process exits (or when a
+# sample or restart is due). Exited processes are restarted with exponential
+# backoff, and per-process CPU and RSS are sampled from /proc.
+
+import json
+import logging
+import os
+import select
+import signal
+import subprocess
+import threading
+import time
+
+DEFAULT_SAMPLE_INTERVAL = 30  # seconds between /proc samples
+DEFAULT_MAX_RESTARTS = 5  # consecutive restarts before a process counts as failed
+BACKOFF_INITIAL_SECONDS = 1
+BACKOFF_MAX_SECONDS = 60
+STABLE_SECONDS = 60  # a process that ran this long resets its backoff
+POLL_FALLBACK_SECONDS = 1  # exit checks for processes without a pidfd
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def read_proc_sample(pid: int):
+    """Returns (cpu seconds, rss bytes) for a pid from /proc, or None if it is gone."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # The command name may contain spaces, so split after its closing paren
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (FileNotFoundError, ProcessLookupError, IndexError):
+        return None
+    # utime and stime are fields 14 and 15 of stat; fields[0] here is field 3
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    return cpu_seconds, resident_pages * PAGE_SIZE
+
+
+class SupervisedProcess:
+    def __init__(self, name, start, restart, critical, max_restarts):
+        self.name = name
+        self.start = start
+        self.restart = restart
+        self.critical = critical
+        self.max_restarts = max_restarts
+        self.process = None  # Popen for children, None for adopted pids
+        self.pid = None
+        self.pidfd = None
+        self.state = "starting"
+        self.started_at = None
+        self.restarts = 0
+        self.consecutive_failures = 0
+        self.restart_at = None
+        self.last_exit_code = None
+        self.last_sample = None  # (monotonic time, cpu seconds)
+        self.cpu_percent = 0.0
+        self.rss_bytes = 0
+
+
+class ProcessSupervisor:
+    """
+    Watches processes and restarts them when they exit.
+
+    watch(name, start) takes a start() callable returning a Popen (a child,
+    whose exit code is collected) or a pid (e.g. a daemon that forked away,
+    watched through its pidfd without an exit code). Pass process= to adopt
+    something already running. wait() blocks until stop() is called or a
+    critical process has exhausted its restarts, which is what lets a
+    container exit instead of idling with nothing useful running.
+    """
+
+    def __init__(self, sample_interval=DEFAULT_SAMPLE_INTERVAL, status_path=None):
+        self.sample_interval = sample_interval
+        self.status_path = status_path
+        self.processes = {}
+        self.lock = threading.Lock()
+        self.poller = select.poll()
+        self.fd_names = {}
+        self.wakeup_read, self.wakeup_write = os.pipe()
+        self.poller.register(self.wakeup_read, select.POLLIN)
+        self.stopping = False
+        self.finished = threading.Event()
+        self.next_sample = time.monotonic()
+        self.thread = None
+
+    def watch(self, name, start, process=None, restart=True, critical=False, max_restarts=DEFAULT_MAX_RESTARTS):
+        entry = SupervisedProcess(name, start, restart, critical, max_restarts)
+        if process is None:
+            process = start()
+        with self.lock:
+            self.processes[name] = entry
+            self.attach(entry, process)
+        self.wake()
+        return self
+
+    def attach(self, entry, process):
+        if isinstance(process, subprocess.Popen):
+            entry.process, entry.pid = process, process.pid
+        else:
+            entry.process, entry.pid = None, int(process)
+        entry.started_at = time.monotonic()
+        entry.state = "running"
+        entry.last_sample = None
+        try:
+            entry.pidfd = os.pidfd_open(entry.pid)
+        except ProcessLookupError:
+            # Already gone; handled like any other exit on the next loop
+            entry.pidfd = None
+            entry.restart_at = None
+            self.handle_exit(entry)
+            return
+        except OSError as e:
+            # No pidfds here (e.g. ENOSYS on older or sandboxed kernels); the
+            # loop checks this process every POLL_FALLBACK_SECONDS instead
+            entry.pidfd = None
+            logging.warning(f"pidfd_open unavailable for {entry.name} ({e}), polling it instead")
+            logging.info(f"Supervising {entry.name} (pid {entry.pid})")
+            return
+        self.fd_names[entry.pidfd] = entry.name
+        self.poller.register(entry.pidfd, select.POLLIN)
+        logging.info(f"Supervising {entry.name} (pid {entry.pid})")
+
+    @staticmethod
+    def has_exited(entry):
+        """Exit check for processes watched without a pidfd."""
+        if entry.process is not None:
+            return entry.process.poll() is not None
+        try:
+            os.kill(entry.pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+
+    def wake(self):
+        os.write(self.wakeup_write, b"x")
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="process-supervisor", daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.finished.is_set():
+            timeout = self.next_deadline() - time.monotonic()
+            for fd, _ in self.poller.poll(max(0, timeout) * 1000):
+                if fd == self.wakeup_read:
+                    os.read(self.wakeup_read, 4096)
+                    continue
+                with self.lock:
+                    entry = self.processes.get(self.fd_names.get(fd))
+                    if entry is not None:
+                        self.handle_exit(entry)
+            now = time.monotonic()
+            with self.lock:
+                for entry in self.processes.values():
+                    if entry.state == "running" and entry.pidfd is None and self.has_exited(entry):
+                        self.handle_exit(entry)
+                due = [
+                    e for e in self.processes.values()
+                    if e.state == "backoff" and e.restart_at <= now and not self.stopping
+                ]
+                for entry in due:
+                    entry.state = "restarting"
+                if now >= self.next_sample:
+                    self.sample(now)
+                    self.next_sample = now + self.sample_interval
+            # Restarts can block for a while (e.g. waiting for a port), so each
+            # runs on its own thread; status() and other exits are not held up
+            for entry in due:
+                threading.Thread(target=self.do_restart, args=(entry,), name=f"restart-{entry.name}", daemon=True).start()
+
+    def next_deadline(self):
+        with self.lock:
+            deadlines = [e.restart_at for e in self.processes.values() if e.state == "backoff"]
+            if any(e.state == "running" and e.pidfd is None for e in self.processes.values()):
+                deadlines.append(time.monotonic() + POLL_FALLBACK_SECONDS)
+        return min([self.next_sample] + deadlines)
+
+    def handle_exit(self, entry):
+        if entry.pidfd is not None:
+            self.poller.unregister(entry.pidfd)
+            del self.fd_names[entry.pidfd]
+            os.close(entry.pidfd)
+            entry.pidfd = None
+        # Popen.poll() reaps the child, so it never lingers as a zombie
+        entry.last_exit_code = entry.process.poll() if entry.process is not None else None
+        ran_for = time.monotonic() - entry.started_at
+        if ran_for >= STABLE_SECONDS:
+            entry.consecutive_failures = 0
+        logging.warning(f"{entry.name} (pid {entry.pid}) exited with code {entry.last_exit_code} after {ran_for:.1f}s")
+        if self.stopping or not entry.restart:
+            entry.state = "exited"
+        elif entry.consecutive_failures >= entry.max_restarts:
+            entry.state = "failed"
+            logging.error(f"{entry.name} failed {entry.consecutive_failures} times in a row, giving up")
+            if entry.critical:
+                self.finished.set()
+        else:
+            delay = min(BACKOFF_MAX_SECONDS, BACKOFF_INITIAL_SECONDS * 2 ** entry.consecutive_failures)
+            entry.consecutive_failures += 1
+            entry.state = "backoff"
+            entry.restart_at = time.monotonic() + delay
+            logging.info(f"Restarting {entry.name} in {delay:.1f}s")
+
+    def do_restart(self, entry):
+        entry.restarts += 1
+        try:
+            process = entry.start()
+        except Exception as e:
+            logging.error(f"Could not restart {entry.name}: {e}")
+            with self.lock:
+                entry.started_at = time.monotonic()
+                self.handle_exit(entry)
+            self.wake()
+            return
+        with self.lock:
+            if not self.stopping:
+                self.attach(entry, process)
+                self.wake()
+                return
+            entry.state = "exited"
+        # stop() ran while this was starting and could not see it
+        pid = process.pid if isinstance(process, subprocess.Popen) else int(process)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def sample(self, now):
+        for entry in self.processes.values():
+            if entry.state != "running":
+                entry.cpu_percent, entry.rss_bytes = 0.0, 0
+                continue
+            sample = read_proc_sample(entry.pid)
+            if sample is None:
+                continue
+            cpu_seconds, entry.rss_bytes = sample
+            if entry.last_sample is not None:
+                last_time, last_cpu = entry.last_sample
+                entry.cpu_percent = 100 * (cpu_seconds - last_cpu) / max(now - last_time, 1e-6)
+            entry.last_sample = (now, cpu_seconds)
+        if self.status_path:
+            try:
+                with open(self.status_path, "w") as f:
+                    json.dump(self.snapshot(), f, indent=2)
+            except OSError as e:
+                logging.error(f"Could not write supervisor status to {self.status_path}: {e}")
+
+    def snapshot(self):
+        now = time.monotonic()
+        return {
+            entry.name: {
+                "pid": entry.pid,
+                "state": entry.state,
+                "critical": entry.critical,
+                "uptime_seconds": round(now - entry.started_at, 1) if entry.state == "running" else 0,
+                "restarts": entry.restarts,
+                "last_exit_code": entry.last_exit_code,
+                "cpu_percent": round(entry.cpu_percent, 1),
+                "rss_mb": round(entry.rss_bytes / 1024**2, 1),
+            }
+            for entry in self.processes.values()
+        }
+
+    def status(self):
+        """Snapshot of every supervised process, sampled fresh."""
+        with self.lock:
+            self.sample(time.monotonic())
+            return self.snapshot()
+
+    def wait(self, timeout=None):
+        """Blocks until stop() or a critical process fails. Returns the final status."""
+        self.finished.wait(timeout)
+        return self.status()
+
+    def stop(self, grace_seconds=10, terminate=True):
+        """Stops restarting and, unless terminate is False, terminates the supervised processes."""
+        with self.lock:
+            self.stopping = True
+            running = [e for e in self.processes.values() if e.state == "running"] if terminate else []
+        for entry in running:
+            try:
+                os.kill(entry.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + grace_seconds
+        for entry in running:
+            if entry.process is not None:
+                try:
+                    entry.process.wait(max(0, deadline - time.monotonic()))
+                except subprocess.TimeoutExpired:
+                    entry.process.kill()
+        self.finished.set()
+        self.wake()
@@ -1,17 +1,90 @@
 #!/usr/bin/env python3
 
 import os
+import asyncio
+import csv
+import heapq
+import json
+import math
+import re
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
 import subprocess
+import tempfile
 import logging
 import time  # Add time import
 import modal
-from typing import List
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List
 
 APP_NAME = "RcloneToVolume"
 VOLUME_NAME = "rclone-volume"
 VOLUME_MOUNT_PATH = "/data"
 RCLONE_CONFIG_DIR = "/config"
 
+# Defaults for packing files into batches that are copied inside one container
+DEFAULT_MAX_BATCH_FILES = 256
+DEFAULT_MAX_BATCH_SIZE = "16G"
+# Volume commit coalescing: commit after this many files, seconds or bytes
+# (whichever comes first, 0 disables a trigger), plus one final commit per batch
+DEFAULT_COMMIT_EVERY_FILES = 200
+DEFAULT_COMMIT_EVERY_SECONDS = 60
+DEFAULT_COMMIT_EVERY_SIZE = "20G"
+# rclone tuning per file size class. Each class also maps to a copy worker
+# function with matching container resources (see COPY_WORKERS below).
+# max_size is the inclusive upper bound of the class; None means unbounded.
+TRANSFER_PROFILES = [
+    {"name": "small", "max_size": "16M", "buffer_size": "16M",
+     "multi_thread_streams": 0, "multi_thread_cutoff": "1G",
+     "transfers": 32, "checkers": 64},
+    {"name": "medium", "max_size": "1G", "buffer_size": "64M",
+     "multi_thread_streams": 4, "multi_thread_cutoff": "64M"},
+    {"name": "large", "max_size": None, "buffer_size": "256M",
+     "multi_thread_streams": 16, "multi_thread_cutoff": "256M"},
+]
+# Flags for copies made without a size class (copy_entries' default)
+DEFAULT_TRANSFER_PROFILE = {"name": "default", "max_size": None, "buffer_size": "128M",
+                            "multi_thread_streams": 8, "multi_thread_cutoff": "64M"}
+# Small-file aggregation: files up to the threshold are copied in groups by a
+# single 'rclone copy --files-from' per group (small_file_mode "bulk"), using
+# the small profile's transfers/checkers; "per-file" runs copyto for each file
+SMALL_FILE_MODES = ("bulk", "per-file")
+DEFAULT_SMALL_FILE_THRESHOLD = TRANSFER_PROFILES[0]["max_size"]
+DEFAULT_SMALL_FILE_GROUP_SIZE = 2000
+# Stream counts the auto-tuner tries, as multiples of a profile's default
+AUTOTUNE_STREAM_FACTORS = (0.5, 1, 2)
+# How often rclone logs stats during a transfer, and how many error messages
+# are kept per transfer in the telemetry
+RCLONE_STATS_INTERVAL = "1s"
+MAX_TELEMETRY_ERRORS = 5
+# Upper bounds of the size buckets used for latency percentiles in run reports
+REPORT_SIZE_BUCKETS = ["64K", "1M", "16M", "256M", "1G", "16G", None]
+REPORT_PERCENTILES = (50, 90, 99)
+# Maximum number of copy batches in flight at once; listing consumption pauses
+# while the window is full, which bounds memory on the local entrypoint
+DEFAULT_MAX_IN_FLIGHT = 200
+# Seconds between live progress reports, and in-flight jobs listed as slowest
+DEFAULT_PROGRESS_INTERVAL = 15
+PROGRESS_SLOWEST_JOBS = 3
+# Number of listing entries streamed back from the listing container at a time
+DEFAULT_LISTING_CHUNK_SIZE = 10000
+# Recursive listings fan out one container per top-level prefix, this many at
+# a time, buffering at most LISTING_QUEUE_SIZE chunks locally
+DEFAULT_MAX_LISTING_SHARDS = 16
+LISTING_QUEUE_SIZE = 8
+# Sync manifest kept on the volume, one directory per destination subdirectory.
+# It holds a compacted manifest.jsonl plus append-only segment files written by
+# the copy workers, which are merged into manifest.jsonl on the next run.
+MANIFEST_ROOT = f"{VOLUME_MOUNT_PATH}/.rclone-manifest"
+MANIFEST_FILE = "manifest.jsonl"
+MANIFEST_SEGMENT_PREFIX = "segment-"
+# full: copy everything, incremental: copy new or changed files,
+# resume: copy only files missing from the manifest (skips size/mtime checks)
+SYNC_MODES = ("full", "incremental", "resume")
+SIZE_SUFFIXES = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4, "P": 1024**5}
+# A number, an optional unit, then rclone's optional binary "i" and/or "B" (16G, 16Gi, 16GiB, 512)
+SIZE_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)\s*(?:([KMGTP])I?)?B?$")
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 image = (
@@ -60,6 +133,295 @@ def get_rclone_config_content(rclone_config_path: str) -> str:
         print(f"Error reading rclone config file: {e}")
         return ""
 
+def parse_size(size: str) -> int:
+    """
+    Parses an rclone style size string such as '512M', '16Gi' or '1GiB' into
+    bytes. Raises ValueError for anything else.
+    """
+    match = SIZE_PATTERN.match(str(size).strip().upper())
+    if not match:
+        raise ValueError(f"Invalid size '{size}': expected a number with an optional K, M, G, T or P suffix, e.g. 512M or 16Gi")
+    number, suffix = match.groups()
+    return int(float(number) * SIZE_SUFFIXES[suffix or ""])
+
+def rclone_base_cmd() -> List[str]:
+    return ["rclone", "--config", os.path.join(RCLONE_CONFIG_DIR, "rclone.conf")]
+
+def profile_for_size(size: int) -> Dict:
+    """Returns the transfer profile of the size class a file falls into."""
+    for profile in TRANSFER_PROFILES:
+        if profile["max_size"] is None or size <= parse_size(profile["max_size"]):
+            return profile
+    return TRANSFER_PROFILES[-1]
+
+def route_for(entry: Dict, small_file_mode: str, small_file_bytes: int) -> str:
+    """
+    Returns the route a listed file is copied on: "bulk" for small files when
+    small_file_mode is "bulk", otherwise the name of its size class.
+    """
+    if small_file_mode == "bulk" and entry["size"] <= small_file_bytes:
+        return "bulk"
+    return profile_for_size(entry["size"])["name"]
+
+def profile_flags(profile: Dict) -> List[str]:
+    """Builds the rclone tuning flags for a transfer profile."""
+    return [
+        "--buffer-size", profile["buffer_size"],
+        "--multi-thread-streams", str(profile["multi_thread_streams"]),
+        "--multi-thread-cutoff", profile["multi_thread_cutoff"]
+    ]
+
+def parse_rclone_json_log(log_text: str) -> Dict:
+    """
+    Parses the output of an rclone run with --use-json-log and periodic stats
+    into transfer telemetry: bytes moved, rclone's elapsed time, average and
+    peak rate (bytes/s), high level retries ("Attempt n/m failed"), low level
+    retries and the error messages that were logged.
+    """
+    telemetry = {
+        "bytes": 0,
+        "elapsed": 0.0,
+        "avg_rate": 0.0,
+        "peak_rate": 0.0,
+        "retries": 0,
+        "low_level_retries": 0,
+        "errors": []
+    }
+    for line in log_text.splitlines():
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if not isinstance(record, dict):
+            continue
+
+        msg = record.get("msg", "")
+        stats = record.get("stats")
+        if stats:
+            telemetry["bytes"] = max(telemetry["bytes"], stats.get("bytes", 0))
+            telemetry["elapsed"] = max(telemetry["elapsed"], stats.get("elapsedTime", 0.0))
+            telemetry["peak_rate"] = max(telemetry["peak_rate"], stats.get("speed", 0.0))
+        if "low level retry" in msg:
+            telemetry["low_level_retries"] += 1
+        elif msg.startswith("Attempt ") and "failed" in msg:
+            telemetry["retries"] += 1
+        elif record.get("level") == "error" and len(telemetry["errors"]) < MAX_TELEMETRY_ERRORS:
+            telemetry["errors"].append(msg.strip())
+
+    if telemetry["elapsed"] > 0:
+        telemetry["avg_rate"] = telemetry["bytes"] / telemetry["elapsed"]
+    return telemetry
+
+def rclone_copyto(source_path: str, dest_path: str, profile: Dict = None) -> Dict:
+    """
+    Copies a single file with rclone copyto, logging JSON with periodic stats.
+    Returns the parsed telemetry (see parse_rclone_json_log) plus "success"
+    and the wall-clock "duration" of the rclone process.
+    """
+    start = time.monotonic()
+    try:
+        dest_dir = os.path.dirname(dest_path)
+        os.makedirs(dest_dir, exist_ok=True)
+
+        # Build the rclone command
+        cmd = rclone_base_cmd() + [
+            "copyto",
+            source_path,
+            dest_path,
+            # "--progress",
+            "--retries", "10",
+            "--use-json-log",
+            "--stats", RCLONE_STATS_INTERVAL,
+            "--stats-log-level", "NOTICE"
+        ] + profile_flags(profile or DEFAULT_TRANSFER_PROFILE)
+
+        logging.info(f"Copying file from '{source_path}' to '{dest_path}'")
+        # Capture rclone output; the JSON log and stats are written to stderr
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        logging.debug(f"Rclone stdout: {result.stdout}")
+        telemetry = parse_rclone_json_log(result.stderr)
+        telemetry["duration"] = time.monotonic() - start
+        telemetry["success"] = result.returncode == 0
+        if telemetry["success"]:
+            logging.info(f"File copied successfully")
+        else:
+            logging.error(f"Error copying file: rclone exited with {result.returncode}")
+            logging.warning(f"Rclone stderr: {result.stderr}") # Log stderr as warning
+        return telemetry
+
+    except Exception as e:
+        logging.error(f"Error copying file: {e}")
+        telemetry = parse_rclone_json_log("")
+        telemetry.update({"duration": time.monotonic() - start, "success": False, "errors": [str(e)]})
+        return telemetry
+
+def parse_rclone_object_events(log_text: str) -> Dict[str, Dict]:
+    """
+    Collects per-object outcomes from an rclone JSON log at INFO level:
+    whether the object was reported copied, its low level retries and errors.
+    """
+    objects: Dict[str, Dict] = {}
+    for line in log_text.splitlines():
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if not isinstance(record, dict) or not record.get("object"):
+            continue
+
+        events = objects.setdefault(record["object"], {"copied": False, "low_level_retries": 0, "errors": []})
+        msg = record.get("msg", "")
+        if msg.startswith("Copied"):
+            events["copied"] = True
+        elif "low level retry" in msg:
+            events["low_level_retries"] += 1
+        elif record.get("level") == "error" and len(events["errors"]) < MAX_TELEMETRY_ERRORS:
+            events["errors"].append(msg.strip())
+    return objects
+
+def rclone_copy_files(source_path: str, dest_path: str, paths: List[str], profile: Dict) -> Dict:
+    """
+    Copies many files in one 'rclone copy --files-from' run, with the
+    parallelism of the profile. Returns the group telemetry (see
+    parse_rclone_json_log) plus "success", "duration" and the per-object
+    outcomes under "objects".
+    """
+    start = time.monotonic()
+    try:
+        os.makedirs(dest_path, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as files_from:
+            files_from.write("\n".join(paths) + "\n")
+
+        try:
+            cmd = rclone_base_cmd() + [
+                "copy",
+                source_path,
+                dest_path,
+                "--files-from", files_from.name,
+                "--no-traverse",
+                "--transfers", str(profile.get("transfers", 4)),
+                "--checkers", str(profile.get("checkers", 8)),
+                "--retries", "10",
+                "--log-level", "INFO",
+                "--use-json-log",
+                "--stats", RCLONE_STATS_INTERVAL,
+                "--stats-log-level", "NOTICE"
+            ] + profile_flags(profile)
+
+            logging.info(f"Copying {len(paths)} files from '{source_path}' to '{dest_path}' in one rclone run")
+            result = subprocess.run(cmd, capture_output=True, text=True)
+        finally:
+            # Removed even when rclone fails or the call raises
+            os.remove(files_from.name)
+        logging.debug(f"Rclone stdout: {result.stdout}")
+        telemetry = parse_rclone_json_log(result.stderr)
+        telemetry["objects"] = parse_rclone_object_events(result.stderr)
+        telemetry["duration"] = time.monotonic() - start
+        telemetry["success"] = result.returncode == 0
+        if not telemetry["success"]:
+            logging.error(f"Error copying file group: rclone exited with {result.returncode}")
+        return telemetry
+
+    except Exception as e:
+        logging.error(f"Error copying file group: {e}")
+        telemetry = parse_rclone_json_log("")
+        telemetry.update({"duration": time.monotonic() - start, "success": False,
+                          "errors": [str(e)], "objects": {}})
+        return telemetry
+
+class TransferAutoTuner:
+    """
+    Picks multi-thread stream counts per size class from the throughput that
+    earlier batches of the same run achieved. Each candidate stream count is
+    tried once, after which the candidate with the best average bytes/s wins.
+    Profiles without multi-threading (streams 0) are left unchanged.
+    """
+
+    def __init__(self, profiles: List[Dict]):
+        self.candidates = {
+            profile["name"]: sorted({
+                max(1, int(profile["multi_thread_streams"] * factor))
+                for factor in AUTOTUNE_STREAM_FACTORS
+            })
+            for profile in profiles if profile["multi_thread_streams"] > 0
+        }
+        # (profile name, streams) -> [total bytes, total transfer seconds]
+        self.samples: Dict[tuple, List[float]] = {}
+        self.dispatched: Dict[tuple, int] = {}
+
+    def choose(self, profile: Dict) -> Dict:
+        """Returns a copy of the profile with the stream count to use next."""
+        candidates = self.candidates.get(profile["name"])
+        if not candidates:
+            return profile
+
+        untried = [
+            streams for streams in candidates
+            if (profile["name"], streams) not in self.samples
+            and not self.dispatched.get((profile["name"], streams))
+        ]
+        if untried:
+            streams = untried[0]
+        elif any((profile["name"], streams) in self.samples for streams in candidates):
+            streams = max(
+                (streams for streams in candidates if (profile["name"], streams) in self.samples),
+                key=lambda streams: self.rate(profile["name"], streams)
+            )
+        else:
+            # Every candidate is still in flight; keep the default until results arrive
+            streams = profile["multi_thread_streams"]
+        self.dispatched[(profile["name"], streams)] = self.dispatched.get((profile["name"], streams), 0) + 1
+        return {**profile, "multi_thread_streams": streams}
+
+    def record(self, profile: Dict, copied_bytes: int, transfer_seconds: float):
+        """Feeds back the bytes and transfer time a finished batch achieved."""
+        if profile["name"] not in self.candidates or transfer_seconds <= 0:
+            return
+        sample = self.samples.setdefault((profile["name"], profile["multi_thread_streams"]), [0, 0.0])
+        sample[0] += copied_bytes
+        sample[1] += transfer_seconds
+
+    def rate(self, name: str, streams: int) -> float:
+        copied_bytes, seconds = self.samples[(name, streams)]
+        return copied_bytes / seconds if seconds else 0.0
+
+def plan_batches(
+    entries: List[Dict],
+    max_batch_bytes: int,
+    max_batch_files: int
+) -> List[List[Dict]]:
+    """
+    Packs listing entries ({"path", "size"}) into size-balanced batches.
+
+    Uses greedy longest-first bin packing: the number of batches is the minimum
+    needed to respect both the byte target and the per-batch file cap, and each
+    file (largest first) goes to the least loaded batch that still has room.
+    A single file larger than max_batch_bytes gets a batch of its own size.
+    """
+    if not entries:
+        return []
+
+    total_bytes = sum(entry["size"] for entry in entries)
+    num_batches = max(
+        1,
+        math.ceil(total_bytes / max(1, max_batch_bytes)),
+        math.ceil(len(entries) / max(1, max_batch_files))
+    )
+    batches: List[List[Dict]] = [[] for _ in range(num_batches)]
+    # Heap of (bytes_assigned, batch_index) for batches that can still take files
+    loads = [(0, i) for i in range(num_batches)]
+
+    for entry in sorted(entries, key=lambda e: e["size"], reverse=True):
+        if not loads:
+            batches.append([])
+            loads.append((0, len(batches) - 1))
+        load, index = heapq.heappop(loads)
+        batches[index].append(entry)
+        if len(batches[index]) < max_batch_files:
+            heapq.heappush(loads, (load + entry["size"], index))
+
+    return [batch for batch in batches if batch]
+
 @app.function()
 def list_remote_files(
     remote_path: str,
@@ -90,148 +452,924 @@ def list_remote_files(
 
     except Exception as e:
         logging.error(f"Error listing files: {e}")
-        return []
+        raise
+
+def iter_remote_entries(
+    remote_path: str,
+    recursive: bool = False,
+    hash_type: str = ""
+) -> Iterator[Dict]:
+    """
+    Streams files (not directories) under remote_path with their size, mtime
+    and, when hash_type is set (e.g. 'MD5'), their hash. Each entry is yielded
+    as soon as rclone prints it instead of waiting for the whole listing.
+    """
+    fields = ["path", "size", "mtime"] + (["hash"] if hash_type else [])
+    cmd = rclone_base_cmd() + [
+        "lsf",
+        remote_path,
+        "--files-only",
+        "--format", "pst" + ("h" if hash_type else ""),
+        "--csv"
+    ]
+    if hash_type:
+        cmd.extend(["--hash", hash_type])
+    if recursive:
+        cmd.append("--recursive")
+
+    logging.info(f"Listing files with sizes in '{remote_path}'")
+    # stderr goes to a temp file so a chatty rclone can never block the stdout pipe
+    with tempfile.TemporaryFile(mode="w+") as stderr_file:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file, text=True)
+        try:
+            count = 0
+            for row in csv.reader(process.stdout):
+                if len(row) == len(fields) and row[0]:
+                    count += 1
+                    entry = dict(zip(fields, row))
+                    entry["size"] = max(0, int(entry["size"]))
+                    yield entry
+        finally:
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+
+        if process.returncode != 0:
+            stderr_file.seek(0)
+            raise subprocess.CalledProcessError(process.returncode, cmd, stderr=stderr_file.read())
+    logging.info(f"Found {count} files in '{remote_path}'")
+
+def chunked(iterable: Iterable, chunk_size: int) -> Iterator[List]:
+    """Groups an iterable into lists of at most chunk_size items."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def manifest_dir_for(dest_subdir: str) -> str:
+    """Returns the manifest directory on the volume for a destination subdirectory."""
+    name = dest_subdir.replace('\\', '/').strip('/').replace('/', '__') or "root"
+    return f"{MANIFEST_ROOT}/{name}"
+
+def load_manifest(manifest_dir: str, path_prefix: str = "") -> Dict[str, Dict]:
+    """
+    Reads the compacted manifest and any segments written since, keyed by path.
+    Segments are applied in name order after the compacted file. With
+    path_prefix set only records under that prefix are kept in memory.
+    """
+    manifest = {}
+    if not os.path.isdir(manifest_dir):
+        return manifest
+
+    segments = sorted(
+        name for name in os.listdir(manifest_dir)
+        if name.startswith(MANIFEST_SEGMENT_PREFIX)
+    )
+    for name in [MANIFEST_FILE] + segments:
+        file_path = os.path.join(manifest_dir, name)
+        if not os.path.exists(file_path):
+            continue
+        with open(file_path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn final line from a worker that died mid-write
+                    continue
+                path = record.pop("path")
+                if path.startswith(path_prefix):
+                    manifest[path] = record
+    return manifest
+
+def compact_manifest(manifest_dir: str) -> Dict[str, Dict]:
+    """Merges all segments into a single manifest file and removes the segments."""
+    manifest = load_manifest(manifest_dir)
+    segments = [
+        name for name in os.listdir(manifest_dir)
+        if name.startswith(MANIFEST_SEGMENT_PREFIX)
+    ] if os.path.isdir(manifest_dir) else []
+    if not segments:
+        return manifest
+
+    tmp_path = os.path.join(manifest_dir, f"{MANIFEST_FILE}.tmp")
+    with open(tmp_path, "w") as f:
+        for path, record in manifest.items():
+            f.write(json.dumps({"path": path, **record}) + "\n")
+    os.replace(tmp_path, os.path.join(manifest_dir, MANIFEST_FILE))
+    for name in segments:
+        os.remove(os.path.join(manifest_dir, name))
+    logging.info(f"Compacted {len(segments)} manifest segments into {len(manifest)} entries")
+    return manifest
+
+def record_manifest_entries(manifest_dir: str, entries: List[Dict]):
+    """Appends copied entries to a new segment file owned by the calling worker."""
+    if not entries:
+        return
+    os.makedirs(manifest_dir, exist_ok=True)
+    segment = f"{MANIFEST_SEGMENT_PREFIX}{time.time_ns()}-{uuid.uuid4().hex}.jsonl"
+    with open(os.path.join(manifest_dir, segment), "a") as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+
+def needs_copy(entry: Dict, record: Dict, sync_mode: str) -> bool:
+    """Diffs a listing entry against its manifest record (None if not present)."""
+    if sync_mode == "full" or record is None:
+        return True
+    if sync_mode == "resume":
+        return False
+    if entry["size"] != record.get("size") or entry.get("mtime") != record.get("mtime"):
+        return True
+    # Hashes are only compared when both sides have one
+    return bool(entry.get("hash") and record.get("hash") and entry["hash"] != record["hash"])
+
+@app.function(volumes={VOLUME_MOUNT_PATH: volume_storage}, timeout=3600)
+def compact_sync_manifest(manifest_dir: str) -> int:
+    """Compacts the manifest segments written by earlier runs. Returns the entry count."""
+    manifest = compact_manifest(manifest_dir)
+    volume_storage.commit()
+    return len(manifest)
+
+@app.function(volumes={VOLUME_MOUNT_PATH: volume_storage}, timeout=24*3600)
+def list_remote_entries(
+    remote_path: str,
+    rclone_config_content: str,
+    recursive: bool = False,
+    chunk_size: int = DEFAULT_LISTING_CHUNK_SIZE,
+    manifest_dir: str = "",
+    sync_mode: str = "full",
+    hash_type: str = "",
+    path_prefix: str = ""
+) -> Iterator[Dict]:
+    """
+    Generator function: streams the listing of remote_path back to the caller
+    so copying can start while rclone is still listing. Call it with
+    .remote_gen(). Every chunk_size listed files it yields
+    {"entries": [...], "skipped": n}, where entries are the files that the
+    manifest diff says need copying and skipped counts the unchanged ones.
+    path_prefix is prepended to every listed path, for listing shards that
+    cover a subdirectory of the source. A failed or cut-off listing raises
+    after logging, so it cannot pass for a short one.
+    """
+    try:
+        setup_rclone_config(rclone_config_content)
+
+        manifest = {}
+        if manifest_dir and sync_mode != "full":
+            manifest = load_manifest(manifest_dir, path_prefix)
+            logging.info(f"Loaded {len(manifest)} manifest entries under '{path_prefix}' from '{manifest_dir}'")
+
+        listing = iter_remote_entries(remote_path, recursive, hash_type)
+        if path_prefix:
+            listing = ({**entry, "path": path_prefix + entry["path"]} for entry in listing)
+        for listed in chunked(listing, chunk_size):
+            entries = [
+                entry for entry in listed
+                if needs_copy(entry, manifest.get(entry["path"]), sync_mode)
+            ]
+            yield {"entries": entries, "skipped": len(listed) - len(entries)}
+
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error listing files: {e}")
+        logging.error(f"Stderr: {e.stderr}")
+        raise
+    except Exception as e:
+        logging.error(f"Error listing files: {e}")
+        raise
+
+class VolumeCommitter:
+    """
+    Coalesces volume commits for a copy worker. Copied files are held as
+    pending until every_files files, every_bytes bytes or every_seconds seconds
+    have accumulated since the last commit (whichever comes first; 0 disables
+    a trigger), and flush() makes the guaranteed final commit. Thresholds are
+    checked as files complete. Pending files are recorded in the manifest right
+    before each commit, and are marked failed if the commit itself fails.
+    """
+
+    def __init__(
+        self,
+        commit_fn: Callable[[], None],
+        every_files: int = 0,
+        every_seconds: float = 0,
+        every_bytes: int = 0,
+        manifest_dir: str = ""
+    ):
+        self.commit_fn = commit_fn
+        self.every_files = every_files
+        self.every_seconds = every_seconds
+        self.every_bytes = every_bytes
+        self.manifest_dir = manifest_dir
+        self.pending: List[Dict] = []
+        self.pending_results: List[Dict] = []
+        self.pending_bytes = 0
+        self.last_commit = time.monotonic()
+        self.commits = 0
+        self.commit_seconds = 0.0
+
+    def add(self, entry: Dict, result: Dict):
+        """Registers a copied file and commits if a threshold has been reached."""
+        self.pending.append(entry)
+        self.pending_results.append(result)
+        self.pending_bytes += entry["size"]
+        if (
+            (self.every_files and len(self.pending) >= self.every_files)
+            or (self.every_bytes and self.pending_bytes >= self.every_bytes)
+            or (self.every_seconds and time.monotonic() - self.last_commit >= self.every_seconds)
+        ):
+            self.commit()
+
+    def add_many(self, entries: List[Dict], results: List[Dict]):
+        """Registers a group of copied files and commits them together."""
+        self.pending.extend(entries)
+        self.pending_results.extend(results)
+        self.pending_bytes += sum(entry["size"] for entry in entries)
+        self.commit()
+
+    def commit(self):
+        if not self.pending:
+            return
+        start = time.monotonic()
+        try:
+            if self.manifest_dir:
+                record_manifest_entries(self.manifest_dir, self.pending)
+            self.commit_fn()
+            logging.info(f"Volume committed after copying {len(self.pending)} files")
+        except Exception as e:
+            logging.error(f"Error committing volume: {e}")
+            for result in self.pending_results:
+                result["success"] = False
+        finally:
+            self.commits += 1
+            self.commit_seconds += time.monotonic() - start
+            self.last_commit = time.monotonic()
+            self.pending = []
+            self.pending_results = []
+            self.pending_bytes = 0
+
+    def flush(self):
+        """Final commit for whatever is still pending."""
+        self.commit()
+
+def copy_entries(
+    batch: List[Dict],
+    source_path: str,
+    dest_path: str,
+    committer: VolumeCommitter,
+    profile: Dict = None
+) -> Dict:
+    """
+    Copies the files of a batch one after another with the given transfer
+    profile, handing each successful copy to the committer, and returns the
+    per-file results (telemetry included) with timing totals.
+    """
+    profile = profile or DEFAULT_TRANSFER_PROFILE
+    results = []
+    transfer_seconds = 0.0
+    for entry in batch:
+        telemetry = rclone_copyto(f"{source_path}/{entry['path']}", f"{dest_path}/{entry['path']}", profile)
+        transfer_seconds += telemetry["duration"]
+        result = {"path": entry["path"], "size": entry["size"], "profile": profile, **telemetry}
+        results.append(result)
+        if result["success"]:
+            committer.add(entry, result)
+    committer.flush()
+
+    return {
+        "files": results,
+        "transfer_seconds": transfer_seconds,
+        "commit_seconds": committer.commit_seconds,
+        "commits": committer.commits
+    }
+
+def copy_entries_bulk(
+    batch: List[Dict],
+    source_path: str,
+    dest_path: str,
+    committer: VolumeCommitter,
+    profile: Dict = None
+) -> Dict:
+    """
+    Copies a group of small files with a single rclone run and commits them
+    together. A file counts as copied when rclone reported it, or when the run
+    succeeded overall (rclone does not log files it found unchanged). Group
+    level retries are attributed to the first file and the group's duration
+    is spread evenly across its files, so per-file latencies are amortized.
+    """
+    profile = profile or TRANSFER_PROFILES[0]
+    telemetry = rclone_copy_files(source_path, dest_path, [entry["path"] for entry in batch], profile)
+    objects = telemetry["objects"]
+    per_file_duration = telemetry["duration"] / max(1, len(batch))
+
+    results = []
+    copied = []
+    for entry in batch:
+        events = objects.get(entry["path"], {"copied": False, "low_level_retries": 0, "errors": []})
+        success = events["copied"] or (telemetry["success"] and not events["errors"])
+        result = {
+            "path": entry["path"],
+            "size": entry["size"],
+            "profile": profile,
+            "success": success,
+            "duration": per_file_duration,
+            "bytes": entry["size"] if success else 0,
+            "elapsed": per_file_duration,
+            "avg_rate": entry["size"] / per_file_duration if success and per_file_duration else 0.0,
+            "peak_rate": telemetry["peak_rate"],
+            "retries": 0,
+            "low_level_retries": events["low_level_retries"],
+            "errors": events["errors"],
+            "grouped": True
+        }
+        results.append(result)
+        if success:
+            copied.append(entry)
+    if results:
+        results[0]["retries"] = telemetry["retries"]
+        if not telemetry["success"] and not any(result["errors"] for result in results):
+            results[0]["errors"] = telemetry["errors"]
+
+    committer.add_many(copied, [result for result in results if result["success"]])
+    return {
+        "files": results,
+        "transfer_seconds": telemetry["duration"],
+        "commit_seconds": committer.commit_seconds,
+        "commits": committer.commits
+    }
+
+def run_copy_batch(
+    batch: List[Dict],
+    source_path: str,
+    dest_path: str,
+    rclone_config_content: str,
+    manifest_dir: str = "",
+    commit_policy: Dict = None,
+    profile: Dict = None,
+    bulk: bool = False
+) -> Dict:
+    """
+    Copies every file of a batch inside the current container, one rclone run
+    per file, or a single --files-from run for the whole batch when bulk is
+    set. Volume commits are coalesced according to commit_policy ({"files",
+    "seconds", "bytes"}), and copied files are recorded in a manifest segment
+    committed together with them. Returns {"files": [per-file results],
+    "transfer_seconds", "commit_seconds", "commits"}.
+    """
+    setup_rclone_config(rclone_config_content)
 
+    commit_policy = commit_policy or {}
+    committer = VolumeCommitter(
+        volume_storage.commit,
+        every_files=commit_policy.get("files", 0),
+        every_seconds=commit_policy.get("seconds", 0),
+        every_bytes=commit_policy.get("bytes", 0),
+        manifest_dir=manifest_dir
+    )
+    if bulk:
+        return copy_entries_bulk(batch, source_path, dest_path, committer, profile)
+    return copy_entries(batch, source_path, dest_path, committer, profile)
+
+# One copy worker per size class, with container resources sized for it.
+# Small files are bound by per-file overhead, large ones by buffers and streams.
 @app.function(
     volumes={VOLUME_MOUNT_PATH: volume_storage},
     timeout=24*3600,
-    cpu=2,
+    cpu=1,
     memory=256,
     retries=3
 )
-def copy_file(
+def copy_batch_small(*args, **kwargs) -> Dict:
+    """Copy worker for the 'small' size class. See run_copy_batch."""
+    return run_copy_batch(*args, **kwargs)
+
+@app.function(
+    volumes={VOLUME_MOUNT_PATH: volume_storage},
+    timeout=24*3600,
+    cpu=2,
+    memory=1024,
+    retries=3
+)
+def copy_batch(*args, **kwargs) -> Dict:
+    """Copy worker for the 'medium' size class. See run_copy_batch."""
+    return run_copy_batch(*args, **kwargs)
+
+@app.function(
+    volumes={VOLUME_MOUNT_PATH: volume_storage},
+    timeout=24*3600,
+    cpu=8,
+    memory=8192,
+    retries=3
+)
+def copy_batch_large(*args, **kwargs) -> Dict:
+    """Copy worker for the 'large' size class. See run_copy_batch."""
+    return run_copy_batch(*args, **kwargs)
+
+@app.function(
+    volumes={VOLUME_MOUNT_PATH: volume_storage},
+    timeout=24*3600,
+    cpu=4,
+    memory=1024,
+    retries=3
+)
+def copy_small_files(*args, **kwargs) -> Dict:
+    """Grouped worker for small files: one rclone --files-from run per batch."""
+    return run_copy_batch(*args, bulk=True, **kwargs)
+
+COPY_WORKERS = {
+    "small": copy_batch_small,
+    "medium": copy_batch,
+    "large": copy_batch_large
+}
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list (0.0 when empty)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def size_bucket_label(bound: str) -> str:
+    return f"<={bound}" if bound else f">{REPORT_SIZE_BUCKETS[-2]}"
+
+def size_bucket(size: int) -> str:
+    """Returns the label of the report size bucket a file falls into."""
+    for bound in REPORT_SIZE_BUCKETS:
+        if bound is None or size <= parse_size(bound):
+            return size_bucket_label(bound)
+    return size_bucket_label(None)
+
+class RunReport:
+    """
+    Aggregates per-file transfer telemetry into a machine-readable run report
+    with latency percentiles, rates and retry counts per size bucket, so runs
+    can be compared and throttling (rising retries, falling rates) spotted.
+    """
+
+    CSV_FIELDS = ["bucket", "files", "failed", "bytes"] + [
+        f"p{q}_seconds" for q in REPORT_PERCENTILES
+    ] + ["avg_rate", "peak_rate", "retries", "low_level_retries", "errors"]
+
+    def __init__(self, settings: Dict):
+        self.settings = settings
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.buckets: Dict[str, Dict] = {}
+        self.error_messages = Counter()
+
+    def add(self, result: Dict):
+        bucket = self.buckets.setdefault(size_bucket(result["size"]), {
+            "files": 0, "failed": 0, "bytes": 0, "durations": [], "transfer_seconds": 0.0,
+            "peak_rate": 0.0, "retries": 0, "low_level_retries": 0, "errors": 0
+        })
+        bucket["files"] += 1
+        bucket["retries"] += result.get("retries", 0)
+        bucket["low_level_retries"] += result.get("low_level_retries", 0)
+        bucket["errors"] += len(result.get("errors", []))
+        self.error_messages.update(result.get("errors", []))
+        if not result["success"]:
+            bucket["failed"] += 1
+            return
+        bucket["bytes"] += result["size"]
+        bucket["durations"].append(result.get("duration", 0.0))
+        bucket["transfer_seconds"] += result.get("duration", 0.0)
+        bucket["peak_rate"] = max(bucket["peak_rate"], result.get("peak_rate", 0.0))
+
+    def rows(self) -> List[Dict]:
+        rows = []
+        for label in map(size_bucket_label, REPORT_SIZE_BUCKETS):
+            bucket = self.buckets.get(label)
+            if not bucket:
+                continue
+            durations = sorted(bucket["durations"])
+            row = {"bucket": label, "files": bucket["files"], "failed": bucket["failed"], "bytes": bucket["bytes"]}
+            for q in REPORT_PERCENTILES:
+                row[f"p{q}_seconds"] = round(percentile(durations, q), 3)
+            row["avg_rate"] = round(bucket["bytes"] / bucket["transfer_seconds"], 1) if bucket["transfer_seconds"] else 0.0
+            row["peak_rate"] = round(bucket["peak_rate"], 1)
+            for key in ("retries", "low_level_retries", "errors"):
+                row[key] = bucket[key]
+            rows.append(row)
+        return rows
+
+    def write(self, path: str, totals: Dict):
+        """Writes the report as CSV (one row per size bucket) or JSON, by extension."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if path.lower().endswith(".csv"):
+            with open(path, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=self.CSV_FIELDS)
+                writer.writeheader()
+                writer.writerows(self.rows())
+        else:
+            report = {
+                "started_at": self.started_at,
+                "settings": self.settings,
+                "totals": totals,
+                "size_buckets": self.rows(),
+                "top_errors": [
+                    {"message": message, "count": count}
+                    for message, count in self.error_messages.most_common(10)
+                ]
+            }
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+        logging.info(f"Run report written to {path}")
+
+def listing_error(remote_path: str, error: Exception) -> Dict:
+    """Builds the listing chunk that stands in for a listing that failed."""
+    logging.error(f"Listing '{remote_path}' failed: {error}")
+    return {"entries": [], "skipped": 0, "error": f"{remote_path}: {error}"}
+
+async def stream_listing(
     source_path: str,
-    dest_path: str,
-    rclone_config_content: str
-) -> bool:
+    rclone_config_content: str,
+    recursive: bool = False,
+    max_listing_shards: int = DEFAULT_MAX_LISTING_SHARDS,
+    **listing_kwargs
+) -> AsyncIterator[Dict]:
+    """
+    Streams listing chunks for source_path. Non-recursive runs use a single
+    listing container. Recursive runs first list the top-level prefixes and
+    then fan the recursive listing out across one container per prefix (at
+    most max_listing_shards at a time), merging their chunks as they arrive.
+    Paths stay relative to source_path, so directory structure is preserved.
+    A listing that fails yields {"entries": [], "skipped": 0, "error": message}
+    instead of ending early, so the caller can report the run as failed.
+    """
+    if not recursive:
+        try:
+            async for chunk in list_remote_entries.remote_gen.aio(
+                source_path, rclone_config_content, **listing_kwargs
+            ):
+                yield chunk
+        except Exception as e:
+            yield listing_error(source_path, e)
+        return
+
     try:
-        setup_rclone_config(rclone_config_content)
+        top_level = await list_remote_files.remote.aio(source_path, rclone_config_content)
+    except Exception as e:
+        yield listing_error(source_path, e)
+        return
+    prefixes = [name for name in top_level if name.endswith("/")]
+    # One shard for the files directly under source_path, one per top-level directory
+    shards = [(source_path, "", False)] + [
+        (f"{source_path}/{prefix.rstrip('/')}", prefix, True) for prefix in prefixes
+    ]
+    logging.info(f"Sharding recursive listing across {len(shards)} listing containers")
 
-        dest_dir = os.path.dirname(dest_path)
-        os.makedirs(dest_dir, exist_ok=True)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=LISTING_QUEUE_SIZE)
+    shard_limit = asyncio.Semaphore(max_listing_shards)
 
-        # Build the rclone command
-        cmd = [
-            "rclone",
-            "--config", os.path.join(RCLONE_CONFIG_DIR, "rclone.conf"),
-            "copyto",
-            source_path,
-            dest_path,
-            # "--progress",
-            "--buffer-size", "128M",
-            "--retries", "10",
-            "--multi-thread-streams", "8",
-            "--multi-thread-cutoff", "64M"
-        ]
+    async def run_shard(remote_path: str, path_prefix: str, shard_recursive: bool):
+        try:
+            async with shard_limit:
+                async for chunk in list_remote_entries.remote_gen.aio(
+                    remote_path,
+                    rclone_config_content,
+                    recursive=shard_recursive,
+                    path_prefix=path_prefix,
+                    **listing_kwargs
+                ):
+                    await queue.put(chunk)
+            logging.info(f"Listing shard '{path_prefix or '/'}' finished")
+        except Exception as e:
+            # The files under this prefix were never listed, so the run must not pass
+            await queue.put(listing_error(remote_path, e))
+        finally:
+            await queue.put(None)
 
-        logging.info(f"Copying file from '{source_path}' to '{dest_path}'")
-        # Capture rclone output
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-        logging.debug(f"Rclone stdout: {result.stdout}")
-        if result.stderr:
-             logging.warning(f"Rclone stderr: {result.stderr}") # Log stderr as warning
-        logging.info(f"File copied successfully")
+    tasks = [asyncio.create_task(run_shard(*shard)) for shard in shards]
+    remaining = len(tasks)
+    try:
+        while remaining:
+            chunk = await queue.get()
+            if chunk is None:
+                remaining -= 1
+                continue
+            yield chunk
+    finally:
+        for task in tasks:
+            task.cancel()
 
-        # Commit the volume after successful copy
-        volume_storage.commit()
-        logging.info(f"Volume committed after copying {os.path.basename(source_path)}")
+class ProgressTracker:
+    """
+    Aggregates batch results as they complete and reports live progress:
+    files/s, bytes/s, an ETA over the files listed so far, and the slowest
+    batches still in flight.
+    """
 
-        return True
+    def __init__(self, run_report: RunReport = None):
+        self.start_time = time.monotonic()
+        self.run_report = run_report
+        self.listing_done = False
+        self.listed_files = 0
+        self.listed_bytes = 0
+        self.skipped = 0
+        self.listing_failed = 0
+        self.batches = 0
+        self.completed = 0
+        self.failed = 0
+        self.copied_bytes = 0
+        self.failed_bytes = 0
+        self.transfer_seconds = 0.0
+        self.commit_seconds = 0.0
+        self.commits = 0
+        self.in_flight: Dict[int, Dict] = {}
 
-    except Exception as e:
-        logging.error(f"Error copying file: {e}")
-        return False
+    def job_started(self, job: Dict):
+        self.batches += 1
+        self.in_flight[job["number"]] = job
+
+    def job_failed(self, job: Dict, reason: str):
+        self.in_flight.pop(job["number"], None)
+        logging.error(f"[{reason}] Batch {job['number']} ({job['files']} {job['profile']['name']} files)")
+        self.failed += job["files"]
+        self.failed_bytes += job["bytes"]
+
+    def job_finished(self, job: Dict, batch_result: Dict) -> int:
+        """Records a finished batch and returns the number of bytes it copied."""
+        self.in_flight.pop(job["number"], None)
+        self.transfer_seconds += batch_result["transfer_seconds"]
+        self.commit_seconds += batch_result["commit_seconds"]
+        self.commits += batch_result["commits"]
+        batch_bytes = 0
+        for result in batch_result["files"]:
+            if self.run_report:
+                self.run_report.add(result)
+            if result["success"]:
+                logging.debug(f"[SUCCESS] Copied file: {result['path']} (profile {result['profile']['name']})")
+                self.completed += 1
+                batch_bytes += result["size"]
+            else:
+                # Failures surface as soon as their batch returns
+                logging.error(f"[FAILED] Could not copy file: {result['path']}")
+                self.failed += 1
+                self.failed_bytes += result["size"]
+        self.copied_bytes += batch_bytes
+        return batch_bytes
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.start_time, 1e-9)
+        files_rate = self.completed / elapsed
+        bytes_rate = self.copied_bytes / elapsed
+        remaining_bytes = self.listed_bytes - self.copied_bytes - self.failed_bytes
+        eta = f"{remaining_bytes / bytes_rate:.0f}s" if bytes_rate > 0 else "unknown"
+        if not self.listing_done:
+            eta += " (listing still running)"
+        logging.info(
+            f"[PROGRESS] {self.completed + self.failed}/{self.listed_files} files "
+            f"({self.failed} failed), {files_rate:.1f} files/s, "
+            f"{bytes_rate / 1024**2:.1f} MB/s, {len(self.in_flight)} batches in flight, ETA {eta}"
+        )
+        now = time.monotonic()
+        slowest = sorted(self.in_flight.values(), key=lambda job: job["started"])[:PROGRESS_SLOWEST_JOBS]
+        for job in slowest:
+            logging.info(f"    slowest: batch {job['number']} ({job['files']} {job['profile']['name']} files, "
+                         f"{job['bytes'] / 1024**2:.1f} MB) running {now - job['started']:.0f}s")
 
 @app.local_entrypoint()
-def main(
+async def main(
     source_path: str = None,
     dest_subdir: str = None,
-    rclone_config_path: str = None
+    rclone_config_path: str = None,
+    max_batch_files: int = DEFAULT_MAX_BATCH_FILES,
+    max_batch_size: str = DEFAULT_MAX_BATCH_SIZE,
+    listing_chunk_size: int = DEFAULT_LISTING_CHUNK_SIZE,
+    sync_mode: str = "incremental",
+    hash_type: str = "",
+    commit_every_files: int = DEFAULT_COMMIT_EVERY_FILES,
+    commit_every_seconds: float = DEFAULT_COMMIT_EVERY_SECONDS,
+    commit_every_size: str = DEFAULT_COMMIT_EVERY_SIZE,
+    autotune: bool = False,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    progress_interval: float = DEFAULT_PROGRESS_INTERVAL,
+    report_path: str = "",
+    recursive: bool = False,
+    max_listing_shards: int = DEFAULT_MAX_LISTING_SHARDS,
+    small_file_mode: str = "bulk",
+    small_file_threshold: str = DEFAULT_SMALL_FILE_THRESHOLD,
+    small_file_group_size: int = DEFAULT_SMALL_FILE_GROUP_SIZE
 ):
     if not all([source_path, dest_subdir, rclone_config_path]):
         print("Error: source_path, dest_subdir, and rclone_config_path are all required")
         return
+    if sync_mode not in SYNC_MODES:
+        print(f"Error: sync_mode must be one of {', '.join(SYNC_MODES)}")
+        return
+    if small_file_mode not in SMALL_FILE_MODES:
+        print(f"Error: small_file_mode must be one of {', '.join(SMALL_FILE_MODES)}")
+        return
+    try:
+        max_batch_bytes = parse_size(max_batch_size)
+        commit_every_bytes = parse_size(commit_every_size)
+        small_file_bytes = parse_size(small_file_threshold)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
 
     logging.info(f"Starting file copy process from '{source_path}' to volume subdirectory '{dest_subdir}'")
-    start_time = time.monotonic()  # Record start time
     rclone_config_content = get_rclone_config_content(rclone_config_path)
 
     if not rclone_config_content:
         logging.error("Failed to read rclone configuration file")
         return
 
-    files = list_remote_files.remote(source_path, rclone_config_content)
-    logging.info(f"Found {len(files)} files to process")
-    logging.debug(f"Files listed: {files}")
-
-    if not files:
-        logging.warning(f"No files found in '{source_path}'")
-        return
-
     dest_path = f"{VOLUME_MOUNT_PATH}/{dest_subdir}".replace('\\', '/')
     logging.debug(f"Base destination path set to: {dest_path}")
+    manifest_dir = manifest_dir_for(dest_subdir)
+    logging.info(f"Sync mode '{sync_mode}' using manifest at '{manifest_dir}'")
+    commit_policy = {
+        "files": commit_every_files,
+        "seconds": commit_every_seconds,
+        "bytes": commit_every_bytes
+    }
+    tuner = TransferAutoTuner(TRANSFER_PROFILES) if autotune else None
+
+    # (route, transfer profile, copy worker, max files per batch). Small files
+    # go to grouped --files-from workers in bulk mode; everything else is
+    # copied file by file on the worker for its size class.
+    routes = [
+        (profile["name"], profile, COPY_WORKERS[profile["name"]], max_batch_files)
+        for profile in TRANSFER_PROFILES
+    ]
+    if small_file_mode == "bulk":
+        bulk_profile = {**TRANSFER_PROFILES[0], "name": "small-bulk"}
+        routes.insert(0, ("bulk", bulk_profile, copy_small_files, small_file_group_size))
+    run_report = RunReport({
+        "source_path": source_path,
+        "dest_subdir": dest_subdir,
+        "sync_mode": sync_mode,
+        "recursive": recursive,
+        "small_file_mode": small_file_mode,
+        "small_file_threshold": small_file_threshold,
+        "max_batch_files": max_batch_files,
+        "max_batch_size": max_batch_size,
+        "commit_policy": commit_policy,
+        "autotune": autotune,
+        "max_in_flight": max_in_flight
+    }) if report_path else None
+    progress = ProgressTracker(run_report)
+    window = asyncio.Semaphore(max_in_flight)
+    tasks = set()
+
+    async def run_job(job: Dict, call):
+        """Waits for one batch and records its result as soon as it completes."""
+        try:
+            batch_result = await call.get.aio()
+        except TimeoutError:
+            progress.job_failed(job, "TIMEOUT")
+            return
+        except Exception as e:
+            progress.job_failed(job, f"ERROR: {e}")
+            return
+        finally:
+            window.release()
 
-    # Process each file individually using copy_file.spawn() for parallel execution
-    function_calls = []
-    for file_name in files:
-        file_source_path = f"{source_path}/{file_name}"
-        file_dest_path = f"{dest_path}/{file_name}"
+        batch_bytes = progress.job_finished(job, batch_result)
+        if tuner:
+            tuner.record(job["profile"], batch_bytes, batch_result["transfer_seconds"])
 
-        logging.debug(f"  Preparing copy: source='{file_source_path}', dest='{file_dest_path}'")
+    async def report_progress():
+        while True:
+            await asyncio.sleep(progress_interval)
+            progress.report()
 
-        # Spawn a copy_file job for each file (runs in parallel)
-        call = copy_file.spawn(
-            source_path=file_source_path,
-            dest_path=file_dest_path,
-            rclone_config_content=rclone_config_content
-        )
-        logging.debug(f"[SPAWNED] Job {len(function_calls)+1} for file: {file_name}")
-        function_calls.append((file_name, call))
+    if sync_mode != "full":
+        # Compact once up front; listing shards then only read the manifest
+        manifest_entries = await compact_sync_manifest.remote.aio(manifest_dir)
+        logging.info(f"Manifest holds {manifest_entries} entries from earlier runs")
 
-    # Wait for all jobs to complete and collect results
-    logging.info("-" * 60)
-    logging.info(f"SPAWNED {len(function_calls)} COPY JOBS - WAITING FOR COMPLETION")
-    logging.info("-" * 60)
+    reporter = asyncio.create_task(report_progress())
+    try:
+        # Stream the listing in chunks and pack each chunk into size-balanced
+        # batches as it arrives, so copy containers start while the listing is
+        # still running. Files are split by size class first so each batch runs
+        # with one transfer profile on a worker sized for it. Results are
+        # collected in completion order, and listing pauses while max_in_flight
+        # batches are outstanding.
+        async for chunk in stream_listing(
+            source_path,
+            rclone_config_content,
+            recursive=recursive,
+            max_listing_shards=max_listing_shards,
+            chunk_size=listing_chunk_size,
+            manifest_dir=manifest_dir,
+            sync_mode=sync_mode,
+            hash_type=hash_type
+        ):
+            if chunk.get("error"):
+                # Batches already dispatched still run, but the run is reported as failed
+                progress.listing_failed += 1
+                continue
+            progress.listed_files += len(chunk["entries"])
+            progress.listed_bytes += sum(entry["size"] for entry in chunk["entries"])
+            progress.skipped += chunk["skipped"]
+            by_route: Dict[str, List[Dict]] = {}
+            for entry in chunk["entries"]:
+                by_route.setdefault(route_for(entry, small_file_mode, small_file_bytes), []).append(entry)
 
-    # Track job status
-    completed = 0
-    failed = 0
-    pending = len(function_calls)
+            for route, profile, worker, route_batch_files in routes:
+                batches = plan_batches(by_route.get(route, []), max_batch_bytes, route_batch_files)
+                # Spawn a copy job for each batch (runs in parallel)
+                for batch in batches:
+                    await window.acquire()
+                    batch_profile = tuner.choose(profile) if tuner else profile
+                    job = {
+                        "number": progress.batches + 1,
+                        "files": len(batch),
+                        "bytes": sum(entry["size"] for entry in batch),
+                        "profile": batch_profile,
+                        "started": time.monotonic()
+                    }
+                    try:
+                        call = await worker.spawn.aio(
+                            batch=batch,
+                            source_path=source_path,
+                            dest_path=dest_path,
+                            rclone_config_content=rclone_config_content,
+                            manifest_dir=manifest_dir,
+                            commit_policy=commit_policy,
+                            profile=batch_profile
+                        )
+                    except Exception as e:
+                        window.release()
+                        progress.batches += 1
+                        progress.job_failed(job, f"SPAWN FAILED: {e}")
+                        continue
+                    progress.job_started(job)
+                    logging.debug(f"[SPAWNED] Batch {job['number']}: {job['files']} {profile['name']} files, "
+                                  f"{job['bytes']} bytes, {batch_profile['multi_thread_streams']} streams")
+                    task = asyncio.create_task(run_job(job, call))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
 
-    # Process results with timeout handling
-    for file_name, call in function_calls:
-        try:
-            success = call.get()
-            if success:
-                logging.info(f"[SUCCESS] Copied file: {file_name}")
-                completed += 1
+            logging.info(f"Listed {progress.listed_files + progress.skipped} files so far "
+                         f"({progress.skipped} unchanged); dispatched {progress.batches} batches")
+
+        progress.listing_done = True
+        logging.info(f"Found {progress.listed_files} files to process, "
+                     f"{progress.skipped} unchanged since the last sync")
+        if not progress.listed_files and not progress.listing_failed:
+            if progress.skipped:
+                logging.info("Volume is already up to date")
             else:
-                logging.error(f"[FAILED] Could not copy file: {file_name}")
-                failed += 1
+                logging.warning(f"No files found in '{source_path}'")
+            return
 
-        except TimeoutError:
-            logging.error(f"[TIMEOUT] Waiting for file: {file_name}")
-            failed += 1
-        except Exception as e:
-            logging.error(f"[ERROR] Processing file {file_name}: {e}")
-            failed += 1
+        # Wait for the remaining jobs to complete
+        logging.info("-" * 60)
+        logging.info(f"SPAWNED {progress.batches} BATCH COPY JOBS - WAITING FOR COMPLETION")
+        logging.info("-" * 60)
+        while tasks:
+            await asyncio.gather(*list(tasks))
+    finally:
+        reporter.cancel()
 
     # Log summary
-    end_time = time.monotonic()  # Record end time
-    duration = end_time - start_time
-    pending = len(function_calls) - (completed + failed)
+    duration = time.monotonic() - progress.start_time
+    pending = progress.listed_files - (progress.completed + progress.failed)
 
     # Print a clear summary table
     logging.info("-" * 60)
     logging.info(f"SUMMARY OF FILE TRANSFER OPERATIONS:")
-    logging.info(f"  Total files:     {len(function_calls)}")
-    logging.info(f"  Successful:      {completed}")
-    logging.info(f"  Failed:          {failed}")
+    logging.info(f"  Total files:     {progress.listed_files}")
+    logging.info(f"  Unchanged:       {progress.skipped}")
+    logging.info(f"  Batches:         {progress.batches}")
+    logging.info(f"  Successful:      {progress.completed}")
+    logging.info(f"  Failed:          {progress.failed}")
     logging.info(f"  Pending:         {pending}")
+    logging.info(f"  Listing failed:  {progress.listing_failed}")
     logging.info(f"  Total time:      {duration:.2f} seconds") # Log duration
+    # Worker times are summed across containers, so they can exceed the wall time
+    logging.info(f"  Transfer time:   {progress.transfer_seconds:.2f} seconds (summed across workers)")
+    logging.info(f"  Commit time:     {progress.commit_seconds:.2f} seconds over {progress.commits} commits")
+    if duration > 0:
+        logging.info(f"  Throughput:      {progress.completed / duration:.2f} files/s, "
+                     f"{progress.copied_bytes / duration / 1024**3:.3f} GB/s")
     logging.info("-" * 60)
 
-    if failed == 0 and pending == 0:
+    if run_report:
+        run_report.write(report_path, {
+            "files": progress.listed_files,
+            "unchanged": progress.skipped,
+            "batches": progress.batches,
+            "successful": progress.completed,
+            "failed": progress.failed,
+            "pending": pending,
+            "listing_failed": progress.listing_failed,
+            "bytes": progress.copied_bytes,
+            "duration_seconds": round(duration, 3),
+            "transfer_seconds": round(progress.transfer_seconds, 3),
+            "commit_seconds": round(progress.commit_seconds, 3),
+            "commits": progress.commits
+        })
+
+    if progress.listing_failed:
+        logging.error(f"Listing failed {progress.listing_failed} time(s); files that were not listed were not copied")
+    elif progress.failed == 0 and pending == 0:
         logging.info("All files processed successfully")
     else:
         logging.error("Some files failed to copy, are still pending, or volume commit failed")
@@ -2,10 +2,17 @@
 
 import os
 import subprocess
-import time
+import threading
 import logging
 import modal
 
+from process_supervisor import ProcessSupervisor
+from volume_commit import VolumeCommitDaemon
+from workspace_cache import CACHE_ROOT, RECENT_PROJECTS_FILE, WriteBackCache
+from service_startup import (
+    ServiceGraph, add_remote_desktop_services, log_access, restart_tailscale, restart_vnc, vnc_pid
+)
+
 # --- Configuration ---
 APP_NAME = "RemoteWorkspace"
 NFS_NAME = "remote-nfs"
@@ -21,11 +28,30 @@ DEBIAN_PACKAGES = [
     "dbus", "x11-xserver-utils", "dbus-x11", "xfce4", "tightvncserver",
     "libgl1", "xfonts-base", "software-properties-common", "build-essential",
     "apt-utils", "ca-certificates", "kmod", "tk",
-    "firefox-esr"
+    "firefox-esr", "inotify-tools"
 ]
 CPU_REQUEST = 8
 MEMORY_REQUEST_MB = 8096
 TIMEOUT_SECONDS = 24 * 60 * 60
+VNC_PASSWORD = "modal"
+VNC_DISPLAY = "1"
+VNC_RESOLUTION = "1920x1080"
+VNC_DEPTH = "24"
+TAILSCALE_HOSTNAME = f"{APP_NAME}-container"
+TAILSCALE_STATE_DIR = "/var/lib/tailscale/tailscaled.state"
+PROCESS_SAMPLE_INTERVAL = 30  # seconds between CPU/RSS samples of the supervised processes
+# Volume commit daemon: commit once writes under the volume have been quiet
+# for COMMIT_QUIET_SECONDS, as soon as COMMIT_DIRTY_BYTES are pending, or
+# when changes have been pending for COMMIT_MAX_DIRTY_SECONDS regardless
+COMMIT_QUIET_SECONDS = 30
+COMMIT_DIRTY_BYTES = 512 * 1024 * 1024
+COMMIT_MAX_DIRTY_SECONDS = 15 * 60
+COMMIT_FALLBACK_SECONDS = 5 * 60  # periodic commits if inotifywait is unavailable
+# Opt-in local-disk write-back cache for both mounts (see workspace_cache.py).
+# Projects are hydrated into CACHE_ROOT when a shell enters them there, or with:
+#   python /root/workspace_cache.py hydrate volume/<project>
+WRITE_BACK_CACHE = False
+CACHE_BUDGET_BYTES = 50 * 1024**3
 
 # --- Logging Setup ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -36,6 +62,7 @@ image = (
     .apt_install(*DEBIAN_PACKAGES)
     .run_commands("curl -fsSL https://tailscale.com/install.sh | sh")
     .pip_install("fastapi[standard]")
+    .add_local_python_source("service_startup", "process_supervisor", "volume_commit", "workspace_cache", "bench_workspace_cache")
 )
 
 # --- Modal App Definition ---
@@ -48,80 +75,11 @@ tailscale_secret = modal.Secret.from_name(TAILSCALE_SECRET)
 volume_storage = modal.Volume.from_name(VOLUME_NAME, create_if_missing=True)
 
 # --- Helper Functions ---
-def start_tailscale_and_get_ip() -> str:
-    """Starts the Tailscale daemon, brings up the connection using the auth key,
-       enables SSH, and returns the Tailscale IPv4 address."""
-    try:
-        logging.info("Starting tailscaled daemon...")
-        with open("/tmp/tailscaled.log", "w") as log_file:
-            subprocess.Popen(
-                ["tailscaled", "--tun=userspace-networking", "--statedir=/var/lib/tailscale/tailscaled.state"],
-                stdout=log_file,
-                stderr=subprocess.STDOUT,
-            )
-        time.sleep(5)
-        logging.info("tailscaled started.")
-
-        ts_authkey = os.environ.get(TAILSCALE_AUTHKEY_ENV_VAR)
-        if not ts_authkey:
-            logging.error(f"'{TAILSCALE_AUTHKEY_ENV_VAR}' not found in environment variables. Make sure the '{TAILSCALE_SECRET}' secret is configured correctly.")
-            return ""
-
-        logging.info("Running tailscale up...")
-        subprocess.run(
-            ["tailscale", "up", "--authkey", ts_authkey, "--ssh", "--hostname", f"{APP_NAME}-container"], # Use a more specific hostname
-            check=True,
-            capture_output=True
-        )
-        logging.info("Tailscale up successful.")
-
-        result = subprocess.run(["tailscale", "ip", "-4"], check=True, capture_output=True, text=True)
-        tailscale_ip = result.stdout.strip()
-        if tailscale_ip:
-            logging.info(f"Tailscale IPv4 address: {tailscale_ip}")
-            return tailscale_ip
-        else:
-            logging.error("Could not retrieve Tailscale IPv4 address.")
-            return ""
-
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Tailscale command failed: {e}")
-        logging.error(f"Stdout: {e.stdout}")
-        logging.error(f"Stderr: {e.stderr}")
-        return ""
-    except Exception as e:
-        logging.error(f"An error occurred during Tailscale setup: {e}")
-        return ""
-
-def setup_and_start_vnc(password: str, display: str, resolution: str, depth: str, tailscale_ip: str):
-    """Sets up and starts a VNC server."""
-    try:
-        os.environ["USER"] = "root"
-        os.system("mkdir -p /run/dbus")
-        os.system("dbus-daemon --system")
-        os.system("dbus-daemon --session --fork")
-
-        vnc_password_file = f"/root/.vnc/passwd"
-        os.system(f"mkdir -p /root/.vnc && echo '{password}'| vncpasswd -f > {vnc_password_file}")
-        os.chmod(vnc_password_file, 0o600)
-        
-        with open("vncserver.log", "w") as vnc_log:
-            subprocess.Popen(
-                ["vncserver", f":{display}", "-geometry", resolution, "-depth", depth],
-                stdout=vnc_log,
-                stderr=subprocess.STDOUT,
-            )
-        logging.info(f"VNC Server running on display :{display} at resolution {resolution}")
-        logging.info(f"Use the following SSH command for VNC access:\nssh -L 590{display}:localhost:590{display} root@{tailscale_ip}")
-
-    except Exception as e:
-        logging.error(f"VNC Setup failed: {e}")
-
 def graceful_exit():
     """ Stops the services and waits for the changes to the volumes to sync."""
     logging.info("Shutting down VNC Server...")
     try:
-        subprocess.run(["vncserver", "-kill", ":1"], check=True, capture_output=True)
+        subprocess.run(["vncserver", "-kill", f":{VNC_DISPLAY}"], check=True, capture_output=True)
         logging.info("VNC Server shut down successfully.")
     except Exception as e:
         logging.error(f"Error shutting down VNC Server: {e}")
@@ -145,35 +103,88 @@ def graceful_exit():
     max_containers=1,
     scaledown_window=None,
 )
+@modal.concurrent(max_inputs=10) # status() and commit_volume() run alongside keep_alive()
 class RemoteWorkspace:
     @modal.enter()
     def start_services(self):
         """
         This method runs automatically when the container starts.
-        It sets up Tailscale and enters the keep-alive loop.
+        It starts dbus/VNC and Tailscale concurrently and returns once they are ready.
         """
         logging.info("Container entered. Starting services...")
-
-        tailscale_ip = start_tailscale_and_get_ip()
+        self.shutdown_lock = threading.Lock()
+        self.shut_down = False
+
+        self.services = add_remote_desktop_services(
+            ServiceGraph(),
+            TAILSCALE_AUTHKEY_ENV_VAR,
+            VNC_PASSWORD, VNC_DISPLAY, VNC_RESOLUTION, VNC_DEPTH,
+            hostname=TAILSCALE_HOSTNAME, # Use a more specific hostname
+            tailscale_state_dir=TAILSCALE_STATE_DIR,
+        )
+        self.services.run()
+        self.start_supervisor()
+        self.commit_daemon = VolumeCommitDaemon(
+            VOLUME_MOUNT_PATH,
+            volume_storage.commit,
+            quiet_seconds=COMMIT_QUIET_SECONDS,
+            dirty_bytes=COMMIT_DIRTY_BYTES,
+            max_dirty_seconds=COMMIT_MAX_DIRTY_SECONDS,
+            fallback_seconds=COMMIT_FALLBACK_SECONDS,
+        ).start()
+        self.cache = None
+        if WRITE_BACK_CACHE:
+            self.cache = WriteBackCache(
+                {"volume": VOLUME_MOUNT_PATH, "nfs": NFS_MOUNT_PATH},
+                budget_bytes=CACHE_BUDGET_BYTES,
+                recent_file=os.path.join(VOLUME_MOUNT_PATH, RECENT_PROJECTS_FILE),
+            ).start()
 
         # Log connection details
         logging.info("---------------------------------------------------------")
-        if tailscale_ip:
-            logging.info(f" SSH Access (via Tailscale): ssh root@{tailscale_ip}")
-        else:
-            logging.error(" Tailscale failed. SSH access via Tailscale IP unavailable.")
+        log_access(self.services, VNC_DISPLAY)
         logging.info(f" NFS Storage mounted at: {NFS_MOUNT_PATH}") # Path updated via constant
         logging.info(f" Volume Storage mounted at: {VOLUME_MOUNT_PATH}") # Path updated
+        if self.cache:
+            logging.info(f" Write-back cache at: {CACHE_ROOT}")
         logging.info(" Container will run for up to 24 hours.")
         logging.info(" Use 'modal app stop downloader-app' to stop manually.")
         logging.info("---------------------------------------------------------")
-        setup_and_start_vnc("modal", "1", "1920x1080", "24", tailscale_ip)
+
+    def start_supervisor(self):
+        """Restarts tailscaled and VNC if they die; without tailscaled the workspace is unreachable."""
+        self.supervisor = ProcessSupervisor(sample_interval=PROCESS_SAMPLE_INTERVAL).start()
+        if "tailscale" in self.services.results:
+            self.supervisor.watch(
+                "tailscaled",
+                lambda: restart_tailscale(TAILSCALE_AUTHKEY_ENV_VAR, TAILSCALE_HOSTNAME, TAILSCALE_STATE_DIR),
+                process=self.services.started["tailscaled"],
+                critical=True,
+            )
+        if "vnc" in self.services.results:
+            self.supervisor.watch(
+                "vnc",
+                lambda: restart_vnc(VNC_PASSWORD, VNC_DISPLAY, VNC_RESOLUTION, VNC_DEPTH),
+                process=vnc_pid(VNC_DISPLAY),
+            )
 
     @modal.method()
     def keep_alive(self):
-        # Sleep indefinitely to keep the container alive.
-        while True:
-            time.sleep(1)
+        # Blocks until the container stops or a critical service can no longer be restarted
+        final_status = self.supervisor.wait()
+        if self.supervisor.stopping:
+            # Woken by shutdown(); the container is already on its way out
+            return final_status
+        logging.error(f"A critical service can no longer be restarted, stopping the container: {final_status}")
+        self.shutdown()
+        # min_containers=1 would otherwise keep the unreachable container
+        # running; exiting the process is what makes Modal tear it down
+        os._exit(1)
+
+    @modal.method()
+    def status(self):
+        """Returns the state, restarts, CPU and RSS of every supervised process."""
+        return self.supervisor.status()
 
     @modal.method()
     def commit_volume(self):
@@ -182,16 +193,41 @@ class RemoteWorkspace:
         It commits the volume and returns a success message.
         """
         logging.info("Committing changes to the volume...")
-        volume_storage.commit()
+        self.commit_daemon.commit_now()
         logging.info("Volume changes committed successfully.")
 
+    @modal.method()
+    def commit_metrics(self):
+        """Returns commit counts, latencies and what is still waiting to be committed."""
+        return self.commit_daemon.metrics()
+
+    @modal.method()
+    def cache_status(self):
+        """Returns the hydrated projects, pending flushes and cache counters."""
+        return self.cache.status() if self.cache else {"enabled": False}
+
     @modal.exit()
     def stop_services(self):
         """
         This method runs when the container is about to exit.
         """
+        self.shutdown()
+
+    def shutdown(self):
+        """Stops the services and commits the volume, once."""
+        with self.shutdown_lock:
+            if self.shut_down:
+                return
+            self.shut_down = True
         logging.info("Container exiting. Stopping services...")
+        # Stop restarts first so the shutdown below is not undone
+        self.supervisor.stop(terminate=False)
         graceful_exit()
+        if self.cache:
+            # Flushed to the mounts first, so the final commit below includes it
+            self.cache.stop()
+        self.commit_daemon.stop()
+        logging.info(f"Volume commit metrics: {self.commit_daemon.metrics()}")
 
 @app.local_entrypoint()
 def main():
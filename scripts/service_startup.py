@@ -0,0 +1,318 @@
+# scripts/service_startup.py
+#
+# Shared container service startup for remote_workspace.py and
+# modal_onetrainer_tailscale_gpu_configurable.py. Services are declared as a
+# dependency graph: each one starts as soon as the services it depends on are
+# ready, independent ones start concurrently, and readiness is polled with
+# probes instead of fixed sleeps. Every service gets a timeline entry so slow
+# startups can be traced to the service that caused them.
+
+import logging
+import os
+import socket
+import subprocess
+import threading
+import time
+
+TAILSCALED_SOCKET = "/var/run/tailscale/tailscaled.sock"
+DBUS_SYSTEM_SOCKET = "/run/dbus/system_bus_socket"
+DEFAULT_READY_TIMEOUT = 60
+DEFAULT_POLL_INTERVAL = 0.1
+
+
+# --- Processes ---
+def stop_process(process: subprocess.Popen, timeout: float = 10):
+    """Terminates a process, killing it if it has not exited after timeout seconds."""
+    if process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+# --- Readiness probes ---
+def wait_until(probe, timeout=DEFAULT_READY_TIMEOUT, interval=DEFAULT_POLL_INTERVAL):
+    """Calls probe until it returns something truthy and returns that. Raises TimeoutError."""
+    deadline = time.monotonic() + timeout
+    while True:
+        value = probe()
+        if value:
+            return value
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Not ready after {timeout}s")
+        time.sleep(interval)
+
+
+def port_open(port: int, host: str = "127.0.0.1"):
+    """Probe that succeeds once something accepts connections on host:port."""
+    def probe():
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return True
+        except OSError:
+            return False
+    return probe
+
+
+def path_exists(path: str):
+    return lambda: os.path.exists(path)
+
+
+def command_output(command):
+    """Probe that succeeds with the command's stripped stdout once it exits 0 with output."""
+    def probe():
+        result = subprocess.run(command, capture_output=True, text=True)
+        return result.stdout.strip() if result.returncode == 0 else ""
+    return probe
+
+
+def process_alive(process, probe):
+    """Wraps a probe so it fails fast when the process it waits for has exited."""
+    def wrapped():
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"{process.args[0]} exited with code {process.returncode}")
+        return probe()
+    return wrapped
+
+
+# --- Dependency graph ---
+class Service:
+    def __init__(self, name, start, ready=None, depends_on=(), timeout=DEFAULT_READY_TIMEOUT):
+        self.name = name
+        self.start = start
+        self.ready = ready
+        self.depends_on = list(depends_on)
+        self.timeout = timeout
+
+
+class ServiceGraph:
+    """
+    Starts services once their dependencies are ready.
+
+    start(started) is called with the dict of values started so far and may
+    return a value (e.g. the Popen it launched). ready(started_value) returns
+    a probe; the first truthy probe result becomes the service's result. A
+    service whose start or probe fails is logged, and everything depending on
+    it is skipped while unrelated services carry on. A Popen it launched is
+    stopped and dropped from started, so nothing is left running unowned.
+    """
+
+    def __init__(self):
+        self.services = {}
+        self.started = {}
+        self.results = {}
+        self.timeline = []
+        self.origin = None
+        self.lock = threading.Lock()
+
+    def add(self, name, start, ready=None, depends_on=(), timeout=DEFAULT_READY_TIMEOUT):
+        for dependency in depends_on:
+            if dependency not in self.services:
+                raise ValueError(f"Service '{name}' depends on unknown service '{dependency}'")
+        self.services[name] = Service(name, start, ready, depends_on, timeout)
+        return self
+
+    def run(self):
+        """Starts every service and blocks until each is ready, failed or skipped."""
+        self.origin = time.monotonic()
+        done = {name: threading.Event() for name in self.services}
+        ok = {}
+
+        def run_service(service):
+            for dependency in service.depends_on:
+                done[dependency].wait()
+            entry = {"service": service.name, "waited_for_deps": self.elapsed()}
+            try:
+                failed = [d for d in service.depends_on if not ok[d]]
+                if failed:
+                    entry["status"] = f"skipped ({', '.join(failed)} failed)"
+                    ok[service.name] = False
+                    return
+                start = time.monotonic()
+                value = service.start(self.started)
+                with self.lock:
+                    self.started[service.name] = value
+                entry["start_seconds"] = round(time.monotonic() - start, 3)
+                result = value
+                if service.ready is not None:
+                    probe = process_alive(value if isinstance(value, subprocess.Popen) else None, service.ready(value))
+                    result = wait_until(probe, service.timeout)
+                with self.lock:
+                    self.results[service.name] = result
+                entry["status"] = "ready"
+                ok[service.name] = True
+            except Exception as e:
+                logging.error(f"Service '{service.name}' failed to start: {e}")
+                entry["status"] = f"failed ({e})"
+                ok[service.name] = False
+                with self.lock:
+                    value = self.started.pop(service.name, None)
+                if isinstance(value, subprocess.Popen):
+                    stop_process(value)
+            finally:
+                entry["ready_at"] = self.elapsed()
+                with self.lock:
+                    self.timeline.append(entry)
+                done[service.name].set()
+
+        threads = [
+            threading.Thread(target=run_service, args=(service,), name=f"start-{name}", daemon=True)
+            for name, service in self.services.items()
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.log_timeline()
+        return self.results
+
+    def elapsed(self):
+        return round(time.monotonic() - self.origin, 3)
+
+    def ready_at(self, name):
+        for entry in self.timeline:
+            if entry["service"] == name and entry["status"] == "ready":
+                return entry["ready_at"]
+        return None
+
+    def log_timeline(self):
+        logging.info("Service startup timeline:")
+        for entry in sorted(self.timeline, key=lambda e: e["ready_at"]):
+            logging.info(
+                f"  {entry['service']:<12} deps ready {entry['waited_for_deps']:>6.2f}s, "
+                f"start {entry.get('start_seconds', 0):>6.2f}s, done {entry['ready_at']:>6.2f}s: {entry['status']}"
+            )
+
+
+# --- Services shared by the workspace containers ---
+def start_dbus(started=None):
+    os.environ["USER"] = "root"
+    os.makedirs("/run/dbus", exist_ok=True)
+    # Either may already be running; readiness is judged by the system socket
+    subprocess.run(["dbus-daemon", "--system"], capture_output=True)
+    subprocess.run(["dbus-daemon", "--session", "--fork"], capture_output=True)
+
+
+def start_tailscaled(state_dir: str = None, log_path: str = "/tmp/tailscaled.log"):
+    command = ["tailscaled", "--tun=userspace-networking"]
+    if state_dir:
+        command.append(f"--statedir={state_dir}")
+    with open(log_path, "w") as log_file:
+        return subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT)
+
+
+def tailscale_up(authkey_env_var: str, hostname: str = None):
+    """Brings the node up with SSH enabled. Its readiness is a Tailscale IPv4 address."""
+    ts_authkey = os.environ.get(authkey_env_var)
+    if not ts_authkey:
+        raise ValueError(f"'{authkey_env_var}' not found in environment variables.")
+    command = ["tailscale", "up", "--authkey", ts_authkey, "--ssh"]
+    if hostname:
+        command += ["--hostname", hostname]
+    try:
+        subprocess.run(command, check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"tailscale up failed: {e.stderr.strip()}") from e
+
+
+def start_vnc(password: str, display: str, resolution: str, depth: str, log_path: str = "vncserver.log"):
+    os.environ["USER"] = "root"
+    vnc_password_file = "/root/.vnc/passwd"
+    os.makedirs("/root/.vnc", exist_ok=True)
+    hashed = subprocess.run(["vncpasswd", "-f"], input=f"{password}\n".encode(), check=True, capture_output=True)
+    with open(vnc_password_file, "wb") as f:
+        f.write(hashed.stdout)
+    os.chmod(vnc_password_file, 0o600)
+    with open(log_path, "w") as vnc_log:
+        # vncserver forks Xvnc and exits, so readiness is the port, not the process
+        subprocess.Popen(
+            ["vncserver", f":{display}", "-geometry", resolution, "-depth", depth],
+            stdout=vnc_log,
+            stderr=subprocess.STDOUT,
+        )
+
+
+def vnc_port(display: str) -> int:
+    return 5900 + int(display)
+
+
+def add_remote_desktop_services(
+    graph: ServiceGraph,
+    authkey_env_var: str,
+    vnc_password: str,
+    vnc_display: str,
+    vnc_resolution: str,
+    vnc_depth: str,
+    hostname: str = None,
+    tailscale_state_dir: str = None,
+) -> ServiceGraph:
+    """
+    Adds dbus, tailscaled, tailscale (up + IP) and VNC to the graph. tailscaled
+    and dbus start together; tailscale waits on the tailscaled socket and VNC
+    on dbus. The "tailscale" result is the node's IPv4 address.
+    """
+    graph.add("dbus", start_dbus, ready=lambda _: path_exists(DBUS_SYSTEM_SOCKET))
+    graph.add(
+        "tailscaled",
+        lambda started: start_tailscaled(tailscale_state_dir),
+        ready=lambda _: path_exists(TAILSCALED_SOCKET),
+    )
+    graph.add(
+        "tailscale",
+        lambda started: tailscale_up(authkey_env_var, hostname),
+        ready=lambda _: command_output(["tailscale", "ip", "-4"]),
+        depends_on=["tailscaled"],
+    )
+    graph.add(
+        "vnc",
+        lambda started: start_vnc(vnc_password, vnc_display, vnc_resolution, vnc_depth),
+        ready=lambda _: port_open(vnc_port(vnc_display)),
+        depends_on=["dbus"],
+    )
+    return graph
+
+
+def vnc_pid(display: str) -> int:
+    """Pid of the Xvnc server vncserver forked for a display, from its pid file."""
+    import glob
+
+    for pid_file in glob.glob(f"/root/.vnc/*:{display}.pid"):
+        with open(pid_file) as f:
+            return int(f.read().strip())
+    raise FileNotFoundError(f"No VNC pid file for display :{display}")
+
+
+# --- Restarts for ProcessSupervisor, each returns what the supervisor should watch ---
+def restart_tailscale(authkey_env_var: str, hostname: str = None, state_dir: str = None):
+    process = start_tailscaled(state_dir)
+    try:
+        wait_until(process_alive(process, path_exists(TAILSCALED_SOCKET)))
+        tailscale_up(authkey_env_var, hostname)
+    except BaseException:
+        # Otherwise every backoff retry would leave another tailscaled behind
+        stop_process(process)
+        raise
+    return process
+
+
+def restart_vnc(password: str, display: str, resolution: str, depth: str) -> int:
+    # Clears the stale lock and pid files the crashed server left behind
+    subprocess.run(["vncserver", "-kill", f":{display}"], capture_output=True)
+    start_vnc(password, display, resolution, depth)
+    wait_until(port_open(vnc_port(display)))
+    return vnc_pid(display)
+
+
+def log_access(graph: ServiceGraph, vnc_display: str):
+    """Logs how to reach the container and how long SSH and VNC took to come up."""
+    tailscale_ip = graph.results.get("tailscale", "")
+    if tailscale_ip:
+        logging.info(f"SSH Access (via Tailscale): ssh root@{tailscale_ip} (ready after {graph.ready_at('tailscale'):.2f}s)")
+    else:
+        logging.error("Tailscale failed. SSH access via Tailscale IP unavailable.")
+    if "vnc" in graph.results:
+        logging.info(f"VNC Server running on display :{vnc_display} (ready after {graph.ready_at('vnc'):.2f}s)")
+        logging.info(f"Use the following SSH command for VNC access:\nssh -L {vnc_port(vnc_display)}:localhost:{vnc_port(vnc_display)} root@{tailscale_ip}")
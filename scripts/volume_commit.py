@@ -0,0 +1,202 @@
+# scripts/volume_commit.py
+#
+# Commit daemon for the RemoteWorkspace volume. Instead of committing on a
+# fixed interval, it tracks which files under the mount changed (through
+# inotifywait) and commits once writes have gone quiet, once enough bytes are
+# pending, or once changes have waited too long, and records how long each
+# commit took.
+
+import logging
+import os
+import subprocess
+import threading
+import time
+
+DEFAULT_QUIET_SECONDS = 30  # commit once writes have been quiet this long
+DEFAULT_DIRTY_BYTES = 512 * 1024 * 1024  # or as soon as this much is pending
+DEFAULT_MAX_DIRTY_SECONDS = 15 * 60  # or when changes have been pending this long regardless
+DEFAULT_FALLBACK_SECONDS = 5 * 60  # commit interval when inotifywait is not available
+LATENCY_HISTORY = 100  # commits kept for the latency percentiles
+
+
+class VolumeCommitDaemon:
+    """
+    Commits the volume when it has uncommitted changes and a good moment comes.
+
+    inotifywait reports writes, creates, deletes and moves under the mount;
+    each changed path is tracked with its size, so the daemon knows how many
+    files and bytes are pending. If inotifywait cannot run or exits (e.g. on
+    hitting fs.inotify.max_user_watches), the daemon falls back to committing
+    every fallback_seconds. handle_event() can be fed directly, which keeps
+    the trigger logic testable without inotify or a volume.
+    """
+
+    def __init__(
+        self,
+        path,
+        commit,
+        quiet_seconds=DEFAULT_QUIET_SECONDS,
+        dirty_bytes=DEFAULT_DIRTY_BYTES,
+        max_dirty_seconds=DEFAULT_MAX_DIRTY_SECONDS,
+        fallback_seconds=DEFAULT_FALLBACK_SECONDS,
+    ):
+        self.path = path
+        self.commit = commit
+        self.quiet_seconds = quiet_seconds
+        self.dirty_bytes_threshold = dirty_bytes
+        self.max_dirty_seconds = max_dirty_seconds
+        self.fallback_seconds = fallback_seconds
+        self.dirty = {}  # path -> size in bytes when it last changed
+        self.first_dirty_at = None
+        self.last_event_at = None
+        self.lock = threading.Lock()
+        self.commit_lock = threading.Lock()
+        self.changed = threading.Event()
+        self.stopped = threading.Event()
+        self.watcher = None
+        self.watching = True  # False once inotifywait is gone and commits are periodic
+        self.latencies = []
+        self.stats = {"commits": 0, "failed_commits": 0, "committed_files": 0, "committed_bytes": 0}
+
+    def handle_event(self, events, path):
+        """Records an inotify event (comma separated names, e.g. 'CLOSE_WRITE,CLOSE')."""
+        now = time.monotonic()
+        size = 0
+        if not set(events.split(",")) & {"DELETE", "MOVED_FROM", "ISDIR"}:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                pass
+        with self.lock:
+            self.dirty[path] = size
+            self.last_event_at = now
+            if self.first_dirty_at is None:
+                self.first_dirty_at = now
+        self.changed.set()
+
+    def pending_bytes(self):
+        with self.lock:
+            return sum(self.dirty.values())
+
+    def commit_reason(self, now):
+        """Why a commit is due now, or None."""
+        with self.lock:
+            if not self.dirty:
+                return None
+            if sum(self.dirty.values()) >= self.dirty_bytes_threshold:
+                return "dirty bytes"
+            if now - self.last_event_at >= self.quiet_seconds:
+                return "quiet"
+            if now - self.first_dirty_at >= self.max_dirty_seconds:
+                return "max dirty age"
+        return None
+
+    def commit_now(self, reason="manual"):
+        """Commits the volume and clears what was pending before the commit started."""
+        with self.commit_lock:
+            with self.lock:
+                pending, self.dirty = self.dirty, {}
+                self.first_dirty_at = None
+            start = time.monotonic()
+            try:
+                self.commit()
+            except Exception as e:
+                logging.error(f"Volume commit failed: {e}")
+                self.stats["failed_commits"] += 1
+                with self.lock:
+                    # Keep the changes pending so the next trigger retries them
+                    self.dirty = {**pending, **self.dirty}
+                    self.first_dirty_at = self.first_dirty_at or start
+                return False
+            latency = time.monotonic() - start
+            self.latencies = (self.latencies + [latency])[-LATENCY_HISTORY:]
+            self.stats["commits"] += 1
+            self.stats["committed_files"] += len(pending)
+            self.stats["committed_bytes"] += sum(pending.values())
+            logging.info(
+                f"Committed volume ({reason}): {len(pending)} files, "
+                f"{sum(pending.values()) / 1024**2:.1f} MB in {latency:.2f}s"
+            )
+            return True
+
+    def watch(self):
+        try:
+            self.watcher = subprocess.Popen(
+                [
+                    "inotifywait", "-m", "-r", "-q", "--format", "%e\t%w%f",
+                    "-e", "close_write", "-e", "create", "-e", "delete", "-e", "moved_to", "-e", "moved_from",
+                    self.path,
+                ],
+                stdout=subprocess.PIPE, text=True,
+            )
+            for line in self.watcher.stdout:
+                events, _, path = line.rstrip("\n").partition("\t")
+                self.handle_event(events, path)
+            reason = f"exited with code {self.watcher.wait()}"
+        except OSError as e:
+            reason = f"could not run: {e}"
+        if not self.stopped.is_set():
+            logging.error(
+                f"inotifywait {reason}; committing every {self.fallback_seconds}s instead "
+                "(raising fs.inotify.max_user_watches may help on large volumes)"
+            )
+            self.watching = False
+            self.changed.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            if not self.watching:
+                # Without events nothing is known to be dirty, so commit on a timer
+                self.commit_now("periodic")
+                self.stopped.wait(self.fallback_seconds)
+                continue
+            reason = self.commit_reason(time.monotonic())
+            if reason:
+                self.commit_now(reason)
+                continue
+            # Sleep until the next event or the earliest moment a trigger could fire
+            self.changed.clear()
+            with self.lock:
+                wait = None
+                if self.dirty:
+                    now = time.monotonic()
+                    wait = max(0.0, min(
+                        self.last_event_at + self.quiet_seconds - now,
+                        self.first_dirty_at + self.max_dirty_seconds - now,
+                    ))
+            self.changed.wait(wait)
+
+    def start(self):
+        threading.Thread(target=self.watch, daemon=True, name="commit-watch").start()
+        threading.Thread(target=self.run, daemon=True, name="commit-daemon").start()
+        logging.info(f"Volume commit daemon watching {self.path}")
+        return self
+
+    def stop(self):
+        """Stops watching and commits whatever is still pending."""
+        if self.watcher:
+            self.watcher.terminate()
+        self.stopped.set()
+        self.changed.set()
+        self.commit_now("exit")
+
+    def metrics(self):
+        latencies = sorted(self.latencies)
+        now = time.monotonic()
+        with self.lock:
+            pending_files = len(self.dirty)
+            pending_bytes = sum(self.dirty.values())
+            oldest = now - self.first_dirty_at if self.first_dirty_at else 0.0
+        return {
+            **self.stats,
+            "watching": self.watching,
+            "pending_files": pending_files,
+            "pending_bytes": pending_bytes,
+            "oldest_pending_seconds": round(oldest, 1),
+            "commit_latency_seconds": {
+                "last": round(self.latencies[-1], 3) if latencies else None,
+                "p50": round(latencies[len(latencies) // 2], 3) if latencies else None,
+                "p95": round(latencies[int(len(latencies) * 0.95)], 3) if latencies else None,
+                "max": round(latencies[-1], 3) if latencies else None,
+            },
+        }
@@ -0,0 +1,480 @@
+# scripts/workspace_cache.py
+#
+# Opt-in write-back cache on local container disk for the RemoteWorkspace
+# mounts. Builds and git operations are metadata heavy and slow on a Volume
+# or NetworkFileSystem, so projects (top-level directories of a mount) can be
+# hydrated into CACHE_ROOT/<mount>/<project> on local disk and worked on
+# there. Projects that are not hydrated are symlinks to the mount, so every
+# path under the cache root works from the start.
+#
+# Changes are flushed back with rsync once a project has been quiet for a
+# while, when it is evicted and on exit. Least recently used projects are
+# evicted (flushed, then turned back into symlinks) when the hydrated total
+# goes over the size budget. A hydrated project must be edited through the
+# cache path: a flush mirrors it onto the mount, deletes included.
+#
+# Projects are hydrated on demand: the shell hook installed into .bashrc
+# hydrates a project when an interactive shell enters it under the cache
+# root, and moves shells that were already inside it onto the local copy.
+#
+# Usage inside the container:
+#   python /root/workspace_cache.py hydrate volume/my-project
+#   python /root/workspace_cache.py flush
+#   python /root/workspace_cache.py status
+
+import argparse
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+CACHE_ROOT = "/root/workspace"
+CACHE_BUDGET_BYTES = 50 * 1024**3
+CACHE_FLUSH_QUIET_SECONDS = 10  # a dirty project is flushed after this long without writes
+# Projects recently hydrated by previous containers, most recent first, kept
+# on the volume so the next container can warm them up in the background
+RECENT_PROJECTS_FILE = ".workspace-cache-recent.json"
+RECENT_PROJECTS_KEPT = 20
+CACHE_RESCAN_SECONDS = 60  # flush interval for every hydrated project if inotifywait is unavailable
+SHELL_HOOK_PATH = "/root/.workspace-cache.sh"
+BASHRC_PATH = "/root/.bashrc"
+# Runs before every prompt. When the shell is inside a project under the cache
+# root but physically on the mount (the project is still a symlink, or was
+# hydrated after the shell entered it), the project is hydrated and the shell
+# re-enters the same path, now on local disk. WORKSPACE_CACHE_AUTO=0 turns it off.
+SHELL_HOOK = """\
+_workspace_cache_hook() {{
+    [ "${{WORKSPACE_CACHE_AUTO:-1}}" = 1 ] || return
+    case "$PWD/" in
+        {root}/*/*/) ;;
+        *) return ;;
+    esac
+    case "$(pwd -P)/" in
+        {root}/*) return ;;
+    esac
+    local key="${{PWD#{root}/}}"
+    key="$(echo "$key" | cut -d/ -f1-2)"
+    if [ -L "{root}/$key" ]; then
+        echo "Hydrating $key into the workspace cache..."
+        python {script} --root {root} hydrate "$key" >/dev/null || return
+    fi
+    cd "$PWD" 2>/dev/null
+}}
+case ";$PROMPT_COMMAND;" in
+    *";_workspace_cache_hook;"*) ;;
+    *) PROMPT_COMMAND="_workspace_cache_hook${{PROMPT_COMMAND:+;$PROMPT_COMMAND}}" ;;
+esac
+"""
+
+
+def tree_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def rsync(source: str, target: str, delete: bool = True, update: bool = False):
+    """Mirrors source into target, deletes included unless delete is False."""
+    command = ["rsync", "-a"]
+    if delete:
+        command.append("--delete")
+    if update:
+        # Never replaces a file that is newer in target
+        command.append("--update")
+    subprocess.run(command + [f"{source}/", f"{target}/"], check=True, capture_output=True, text=True)
+
+
+class WriteBackCache:
+    """
+    Cache state lives in an index file next to the cached projects and is
+    only changed under a file lock, so the daemon in the Modal container and
+    the command line in an SSH session can both hydrate and flush. The index
+    lock is only held to read and update the index; the copies themselves
+    run under a file lock per project, so one project's rsync never holds up
+    another project or the event reader.
+    """
+
+    def __init__(self, backings, root=CACHE_ROOT, budget_bytes=CACHE_BUDGET_BYTES, quiet_seconds=CACHE_FLUSH_QUIET_SECONDS, recent_file=None):
+        self.backings = dict(backings)  # mount name -> mount path
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self.quiet_seconds = quiet_seconds
+        self.recent_file = recent_file
+        self.index_path = os.path.join(root, ".cache-index.json")
+        self.lock_path = os.path.join(root, ".cache.lock")
+        self.thread_lock = threading.Lock()  # guards dirty and stats, never held across an rsync
+        self.watcher = None
+        self.stopped = threading.Event()
+        # project key -> monotonic time of its last write, for projects with unflushed changes
+        self.dirty = {}
+        self.stats = {"hydrations": 0, "hydrate_seconds": 0.0, "flushes": 0, "flush_seconds": 0.0, "evictions": 0}
+        os.makedirs(root, exist_ok=True)
+
+    # --- Index ---
+    @staticmethod
+    @contextlib.contextmanager
+    def file_lock(lock_path: str):
+        # flock locks belong to the open file, so threads of one process exclude each other too
+        with open(lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Holds the index lock and yields the index. Keep it short: no copies under it."""
+        with self.file_lock(self.lock_path):
+            yield self.load_index()
+
+    def project_locked(self, key: str):
+        """Serializes hydrating, flushing and evicting one project."""
+        return self.file_lock(f"{self.lock_path}.{key.replace('/', '__')}")
+
+    def load_index(self):
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def save_index(self, index):
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp_path, self.index_path)
+
+    # --- Paths ---
+    def split_key(self, key: str):
+        name, _, project = key.partition("/")
+        if name not in self.backings or not project or "/" in project:
+            raise ValueError(f"Projects are named <mount>/<top-level directory>, one of {sorted(self.backings)}: {key}")
+        return name, project
+
+    def cache_path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def backing_path(self, key: str) -> str:
+        name, project = self.split_key(key)
+        return os.path.join(self.backings[name], project)
+
+    def key_for(self, path: str):
+        """Project key for a path inside the cache root, or None."""
+        relative = os.path.relpath(path, self.root)
+        parts = relative.split(os.sep)
+        if len(parts) < 2 or parts[0] not in self.backings:
+            return None
+        return f"{parts[0]}/{parts[1]}"
+
+    # --- Operations ---
+    def link_unhydrated(self):
+        """Points every top-level entry of each mount that is not hydrated at the mount."""
+        with self.locked() as index:
+            for name, backing in self.backings.items():
+                os.makedirs(os.path.join(self.root, name), exist_ok=True)
+                for entry in os.listdir(backing):
+                    key = f"{name}/{entry}"
+                    path = self.cache_path(key)
+                    if key not in index and not os.path.lexists(path):
+                        os.symlink(os.path.join(backing, entry), path)
+                # Drop links to entries that no longer exist on the mount
+                for entry in os.listdir(os.path.join(self.root, name)):
+                    path = self.cache_path(f"{name}/{entry}")
+                    if os.path.islink(path) and not os.path.exists(path):
+                        os.unlink(path)
+
+    def hydrate(self, key: str):
+        """
+        Copies a project to local disk, replacing its symlink. No-op if
+        already hydrated. The project stays usable through the symlink while
+        it is copied, so whatever was written to the mount meanwhile is
+        reconciled: a second pass catches up the staging copy, and one after
+        the swap picks up files written in the moment between the two
+        without deleting or overwriting anything newer in the cache. Without
+        that, the next flush (which mirrors, deletes included) would remove
+        those writes from the mount.
+        """
+        backing = self.backing_path(key)
+        path = self.cache_path(key)
+        with self.project_locked(key):
+            with self.locked() as index:
+                if key in index:
+                    index[key]["last_access"] = time.time()
+                    self.save_index(index)
+                    return False
+            if not os.path.isdir(backing):
+                raise FileNotFoundError(f"{backing} is not a directory")
+            start = time.monotonic()
+            staging = f"{path}.hydrating"
+            shutil.rmtree(staging, ignore_errors=True)
+            rsync(backing, staging)
+            rsync(backing, staging)  # incremental, only what changed during the first pass
+            if os.path.islink(path):
+                os.unlink(path)
+            os.rename(staging, path)
+            rsync(backing, path, delete=False, update=True)
+            size = tree_size(path)
+            seconds = time.monotonic() - start
+            with self.locked() as index:
+                index[key] = {"bytes": size, "hydrated_at": time.time(), "last_access": time.time()}
+                self.save_index(index)
+        with self.thread_lock:
+            self.stats["hydrations"] += 1
+            self.stats["hydrate_seconds"] += seconds
+        logging.info(f"Hydrated {key} ({size / 1024**2:.1f} MB) in {seconds:.2f}s")
+        self.enforce_budget(keep=key)
+        return True
+
+    def flush(self, key: str):
+        """Writes a hydrated project back to its mount."""
+        with self.project_locked(key):
+            return self.write_back(key)
+
+    def write_back(self, key: str):
+        """flush() for a caller that already holds the project lock."""
+        start = time.monotonic()
+        # Writes made while the rsync runs mark the project dirty again
+        with self.thread_lock:
+            self.dirty.pop(key, None)
+        if key not in self.load_index():
+            return False
+        rsync(self.cache_path(key), self.backing_path(key))
+        size = tree_size(self.cache_path(key))
+        with self.locked() as index:
+            if key in index:
+                index[key]["bytes"] = size
+                index[key]["flushed_at"] = time.time()
+                self.save_index(index)
+        seconds = time.monotonic() - start
+        with self.thread_lock:
+            self.stats["flushes"] += 1
+            self.stats["flush_seconds"] += seconds
+        logging.info(f"Flushed {key} to {self.backing_path(key)} in {seconds:.2f}s")
+        return True
+
+    def flush_all(self):
+        for key in list(self.load_index()):
+            try:
+                self.flush(key)
+            except Exception as e:
+                logging.error(f"Could not flush {key}: {e}")
+
+    def evict(self, key: str):
+        """
+        Flushes a project and turns it back into a symlink to the mount. The
+        local copy is moved aside and the symlink put back before the copy is
+        deleted, so new writes already go to the mount. Files written between
+        the flush and the swap are caught up without deleting or overwriting
+        anything newer on the mount.
+        """
+        path = self.cache_path(key)
+        backing = self.backing_path(key)
+        evicting = f"{path}.evicting"
+        with self.project_locked(key):
+            if not self.write_back(key):
+                return False
+            shutil.rmtree(evicting, ignore_errors=True)
+            os.rename(path, evicting)
+            os.symlink(backing, path)
+            rsync(evicting, backing, delete=False, update=True)
+            shutil.rmtree(evicting)
+            with self.locked() as index:
+                index.pop(key, None)
+                self.save_index(index)
+            with self.thread_lock:
+                self.dirty.pop(key, None)
+                self.stats["evictions"] += 1
+        logging.info(f"Evicted {key} from the workspace cache")
+        return True
+
+    def enforce_budget(self, keep=None):
+        index = self.load_index()
+        total = sum(entry["bytes"] for entry in index.values())
+        for key in sorted(index, key=lambda k: index[k]["last_access"]):
+            if total <= self.budget_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                self.evict(key)
+                total -= index[key]["bytes"]
+            except Exception as e:
+                logging.error(f"Could not evict {key}: {e}")
+
+    # --- Daemon ---
+    def handle_event(self, events: str, path: str):
+        """Marks the project a write happened in as dirty and recently used."""
+        key = self.key_for(path)
+        # Hydration and eviction themselves (the staging copies and their renames) are not changes
+        if key is None or ".hydrating" in path or ".evicting" in path or path == self.cache_path(key):
+            return
+        with self.thread_lock:
+            self.dirty[key] = time.monotonic()
+
+    def watch(self):
+        try:
+            self.watcher = subprocess.Popen(
+                [
+                    "inotifywait", "-m", "-r", "-q", "--format", "%e\t%w%f",
+                    "-e", "close_write", "-e", "create", "-e", "delete", "-e", "moved_to", "-e", "moved_from", "-e", "attrib",
+                    "--exclude", r"\.cache-index\.json|\.cache\.lock",
+                    self.root,
+                ],
+                stdout=subprocess.PIPE, text=True,
+            )
+            for line in self.watcher.stdout:
+                events, _, path = line.rstrip("\n").partition("\t")
+                self.handle_event(events, path)
+            reason = f"exited with code {self.watcher.wait()}"
+        except OSError as e:
+            reason = f"could not run: {e}"
+        if self.stopped.is_set():
+            return
+        # Without events any hydrated project may be dirty, so flush them all periodically
+        logging.error(f"inotifywait {reason}; flushing every hydrated project every {CACHE_RESCAN_SECONDS}s instead")
+        while not self.stopped.wait(CACHE_RESCAN_SECONDS):
+            stale = time.monotonic() - self.quiet_seconds
+            with self.thread_lock:
+                for key in self.load_index():
+                    self.dirty.setdefault(key, stale)
+
+    def run_flusher(self):
+        while not self.stopped.wait(1):
+            now = time.monotonic()
+            with self.thread_lock:
+                quiet = [key for key, last_write in self.dirty.items() if now - last_write >= self.quiet_seconds]
+            for key in quiet:
+                try:
+                    self.flush(key)
+                    with self.locked() as index:
+                        if key in index:
+                            index[key]["last_access"] = time.time()
+                            self.save_index(index)
+                except Exception as e:
+                    logging.error(f"Could not flush {key}: {e}")
+
+    def warm_recent(self):
+        """Hydrates the projects previous containers used, most recent first, within the budget."""
+        if not self.recent_file or not os.path.exists(self.recent_file):
+            return
+        with open(self.recent_file) as f:
+            recent = json.load(f)
+        used = 0
+        for entry in recent:
+            if used + entry["bytes"] > self.budget_bytes:
+                break
+            try:
+                self.hydrate(entry["key"])
+                used += entry["bytes"]
+            except Exception as e:
+                logging.error(f"Could not warm {entry['key']}: {e}")
+
+    def install_shell_hook(self, bashrc=BASHRC_PATH, hook_path=SHELL_HOOK_PATH):
+        """Writes the on-demand hydration hook and sources it from bashrc."""
+        with open(hook_path, "w") as f:
+            f.write(SHELL_HOOK.format(root=self.root, script=os.path.abspath(__file__)))
+        line = f". {hook_path}"
+        existing = ""
+        if os.path.exists(bashrc):
+            with open(bashrc) as f:
+                existing = f.read()
+        if line not in existing.splitlines():
+            with open(bashrc, "a") as f:
+                f.write(f"\n{line}\n")
+
+    def save_recent(self):
+        if not self.recent_file:
+            return
+        index = self.load_index()
+        recent = sorted(index, key=lambda k: index[k]["last_access"], reverse=True)[:RECENT_PROJECTS_KEPT]
+        with open(self.recent_file, "w") as f:
+            json.dump([{"key": key, "bytes": index[key]["bytes"]} for key in recent], f)
+
+    def start(self):
+        # Lets the command line find the mounts without being told
+        with open(os.path.join(self.root, ".cache-mounts.json"), "w") as f:
+            json.dump(self.backings, f)
+        self.link_unhydrated()
+        self.install_shell_hook()
+        threading.Thread(target=self.watch, daemon=True, name="cache-watch").start()
+        threading.Thread(target=self.run_flusher, daemon=True, name="cache-flush").start()
+        threading.Thread(target=self.warm_recent, daemon=True, name="cache-warm").start()
+        logging.info(f"Workspace cache at {self.root} (budget {self.budget_bytes / 1024**3:.1f} GB)")
+        return self
+
+    def stop(self):
+        """Stops watching and flushes every hydrated project."""
+        if self.watcher:
+            self.watcher.terminate()
+        self.stopped.set()
+        self.flush_all()
+        self.save_recent()
+
+    def status(self):
+        index = self.load_index()
+        with self.thread_lock:
+            dirty = sorted(self.dirty)
+        return {
+            "root": self.root,
+            "budget_bytes": self.budget_bytes,
+            "hydrated_bytes": sum(entry["bytes"] for entry in index.values()),
+            "projects": index,
+            "dirty": dirty,
+            **self.stats,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local-disk write-back cache for the workspace mounts")
+    parser.add_argument("--root", default=CACHE_ROOT)
+    parser.add_argument("--backing", action="append", default=[], metavar="NAME=PATH",
+                        help="Mount to cache (repeatable); defaults to the mounts recorded by the container")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    hydrate = subcommands.add_parser("hydrate", help="Copy projects to local disk")
+    hydrate.add_argument("projects", nargs="+", help="<mount>/<project>, e.g. volume/my-repo")
+    flush = subcommands.add_parser("flush", help="Write projects back to their mounts (all by default)")
+    flush.add_argument("projects", nargs="*")
+    evict = subcommands.add_parser("evict", help="Flush projects and drop them from local disk")
+    evict.add_argument("projects", nargs="+")
+    subcommands.add_parser("status")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    backings = dict(b.split("=", 1) for b in args.backing)
+    if not backings:
+        mounts_path = os.path.join(args.root, ".cache-mounts.json")
+        if not os.path.exists(mounts_path):
+            print(f"Error: no --backing given and {mounts_path} does not exist")
+            sys.exit(1)
+        with open(mounts_path) as f:
+            backings = json.load(f)
+    cache = WriteBackCache(backings, root=args.root)
+
+    if args.command == "hydrate":
+        for project in args.projects:
+            cache.hydrate(project)
+            print(f"{project} is at {cache.cache_path(project)}")
+    elif args.command == "flush":
+        for project in args.projects or list(cache.load_index()):
+            cache.flush(project)
+    elif args.command == "evict":
+        for project in args.projects:
+            cache.evict(project)
+    else:
+        print(json.dumps(cache.status(), indent=2))
+
+
+if __name__ == "__main__":
+    main()